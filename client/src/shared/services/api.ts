@@ -94,8 +94,17 @@ export const createBot = async (config: BotConfig) => {
 
 export const listBots = async (): Promise<Bot[]> => {
   try {
-    const response = await axios.get(`${API_BASE_URL}/bots`);
-    return response.data.map((bot: any) => ({
+    // The sidebar doesn't need knowledge item bodies; getBot loads them for the selected bot
+    const bots = [];
+    let cursor: string | undefined;
+    do {
+      const response = await axios.get(`${API_BASE_URL}/bots`, {
+        params: { fields: "id,name,tone,company,knowledge_items,whitelisted_domains", limit: 200, cursor },
+      });
+      bots.push(...response.data);
+      cursor = response.headers["x-next-cursor"];
+    } while (cursor);
+    return bots.map((bot: any) => ({
       ...bot,
       status: "ready",
       primary_color: "#4F46E5",
@@ -117,6 +126,8 @@ export const getBotStatus = async (botId: string): Promise<PollingResponse> => {
   }
 };
 
+export const getBotStatusStreamUrl = (botId: string): string => `${API_BASE_URL}/bot/${botId}/status/stream`;
+
 export const getBot = async (botId: string): Promise<Bot> => {
   try {
     const response = await axios.get(`${API_BASE_URL}/bot/${botId}`);
@@ -1,5 +1,5 @@
 import { Bot } from "./services/api";
-import { getBotStatus } from "./services/api";
+import { getBotStatusStreamUrl } from "./services/api";
 import { useEffect, useState } from "react";
 
 interface PollingResponse {
@@ -15,58 +15,43 @@ interface PollingResponse {
   }[];
 }
 
-const POLLING_INTERVAL = 3000;
-
 const useBotPolling = (botId: string) => {
   const [status, setStatus] = useState<PollingResponse | null>(null);
   const [isPolling, setIsPolling] = useState(false);
 
   useEffect(() => {
-    let isMounted = true;
-
-    const startPolling = async () => {
-      try {
-        setIsPolling(true);
-        while (isMounted) {
-          const response = await getBotStatus(botId);
-          
-          // Check if we should stop polling
-          const hasTerminalStatus = response.pollings.some(polling => 
-            ["ready", "completed", "error"].includes(polling.status.toLowerCase())
-          );
+    if (!botId) {
+      // Clear status when no bot is selected
+      setStatus(null);
+      setIsPolling(false);
+      return;
+    }
 
-          if (hasTerminalStatus) {
-            if (isMounted) {
-              setStatus(response);
-            }
-            break;
-          }
+    // The server pushes a status snapshot whenever training progresses
+    setIsPolling(true);
+    const source = new EventSource(getBotStatusStreamUrl(botId));
 
-          if (isMounted) {
-            setStatus(response);
-          }
+    source.addEventListener("status", (event) => {
+      const response: PollingResponse = JSON.parse((event as MessageEvent).data);
+      setStatus(response);
 
-          await new Promise(resolve => setTimeout(resolve, POLLING_INTERVAL));
-        }
-      } catch (error) {
-        console.error("Error polling bot status:", error);
-      } finally {
-        if (isMounted) {
-          setIsPolling(false);
-        }
+      // Check if we should stop listening
+      const hasTerminalStatus = response.pollings.some(polling =>
+        ["ready", "completed", "error"].includes(polling.status.toLowerCase())
+      );
+      if (hasTerminalStatus) {
+        source.close();
+        setIsPolling(false);
       }
-    };
+    });
 
-    if (botId) {
-      startPolling();
-    } else {
-      // Clear status when no bot is selected
-      setStatus(null);
-      setIsPolling(false);
-    }
+    source.onerror = (error) => {
+      // EventSource reconnects on its own and resumes from the last status it saw
+      console.error("Error streaming bot status:", error);
+    };
 
     return () => {
-      isMounted = false;
+      source.close();
     };
   }, [botId]);
 
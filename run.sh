@@ -12,6 +12,10 @@ cd server
 echo "🚀 Starting Django server..."
 uv run python manage.py runserver &
 
+# Start the background job worker in background
+echo "🚀 Starting job worker..."
+uv run python manage.py run_worker &
+
 # --- Start React Frontend ---
 echo "🔧 Setting up React frontend..."
 
@@ -20,6 +20,18 @@ if USE_S3:
     AWS_S3_OBJECT_PARAMETERS = {
         "CacheControl": "max-age=86400",
     }
+    # An S3-compatible service instead of AWS, e.g. http://localhost:9000 for MinIO
+    AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL", default=None)
+    AWS_S3_ADDRESSING_STYLE = os.getenv("AWS_S3_ADDRESSING_STYLE", default="path" if AWS_S3_ENDPOINT_URL else "auto")
+    AWS_S3_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_S3_MAX_POOL_CONNECTIONS", 32))
+    AWS_S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+    AWS_S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+    AWS_S3_MAX_CONCURRENCY = 4
+    # Lifetime of presigned URLs, in seconds
+    AWS_QUERYSTRING_EXPIRE = int(os.getenv("AWS_QUERYSTRING_EXPIRE", 900))
+    # ACL of logos and profile pictures, which get plain URLs. Set it empty for buckets
+    # where ACLs are disabled and a bucket policy makes those prefixes public.
+    AWS_PUBLIC_MEDIA_ACL = os.getenv("AWS_PUBLIC_MEDIA_ACL", "public-read") or None
 else:
     # Local storage settings
     MEDIA_ROOT = os.path.join(BASE_DIR, "media")
@@ -63,6 +75,8 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "core.middleware.CompanyMiddleware",
+    "core.middleware.OriginMiddleware",
+    "core.middleware.RateLimitMiddleware",
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -70,6 +84,38 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:5173",
 ]
 
+# Widget endpoints checked against the bot's whitelisted domains (see bot/domains.py).
+# The dashboard's own origins may always call them, for its chat preview.
+BOT_ORIGIN_CHECKED_PATHS = [
+    r"^/rest/v1/bot/(?P<bot_id>[^/]+)/chat$",
+    r"^/rest/v1/bot/(?P<bot_id>[^/]+)/feedback$",
+]
+BOT_ORIGIN_ALWAYS_ALLOWED = CORS_ALLOWED_ORIGINS
+
+# Rate limits of the widget endpoints above (core/ratelimit.py), as (requests, seconds).
+# Use core.ratelimit.CacheRateLimiter to share the counts between worker processes.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "core.ratelimit.LocalRateLimiter")
+RATE_LIMIT_BOT_IP = (30, 60)
+RATE_LIMIT_COMPANY = (1200, 60)
+RATE_LIMIT_MAX_BACKOFF = 3600
+RATE_LIMIT_STRIKE_TTL = 3600
+RATE_LIMIT_LOCAL_KEYS = 100000
+# Reverse proxies in front of the app, whose X-Forwarded-For entries are trusted
+RATE_LIMIT_PROXY_COUNT = int(os.getenv("RATE_LIMIT_PROXY_COUNT", "0"))
+BOT_DOMAIN_CACHE_SIZE = int(os.getenv("BOT_DOMAIN_CACHE_SIZE", 4096))
+BOT_DOMAIN_CACHE_TTL = int(os.getenv("BOT_DOMAIN_CACHE_TTL", 3600))
+
+# Public widget configuration (bot/widget.py): kept per process for the cache TTL, and by
+# browsers and CDNs for max-age, then served stale while they revalidate
+WIDGET_CONFIG_CACHE_SIZE = int(os.getenv("WIDGET_CONFIG_CACHE_SIZE", 4096))
+WIDGET_CONFIG_CACHE_TTL = int(os.getenv("WIDGET_CONFIG_CACHE_TTL", 60))
+WIDGET_CONFIG_MAX_AGE = int(os.getenv("WIDGET_CONFIG_MAX_AGE", 60))
+WIDGET_CONFIG_STALE_WHILE_REVALIDATE = int(os.getenv("WIDGET_CONFIG_STALE_WHILE_REVALIDATE", 86400))
+
+# Response headers the dashboard reads cross-origin
+CORS_EXPOSE_HEADERS = ["ETag", "Link", "X-Next-Cursor"]
+
 ROOT_URLCONF = "api.urls"
 
 TEMPLATES = [
@@ -89,17 +135,75 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "api.wsgi.application"
+ASGI_APPLICATION = "api.asgi.application"
 
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DB_ENGINE picks the profile: "sqlite" (default) or "postgres". Compare the write
+# throughput of profiles with `manage.py load_test_writes`.
+DB_ENGINE = os.getenv("DB_ENGINE", "sqlite")
+
+if DB_ENGINE == "postgres":
+    # Needs psycopg
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB", "ai_customer_service"),
+            "USER": os.getenv("POSTGRES_USER", "postgres"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", "localhost"),
+            "PORT": os.getenv("POSTGRES_PORT", "5432"),
+            # Connections are kept open between requests for this many seconds
+            "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            # Behind PgBouncer in transaction pooling mode, where a named cursor may
+            # land on another server connection than the one that declared it
+            "DISABLE_SERVER_SIDE_CURSORS": os.getenv("DB_POOLER", "") == "pgbouncer",
+            "OPTIONS": {"connect_timeout": 5},
+        }
     }
-}
+    SQLITE_PRAGMAS = {}
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+    # Applied to every new connection (core/db.py). "tuned" lets readers run alongside the
+    # writer (WAL), syncs to disk at checkpoints rather than at every commit and waits up
+    # to busy_timeout ms for the write lock; "default" keeps SQLite's rollback journal.
+    SQLITE_MODE = os.getenv("SQLITE_MODE", "tuned")
+    SQLITE_PRAGMAS = {
+        "tuned": {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 5000},
+        "default": {"journal_mode": "DELETE"},
+    }[SQLITE_MODE]
+
+
+# Cache shared by the API and worker processes. Falls back to a file-based cache,
+# which is shared by processes on one host, when no Redis is configured.
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_URL}}
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": os.path.join(BASE_DIR, ".cache")}}
+
+# Resized copies of uploaded logos and profile pictures (core/images.py)
+IMAGE_DERIVATIVE_WIDTHS = (64, 128, 256, 512)
+IMAGE_DERIVATIVE_FORMATS = ("webp", "png")
+IMAGE_DERIVATIVE_QUALITY = 80
+
+# Media served from the local storage (core/media.py). Set the prefix to an nginx
+# `internal` location aliasing MEDIA_ROOT to have nginx send the files.
+MEDIA_PUBLIC_PREFIXES = ("company_logos/", "profile_pictures/")
+MEDIA_CACHE_MAX_AGE = 3600
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX", "")
+
+# Per-process cache of resolved companies (see core/tenants.py)
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", 1024))
+TENANT_CACHE_TTL = int(os.getenv("TENANT_CACHE_TTL", 60))
 
 
 # Password validation
@@ -143,6 +247,92 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Background jobs (bot/tasks/queue.py, run with `manage.py run_worker`)
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_SECONDS = 5
+JOB_RETRY_MAX_SECONDS = 600
+
+# Knowledge indexing (bot/tasks/embeddings.py)
+BOT_EMBEDDER = os.getenv("BOT_EMBEDDER", "bot.tasks.embedder.HashingEmbedder")
+BOT_EMBEDDING_DIM = 256
+BOT_EMBEDDING_BATCH_SIZE = 64
+BOT_CHUNK_MAX_TOKENS = 200
+BOT_CHUNK_OVERLAP_TOKENS = 40
+BOT_INDEX_ROOT = os.getenv("BOT_INDEX_ROOT", os.path.join(BASE_DIR, "indexes"))
+BOT_INDEX_QUANTIZE = os.getenv("BOT_INDEX_QUANTIZE", "false").lower() == "true"
+# Vector indexes of at least this many chunks are partitioned, and a query only scans the
+# BOT_INDEX_PROBES partitions nearest to it (bot/retrieval/vector_index.py)
+BOT_INDEX_PARTITION_MIN_ROWS = int(os.getenv("BOT_INDEX_PARTITION_MIN_ROWS", 20000))
+BOT_INDEX_PROBES = int(os.getenv("BOT_INDEX_PROBES", 32))
+BOT_BM25_MAX_SEGMENTS = 8
+BOT_BM25_MAX_DELETED_RATIO = 0.3
+BOT_SEARCH_MAX_K = 50
+BOT_SEARCH_CANDIDATES = 50
+# Ready knowledge versions kept for rollback, the active one is always kept too
+BOT_KNOWLEDGE_VERSIONS_KEPT = int(os.getenv("BOT_KNOWLEDGE_VERSIONS_KEPT", "2"))
+
+# Training status stream (bot/status.py)
+BOT_STATUS_CHECK_SECONDS = 0.5
+BOT_STATUS_KEEPALIVE_SECONDS = 15
+BOT_STATUS_STREAM_SECONDS = 300
+BOT_STATUS_RETRY_MS = 3000
+BOT_STATUS_MAX_WAIT_SECONDS = 30
+
+# Ingestion of knowledge files and URLs (bot/ingestion/)
+INGEST_READ_BYTES = 64 * 1024
+BOT_URL_FETCHER = os.getenv("BOT_URL_FETCHER", "bot.ingestion.crawler.UrllibFetcher")
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", 4))
+CRAWL_TIMEOUT_SECONDS = int(os.getenv("CRAWL_TIMEOUT_SECONDS", 20))
+CRAWL_MAX_BYTES = int(os.getenv("CRAWL_MAX_BYTES", 512 * 1024 * 1024))
+# Let the crawler fetch loopback, private and link-local addresses (local development only)
+CRAWL_ALLOW_PRIVATE_ADDRESSES = os.getenv("CRAWL_ALLOW_PRIVATE_ADDRESSES", "false").lower() == "true"
+
+# Knowledge uploads are inserted in batches of this many items (bot/importing.py)
+KNOWLEDGE_IMPORT_BATCH_SIZE = int(os.getenv("KNOWLEDGE_IMPORT_BATCH_SIZE", 500))
+# Largest knowledge file clients may upload straight to object storage (USE_S3)
+KNOWLEDGE_DIRECT_UPLOAD_MAX_BYTES = int(os.getenv("KNOWLEDGE_DIRECT_UPLOAD_MAX_BYTES", 512 * 1024 * 1024))
+
+# Cursor pagination (bot/pagination.py)
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+KNOWLEDGE_PREVIEW_CHARS = 200
+
+# Chat (bot/chat)
+BOT_LLM_CLIENT = os.getenv("BOT_LLM_CLIENT", "bot.chat.llm.FakeLLMClient")
+CHAT_CONTEXT_CHUNKS = 4
+# Multi-turn prompts (bot/chat/context.py): the whole prompt, and the recent turns within it
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "2048"))
+CHAT_HISTORY_TOKENS = 768
+CHAT_HISTORY_TURNS = 6
+CHAT_SUMMARY_TOKENS = 200
+CHAT_SESSION_TTL = 24 * 60 * 60
+
+# Answers to repeated questions (bot/chat/answer_cache.py). Questions whose embeddings are
+# at least this similar to a cached one get its answer.
+BOT_ANSWER_CACHE_TTL = int(os.getenv("BOT_ANSWER_CACHE_TTL", 3600))
+BOT_ANSWER_CACHE_SIZE = 256
+BOT_ANSWER_CACHE_BOTS = 1024
+BOT_ANSWER_CACHE_SIMILARITY = 0.95
+
+# Buffered writes of conversations and messages (bot/chat/conversations.py)
+CONVERSATION_WRITE_BACKGROUND = os.getenv("CONVERSATION_WRITE_BACKGROUND", "true").lower() == "true"
+CONVERSATION_WRITE_INTERVAL_MS = int(os.getenv("CONVERSATION_WRITE_INTERVAL_MS", "500"))
+CONVERSATION_WRITE_BATCH_SIZE = 500
+CONVERSATION_WRITE_MAX_BUFFER = 50000
+
+# Dashboard analytics (bot/analytics.py), rolled up by `manage.py rollup_analytics`
+ANALYTICS_ROLLUP_BATCH_SIZE = 5000
+# Ids behind the newest folded row that are checked again for rows committed late, by
+# transactions that took their ids earlier (concurrent writers on Postgres)
+ANALYTICS_ROLLUP_ID_LAG = int(os.getenv("ANALYTICS_ROLLUP_ID_LAG", 10000))
+# How long feedback waits for its conversation to be written before it's ignored
+ANALYTICS_FEEDBACK_GRACE_SECONDS = int(os.getenv("ANALYTICS_FEEDBACK_GRACE_SECONDS", 600))
+ANALYTICS_TOP_UNANSWERED = 10
+# Longest range the analytics endpoints serve, in periods of the requested size
+ANALYTICS_MAX_PERIODS = 2000
+
 # Custom User model
 AUTH_USER_MODEL = "web_auth.User"
 
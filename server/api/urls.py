@@ -1,10 +1,14 @@
 from django.contrib import admin
-from django.urls import path
+from django.conf import settings
+from django.urls import path, re_path
 from ninja import NinjaAPI
 from .routes_handler.health_handler import router as health_router
 from company.routes_handler.company_handler import router as company_router
 from bot.routes_handler.bot_handler import router as bot_router
+from bot.routes_handler.analytics_handler import router as analytics_router
+from bot.routes_handler.widget_handler import router as widget_router
 from web_auth.routes_handler.auth_handler import router as web_auth_router
+from core.media import serve_media
 
 
 api = NinjaAPI(csrf=False)
@@ -13,8 +17,13 @@ api.add_router("", web_auth_router)
 api.add_router("", health_router)
 api.add_router("", company_router)
 api.add_router("", bot_router)
+api.add_router("", analytics_router)
+api.add_router("", widget_router)
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("rest/v1/", api.urls),
 ]
+
+if not settings.USE_S3:
+    urlpatterns.append(re_path(r"^media/(?P<path>.+)$", serve_media))
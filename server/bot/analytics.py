@@ -0,0 +1,245 @@
+"""Precomputed analytics for the dashboard.
+
+`rollup_analytics`, run periodically by `manage.py rollup_analytics`, folds the questions
+and feedback stored since its last run into hourly and daily AnalyticsRollup rows and
+daily UnansweredQuestion counts. The analytics endpoints only read rollups.
+
+Progress through the questions is the last folded id, kept in RollupWatermark: messages
+are inserted in batches after the time they carry, so a timestamp watermark would skip
+late rows.
+
+With concurrent writers (Postgres), a transaction holding lower ids may commit after
+rows with higher ids were folded. So the last `ANALYTICS_ROLLUP_ID_LAG` ids behind the
+watermark are checked again on every run, and those not in its `recent_ids` are folded
+then. A row committed even later than that, further behind, is never folded.
+
+Feedback can change (voting again replaces the rating), so each row is `pending` until
+its current rating is counted, and the rating counted before is taken back then. Feedback
+on a conversation that isn't stored for its bot is left pending while the conversation
+may still be in the message buffer, and ignored after `ANALYTICS_FEEDBACK_GRACE_SECONDS`.
+"""
+
+import csv
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import AsyncIterator, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet, Sum
+from django.utils import timezone
+
+from bot.chat.answer_cache import normalize_question
+from bot.models import AnalyticsRollup, Conversation, Feedback, Message, RollupWatermark, UnansweredQuestion
+
+PERIODS = ("hour", "day")
+ROLLUP_FIELDS = ("conversations", "questions", "unanswered", "thumbs_up", "thumbs_down")
+RATING_FIELDS = {1: "thumbs_up", -1: "thumbs_down"}
+
+
+def period_start(moment: datetime, period: str) -> datetime:
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment if period == "hour" else moment.replace(hour=0)
+
+
+class _Rollup:
+    """Counters of one batch of source rows, added to the stored rollups by `save`.
+
+    `save` reads the stored counters and writes them back, so it must run under
+    `_lock_rollups`, or concurrent runs would overwrite each other's counts.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(Counter)  # (bot_id, period, start) -> field counts
+        self.unanswered = Counter()  # (bot_id, day, question) -> count
+
+    def add(self, bot_id, moment: datetime, field: str, count: int = 1):
+        for period in PERIODS:
+            self.counts[(bot_id, period, period_start(moment, period))][field] += count
+
+    def add_unanswered(self, bot_id, moment: datetime, question: str):
+        self.unanswered[(bot_id, period_start(moment, "day").date(), normalize_question(question)[:255])] += 1
+
+    def save(self):
+        if self.counts:
+            rollups = AnalyticsRollup.objects.filter(bot_id__in={key[0] for key in self.counts}, start__in={key[2] for key in self.counts})
+            # The filter matches a superset of the keys
+            existing = {key: rollup for rollup in rollups if (key := (rollup.bot_id, rollup.period, rollup.start)) in self.counts}
+            created = []
+            for key, counts in self.counts.items():
+                rollup = existing.get(key)
+                if rollup is None:
+                    rollup = AnalyticsRollup(bot_id=key[0], period=key[1], start=key[2])
+                    created.append(rollup)
+                for field, count in counts.items():
+                    setattr(rollup, field, getattr(rollup, field) + count)
+            AnalyticsRollup.objects.bulk_update(existing.values(), ROLLUP_FIELDS, batch_size=500)
+            AnalyticsRollup.objects.bulk_create(created, batch_size=500)
+
+        if self.unanswered:
+            questions = UnansweredQuestion.objects.filter(bot_id__in={key[0] for key in self.unanswered}, day__in={key[1] for key in self.unanswered})
+            questions = questions.filter(question__in={key[2] for key in self.unanswered})
+            existing = {key: row for row in questions if (key := (row.bot_id, row.day, row.question)) in self.unanswered}
+            created = []
+            for key, count in self.unanswered.items():
+                row = existing.get(key)
+                if row is None:
+                    created.append(UnansweredQuestion(bot_id=key[0], day=key[1], question=key[2], count=count))
+                else:
+                    row.count += count
+            UnansweredQuestion.objects.bulk_update(existing.values(), ["count"], batch_size=500)
+            UnansweredQuestion.objects.bulk_create(created, batch_size=500)
+
+
+def _fold_questions(rollup: _Rollup, row: tuple):
+    _, bot_id, content, metadata, created_at = row
+    rollup.add(bot_id, created_at, "questions")
+    if metadata.get("opening"):
+        rollup.add(bot_id, created_at, "conversations")
+    # Questions whose turn failed have no `answered`, they aren't knowledge gaps
+    if metadata.get("answered") is False:
+        rollup.add(bot_id, created_at, "unanswered")
+        rollup.add_unanswered(bot_id, created_at, content)
+
+
+def _lock_rollups() -> RollupWatermark:
+    """Lock the rollups until the end of the transaction, returns the questions watermark.
+
+    Every batch, of questions or feedback, takes the lock of this one row before it
+    touches the rollups, so concurrent runs fold one batch at a time.
+    """
+    RollupWatermark.objects.get_or_create(source="questions")
+    return RollupWatermark.objects.select_for_update().get(source="questions")
+
+
+def _fold_questions_batch(batch_size: int) -> int:
+    """Fold the next `batch_size` questions past the watermark. Returns how many were folded."""
+    rows = Message.objects.filter(role="user").values_list("id", "bot_id", "content", "metadata", "created_at")
+    with transaction.atomic():
+        # Also keeps concurrent runs from folding the same rows twice
+        watermark = _lock_rollups()
+        recent = set(watermark.recent_ids)
+        behind = rows.filter(id__gt=watermark.last_id - settings.ANALYTICS_ROLLUP_ID_LAG, id__lte=watermark.last_id)
+        late = [row_id for row_id in behind.values_list("id", flat=True) if row_id not in recent][:batch_size]
+        batch = list(rows.filter(id__in=late).order_by("id")) if late else []
+        if len(batch) < batch_size:
+            batch += rows.filter(id__gt=watermark.last_id).order_by("id")[: batch_size - len(batch)]
+        if not batch:
+            return 0
+        rollup = _Rollup()
+        for row in batch:
+            _fold_questions(rollup, row)
+        rollup.save()
+        watermark.last_id = max(watermark.last_id, batch[-1][0])
+        watermark.recent_ids = sorted(row_id for row_id in recent.union(row[0] for row in batch) if row_id > watermark.last_id - settings.ANALYTICS_ROLLUP_ID_LAG)
+        watermark.save(update_fields=["last_id", "recent_ids", "updated_at"])
+    return len(batch)
+
+
+def _fold_feedback(after_id: int, batch_size: int) -> Tuple[int, int, int]:
+    """Fold the next `batch_size` pending feedback rows after `after_id`.
+
+    Returns how many rows were read, how many of them were folded and the last id read.
+    """
+    expired = timezone.now() - timedelta(seconds=settings.ANALYTICS_FEEDBACK_GRACE_SECONDS)
+    with transaction.atomic():
+        _lock_rollups()
+        # Locked, so a vote can't change between being counted and marked as counted
+        batch = list(Feedback.objects.select_for_update().filter(pending=True, id__gt=after_id).order_by("id")[:batch_size])
+        if not batch:
+            return 0, 0, after_id
+        conversations = set(Conversation.objects.filter(id__in={feedback.conversation_id for feedback in batch}).values_list("id", "bot_id"))
+        rollup = _Rollup()
+        done = []
+        folded = 0
+        for feedback in batch:
+            if (feedback.conversation_id, feedback.bot_id) not in conversations:
+                if feedback.created_at < expired:
+                    feedback.pending = False
+                    done.append(feedback)
+                continue
+            if feedback.folded_rating is not None:
+                rollup.add(feedback.bot_id, feedback.created_at, RATING_FIELDS[feedback.folded_rating], -1)
+            rollup.add(feedback.bot_id, feedback.created_at, RATING_FIELDS[feedback.rating])
+            feedback.pending, feedback.folded_rating = False, feedback.rating
+            done.append(feedback)
+            folded += 1
+        rollup.save()
+        Feedback.objects.bulk_update(done, ["pending", "folded_rating"], batch_size=500)
+    return len(batch), folded, batch[-1].id
+
+
+def rollup_analytics(batch_size: Optional[int] = None) -> dict:
+    """Fold every question and feedback stored since the last run into the rollups.
+
+    Each batch is committed with its progress, so an interrupted run loses no work.
+    Returns how many rows of each source were folded.
+    """
+    batch_size = batch_size or settings.ANALYTICS_ROLLUP_BATCH_SIZE
+    counts = {"questions": 0, "feedback": 0}
+    while folded := _fold_questions_batch(batch_size):
+        counts["questions"] += folded
+        if folded < batch_size:
+            break
+
+    # Rows left pending are passed over, until the next run
+    after_id = 0
+    while True:
+        read, folded, after_id = _fold_feedback(after_id, batch_size)
+        counts["feedback"] += folded
+        if read < batch_size:
+            break
+    return counts
+
+
+def satisfaction(row: dict) -> Optional[float]:
+    rated = row["thumbs_up"] + row["thumbs_down"]
+    return round(row["thumbs_up"] / rated, 4) if rated else None
+
+
+def rollup_rows(bot_id, period: str, since: datetime, until: datetime) -> QuerySet:
+    return AnalyticsRollup.objects.filter(bot_id=bot_id, period=period, start__gte=period_start(since, period), start__lt=until).order_by("start")
+
+
+def get_analytics(bot_id, period: str, since: datetime, until: datetime) -> dict:
+    """Counters of a bot per period between `since` and `until`, periods without activity left out."""
+    series = []
+    for row in rollup_rows(bot_id, period, since, until).values("start", *ROLLUP_FIELDS):
+        row["satisfaction"] = satisfaction(row)
+        series.append(row)
+    totals = {field: sum(row[field] for row in series) for field in ROLLUP_FIELDS}
+    totals["satisfaction"] = satisfaction(totals)
+
+    unanswered = (
+        UnansweredQuestion.objects.filter(bot_id=bot_id, day__gte=period_start(since, "day").date(), day__lte=until.date())
+        .values("question")
+        .annotate(total=Sum("count"))
+        .order_by("-total", "question")[: settings.ANALYTICS_TOP_UNANSWERED]
+    )
+    return {
+        "totals": totals,
+        "series": series,
+        "top_unanswered": [{"question": row["question"], "count": row["total"]} for row in unanswered],
+    }
+
+
+class _Echo:
+    """File-like object whose `write` returns the line, so csv.writer can feed a generator."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def csv_lines(bot_id, period: str, since: datetime, until: datetime) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(("start", *ROLLUP_FIELDS))
+    for row in rollup_rows(bot_id, period, since, until).values_list("start", *ROLLUP_FIELDS).iterator(chunk_size=2000):
+        yield writer.writerow((row[0].isoformat(), *row[1:]))
+
+
+async def acsv_lines(bot_id, period: str, since: datetime, until: datetime) -> AsyncIterator[str]:
+    """Async variant of `csv_lines` for ASGI, which would otherwise buffer a sync iterator."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(("start", *ROLLUP_FIELDS))
+    async for row in rollup_rows(bot_id, period, since, until).values_list("start", *ROLLUP_FIELDS).aiterator(chunk_size=2000):
+        yield writer.writerow((row[0].isoformat(), *row[1:]))
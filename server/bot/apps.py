@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bot'
+
+    def ready(self):
+        # Register background job handlers with the queue
+        from .tasks import embeddings  # noqa: F401
+        from . import signals  # noqa: F401
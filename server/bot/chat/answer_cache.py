@@ -0,0 +1,121 @@
+"""Cache of chat answers per bot.
+
+Answers are keyed by the normalized question and the bot's knowledge version, a token
+in the shared cache that is replaced whenever the bot's knowledge or settings change
+or it finishes training. Exact repeats are found in the shared cache, so every
+process benefits; each process also keeps the question embeddings of recent answers
+to match rephrasings above `BOT_ANSWER_CACHE_SIMILARITY`.
+"""
+
+import hashlib
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from bot.tasks.embedder import get_embedder
+from core.cache import LocalTTLCache
+
+QUESTION_PUNCTUATION_RE = re.compile(r"[\s?!.,;:]+$")
+
+
+def normalize_question(question: str) -> str:
+    return QUESTION_PUNCTUATION_RE.sub("", " ".join(question.lower().split()))
+
+
+def _version_key(bot_id) -> str:
+    return f"bot-knowledge-version:{bot_id}"
+
+
+def bump_knowledge_version(bot_id) -> str:
+    """Invalidate the cached answers of a bot in every process."""
+    version = uuid.uuid4().hex
+    cache.set(_version_key(bot_id), version, timeout=None)
+    return version
+
+
+def knowledge_version(bot_id) -> str:
+    return cache.get(_version_key(bot_id)) or bump_knowledge_version(bot_id)
+
+
+class _BotAnswers:
+    """Recent answers of one bot at one knowledge version, LRU with a TTL."""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.entries = OrderedDict()  # question -> (expires, vector, answer)
+        self.lock = threading.Lock()
+
+    def nearest(self, vector: np.ndarray, threshold: float) -> Optional[dict]:
+        with self.lock:
+            now = time.monotonic()
+            for question in [question for question, (expires, _, _) in self.entries.items() if expires < now]:
+                del self.entries[question]
+            if not self.entries:
+                return None
+            questions = list(self.entries)
+            scores = np.stack([self.entries[question][1] for question in questions]) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            self.entries.move_to_end(questions[best])
+            return self.entries[questions[best]][2]
+
+    def put(self, question: str, vector: np.ndarray, answer: dict):
+        with self.lock:
+            self.entries[question] = (time.monotonic() + settings.BOT_ANSWER_CACHE_TTL, vector, answer)
+            self.entries.move_to_end(question)
+            while len(self.entries) > settings.BOT_ANSWER_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+
+_bots = LocalTTLCache(maxsize=settings.BOT_ANSWER_CACHE_BOTS, ttl=settings.BOT_ANSWER_CACHE_TTL)
+
+
+def _answer_key(bot_id, version: str, question: str) -> str:
+    return f"answer:{bot_id}:{version}:{hashlib.sha256(question.encode('utf-8')).hexdigest()}"
+
+
+def _bot_answers(bot_id, version: str) -> _BotAnswers:
+    answers = _bots.get(str(bot_id))
+    if answers is None or answers.version != version:
+        answers = _BotAnswers(version)
+        _bots.set(str(bot_id), answers)
+    return answers
+
+
+@dataclass
+class Lookup:
+    """A question looked up in the cache, and what's needed to store its answer on a miss."""
+
+    bot_id: str
+    question: str
+    version: str
+    vector: Optional[np.ndarray] = None
+    answer: Optional[dict] = None
+
+
+def lookup_answer(bot_id, question: str) -> Lookup:
+    """Find the cached `{"text", "sources"}` answer to `question` or a near-duplicate of it."""
+    question = normalize_question(question)
+    # Pinned now, so an answer generated while the knowledge changes stays with the old version
+    lookup = Lookup(str(bot_id), question, knowledge_version(bot_id))
+    lookup.answer = cache.get(_answer_key(bot_id, lookup.version, question))
+    if lookup.answer is None:
+        lookup.vector = get_embedder().embed([question])[0]
+        lookup.answer = _bot_answers(bot_id, lookup.version).nearest(lookup.vector, settings.BOT_ANSWER_CACHE_SIMILARITY)
+    return lookup
+
+
+def store_answer(lookup: Lookup, answer: dict):
+    cache.set(_answer_key(lookup.bot_id, lookup.version, lookup.question), answer, settings.BOT_ANSWER_CACHE_TTL)
+    answers = _bots.get(lookup.bot_id)
+    if answers is not None and answers.version == lookup.version and lookup.vector is not None:
+        answers.put(lookup.question, lookup.vector, answer)
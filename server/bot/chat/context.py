@@ -0,0 +1,136 @@
+"""Prompt assembly for multi-turn chat within a fixed token budget.
+
+The state of a conversation, its recent turns and a summary of the older ones, is kept
+in the cache under the conversation id, so a turn costs one cache read and one write
+instead of a replay of the conversation from the database. Once the window grows past
+`CHAT_HISTORY_TURNS`, its older half is folded into the summary: the question and the
+first sentence of the answer of each turn, trimmed to `CHAT_SUMMARY_TOKENS` from the
+oldest end. Token counts use the chunker's regex tokenizer, which tracks model
+tokenizers closely enough to budget with and costs no model call.
+"""
+
+import re
+from dataclasses import asdict, dataclass, field
+from typing import List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from bot.models import Bot, Message
+from bot.tasks.chunking import count_tokens
+
+TONE_INSTRUCTIONS = {
+    "professional": "Answer in a professional, concise manner.",
+    "friendly": "Answer in a warm and friendly manner.",
+    "casual": "Answer in a relaxed, casual manner.",
+    "technical": "Answer precisely, with technical detail where useful.",
+}
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def first_sentence(text: str) -> str:
+    return SENTENCE_END_RE.split(text.strip(), maxsplit=1)[0]
+
+
+@dataclass
+class Turn:
+    question: str
+    answer: str
+    tokens: int
+
+
+@dataclass
+class Session:
+    summary: str = ""
+    turns: List[Turn] = field(default_factory=list)
+
+    def add_turn(self, question: str, answer: str):
+        self.turns.append(Turn(question, answer, count_tokens(question) + count_tokens(answer)))
+        if len(self.turns) > settings.CHAT_HISTORY_TURNS:
+            # Folding half the window at once, so most turns don't touch the summary
+            cut = len(self.turns) - settings.CHAT_HISTORY_TURNS // 2
+            self.summary = summarize(self.summary, self.turns[:cut])
+            self.turns = self.turns[cut:]
+
+
+def summarize(summary: str, turns: List[Turn]) -> str:
+    """`summary` extended with a line per turn, without its oldest lines past `CHAT_SUMMARY_TOKENS`."""
+    lines = summary.splitlines() + [f"- Asked: {first_sentence(turn.question)} Answered: {first_sentence(turn.answer)}" for turn in turns]
+    kept = []
+    tokens = 0
+    for line in reversed(lines):
+        tokens += count_tokens(line)
+        if tokens > settings.CHAT_SUMMARY_TOKENS:
+            break
+        kept.append(line)
+    return "\n".join(reversed(kept))
+
+
+def _session_key(bot_id, conversation_id) -> str:
+    return f"chat-session:{bot_id}:{conversation_id}"
+
+
+def load_session(bot_id, conversation_id) -> Session:
+    """The state of a conversation; rebuilt from its latest stored messages if it left the cache."""
+    data = cache.get(_session_key(bot_id, conversation_id))
+    if data is not None:
+        return Session(data["summary"], [Turn(**turn) for turn in data["turns"]])
+
+    rows = Message.objects.filter(conversation_id=conversation_id, bot_id=bot_id).order_by("-created_at", "-id").values_list("role", "content")
+    session = Session()
+    question = None
+    for role, content in reversed(rows[: 2 * settings.CHAT_HISTORY_TURNS]):
+        if role == "user":
+            question = content
+        elif question is not None:
+            session.add_turn(question, content)
+            question = None
+    return session
+
+
+def save_session(bot_id, conversation_id, session: Session):
+    cache.set(_session_key(bot_id, conversation_id), asdict(session), settings.CHAT_SESSION_TTL)
+
+
+def build_messages(bot: Bot, question: str, chunks: List[dict], session: Session) -> Tuple[List[dict], List[dict]]:
+    """Prompt messages for `question` within `CHAT_CONTEXT_TOKENS`, and the chunks that made it in.
+
+    After the instructions and the question, recent turns come first (newest first, up to
+    `CHAT_HISTORY_TOKENS`), then the summary, then the knowledge chunks in rank order.
+    """
+    instructions = (
+        f"You are the customer support assistant of {bot.company.name}. "
+        f"{TONE_INSTRUCTIONS.get(bot.tone, TONE_INSTRUCTIONS['professional'])} "
+        "Only answer using the knowledge below; if it doesn't cover the question, say so."
+    )
+    remaining = settings.CHAT_CONTEXT_TOKENS - count_tokens(instructions) - count_tokens(question)
+
+    history = []
+    history_budget = min(remaining, settings.CHAT_HISTORY_TOKENS)
+    for turn in reversed(session.turns):
+        if turn.tokens > history_budget:
+            break
+        history.append(turn)
+        history_budget -= turn.tokens
+        remaining -= turn.tokens
+    history.reverse()
+
+    summary_tokens = count_tokens(session.summary)
+    if session.summary and summary_tokens <= history_budget:
+        instructions += f"\n\nEarlier in this conversation:\n{session.summary}"
+        remaining -= summary_tokens
+
+    used = []
+    for chunk in chunks:
+        tokens = count_tokens(chunk["text"])
+        if tokens <= remaining:
+            used.append(chunk)
+            remaining -= tokens
+
+    knowledge = "\n\n".join(chunk["text"] for chunk in used)
+    messages = [{"role": "system", "content": f"{instructions}\n\nKnowledge:\n{knowledge}"}]
+    for turn in history:
+        messages += [{"role": "user", "content": turn.question}, {"role": "assistant", "content": turn.answer}]
+    messages.append({"role": "user", "content": question})
+    return messages, used
@@ -0,0 +1,117 @@
+"""Buffered writing of chat conversations and messages.
+
+Chat turns are recorded in memory and inserted with `bulk_create` by a background
+thread, every `CONVERSATION_WRITE_INTERVAL_MS` or as soon as
+`CONVERSATION_WRITE_BATCH_SIZE` messages are waiting. A busy widget then doesn't insert
+on the request path, and SQLite's single writer is taken for one short transaction per
+batch. The buffer is flushed when the process exits; a crash loses at most one interval.
+"""
+
+import atexit
+import logging
+import threading
+import uuid
+from datetime import datetime
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from bot.models import Bot, Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+
+def parse_conversation_id(value: Optional[str]) -> Optional[uuid.UUID]:
+    """The conversation a chat request continues, None to start one if it names none (or garbage)."""
+    try:
+        return uuid.UUID(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MessageWriter:
+    def __init__(self):
+        self.buffer: List[Message] = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def record(self, messages: List[Message]):
+        """Queue `messages` for the next batch. Never touches the database."""
+        with self.lock:
+            if len(self.buffer) + len(messages) > settings.CONVERSATION_WRITE_MAX_BUFFER:
+                # The database can't keep up, shedding logs beats running out of memory
+                logger.warning("Message buffer full, dropping %d messages", len(messages))
+                return
+            self.buffer.extend(messages)
+            full = len(self.buffer) >= settings.CONVERSATION_WRITE_BATCH_SIZE
+            if self.thread is None and settings.CONVERSATION_WRITE_BACKGROUND:
+                self.thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+        if full:
+            self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait(settings.CONVERSATION_WRITE_INTERVAL_MS / 1000)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing chat messages failed")
+            finally:
+                close_old_connections()
+
+    def flush(self) -> int:
+        """Insert the buffered messages and their new conversations. Returns how many were inserted."""
+        with self.lock:
+            messages, self.buffer = self.buffer, []
+        if not messages:
+            return 0
+
+        with transaction.atomic():
+            # Bots deleted since their messages were recorded
+            bot_ids = set(Bot.objects.filter(id__in={message.bot_id for message in messages}).values_list("id", flat=True))
+            started = {}
+            for message in messages:
+                if message.bot_id in bot_ids:
+                    started.setdefault(message.conversation_id, (message.bot_id, message.created_at))
+            Conversation.objects.bulk_create(
+                [Conversation(id=conversation_id, bot_id=bot_id, created_at=created_at) for conversation_id, (bot_id, created_at) in started.items()],
+                batch_size=settings.CONVERSATION_WRITE_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            # A conversation id sent to another bot doesn't get its messages
+            owners = dict(Conversation.objects.filter(id__in=list(started)).values_list("id", "bot_id"))
+            messages = [message for message in messages if owners.get(message.conversation_id) == message.bot_id]
+            Message.objects.bulk_create(messages, batch_size=settings.CONVERSATION_WRITE_BATCH_SIZE)
+        return len(messages)
+
+
+message_writer = MessageWriter()
+
+
+def record_turn(
+    bot_id,
+    conversation_id: uuid.UUID,
+    question: str,
+    asked_at: datetime,
+    reply: Optional[str] = None,
+    metadata: Optional[dict] = None,
+    opening: bool = False,
+):
+    """Queue the question of a chat turn and, unless it failed, the reply.
+
+    The question is flagged as `opening` its conversation, and as `answered` when the
+    reply had knowledge sources, for the analytics rollups.
+    """
+    question_metadata = {"opening": opening}
+    if reply is not None:
+        question_metadata["answered"] = bool((metadata or {}).get("sources"))
+    messages = [Message(conversation_id=conversation_id, bot_id=bot_id, role="user", content=question, metadata=question_metadata, created_at=asked_at)]
+    if reply is not None:
+        messages.append(Message(conversation_id=conversation_id, bot_id=bot_id, role="assistant", content=reply, metadata=metadata or {}, created_at=timezone.now()))
+    message_writer.record(messages)
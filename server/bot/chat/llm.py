@@ -0,0 +1,65 @@
+"""LLM clients used to generate chat replies.
+
+The active client is configured with the `BOT_LLM_CLIENT` setting (a dotted path).
+"""
+
+import re
+from functools import lru_cache
+from typing import AsyncIterator, Iterator, List
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class LLMClient:
+    """Base class for LLM clients.
+
+    `messages` are chat-style dicts with `role` ("system", "user" or "assistant") and
+    `content`. `stream` yields the reply as text fragments as soon as they're available;
+    `astream` is its async counterpart used when serving over ASGI.
+    """
+
+    def stream(self, messages: List[dict]) -> Iterator[str]:
+        raise NotImplementedError
+
+    async def astream(self, messages: List[dict]) -> AsyncIterator[str]:
+        # Clients with a native async transport should override this. The fallback
+        # pulls each fragment of the blocking stream from a worker thread.
+        iterator = iter(self.stream(messages))
+        done = object()
+        while True:
+            text = await sync_to_async(next, thread_sensitive=False)(iterator, done)
+            if text is done:
+                return
+            yield text
+
+
+class FakeLLMClient(LLMClient):
+    """Deterministic local model for development and tests.
+
+    Answers with the first sentence of the knowledge passed in the system prompt, one
+    word at a time, so the streaming path can be exercised without a model provider.
+    """
+
+    FALLBACK = "I'm sorry, I couldn't find an answer to that in our help content."
+
+    def _reply(self, messages: List[dict]) -> str:
+        system = next((message["content"] for message in messages if message["role"] == "system"), "")
+        _, _, knowledge = system.partition("Knowledge:\n")
+        first_passage = knowledge.strip().split("\n\n")[0]
+        sentences = re.split(r"(?<=[.!?])\s+", first_passage)
+        return sentences[0] if sentences and sentences[0] else self.FALLBACK
+
+    def stream(self, messages: List[dict]) -> Iterator[str]:
+        for i, word in enumerate(self._reply(messages).split(" ")):
+            yield word if i == 0 else f" {word}"
+
+    async def astream(self, messages: List[dict]) -> AsyncIterator[str]:
+        for text in self.stream(messages):
+            yield text
+
+
+@lru_cache(maxsize=None)
+def get_llm_client() -> LLMClient:
+    return import_string(settings.BOT_LLM_CLIENT)()
@@ -0,0 +1,140 @@
+import json
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Iterator, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from bot.models import Bot
+from bot.retrieval.service import search_knowledge
+from .answer_cache import lookup_answer, store_answer
+from .context import Session, build_messages, load_session, save_session
+from .conversations import record_turn
+from .llm import get_llm_client
+
+logger = logging.getLogger(__name__)
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ChatTurn:
+    """State of one streamed reply: cache lookup, retrieval, prompt, SSE events and latency metrics.
+
+    `conversation_id` is None for the first turn of a conversation.
+    """
+
+    def __init__(self, bot: Bot, question: str, conversation_id: Optional[uuid.UUID]):
+        self.bot = bot
+        self.question = question
+        self.conversation_id = conversation_id or uuid.uuid4()
+        self.session = None
+        self.continued = conversation_id is not None
+        self.asked_at = timezone.now()
+        self.chunks = []
+        self.reply = []
+        self.cache_lookup = None
+        self.cached = False
+        self.started = time.perf_counter()
+        self.retrieval_ms = None
+        self.first_token_ms = None
+
+    def _elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def lookup(self) -> Optional[str]:
+        """Load the conversation. For its opening question, return the cached reply to it (or to
+        a near-duplicate), which skips retrieval and generation."""
+        if self.continued:
+            # Follow-ups depend on the conversation, their answers aren't shared
+            self.session = load_session(self.bot.id, self.conversation_id)
+            return None
+        self.session = Session()
+        self.cache_lookup = lookup_answer(self.bot.id, self.question)
+        answer = self.cache_lookup.answer
+        if answer is None:
+            return None
+        self.cached = True
+        self.chunks = [{"chunk_id": chunk_id} for chunk_id in answer["sources"]]
+        return answer["text"]
+
+    def prepare(self) -> List[dict]:
+        """Retrieve knowledge for the question and return the prompt messages."""
+        [chunks] = search_knowledge(self.bot.id, [self.question], k=settings.CHAT_CONTEXT_CHUNKS)
+        self.retrieval_ms = self._elapsed_ms()
+        messages, self.chunks = build_messages(self.bot, self.question, chunks, self.session)
+        return messages
+
+    def token(self, text: str) -> str:
+        if self.first_token_ms is None:
+            self.first_token_ms = self._elapsed_ms()
+        self.reply.append(text)
+        return sse_event("token", {"text": text})
+
+    def remember(self):
+        """Add the turn to the conversation, and cache a generated opening reply for repeats of the question."""
+        reply = "".join(self.reply)
+        self.session.add_turn(self.question, reply)
+        save_session(self.bot.id, self.conversation_id, self.session)
+        if self.cache_lookup is not None and not self.cached:
+            store_answer(self.cache_lookup, {"text": reply, "sources": [chunk["chunk_id"] for chunk in self.chunks]})
+
+    def error(self) -> str:
+        logger.exception("Chat reply failed for bot %s", self.bot.id)
+        record_turn(self.bot.id, self.conversation_id, self.question, self.asked_at, opening=not self.continued)
+        return sse_event("error", {"error": "Failed to generate a reply"})
+
+    def done(self) -> str:
+        metrics = {
+            "cached": self.cached,
+            "retrieval_ms": round(self.retrieval_ms or 0, 2),
+            "ttft_ms": round(self.first_token_ms if self.first_token_ms is not None else 0, 2),
+            "total_ms": round(self._elapsed_ms(), 2),
+        }
+        logger.info("Chat reply for bot %s: %s", self.bot.id, metrics)
+        sources = [chunk["chunk_id"] for chunk in self.chunks]
+        record_turn(self.bot.id, self.conversation_id, self.question, self.asked_at, "".join(self.reply), {"sources": sources, "metrics": metrics}, opening=not self.continued)
+        return sse_event("done", {"conversation_id": str(self.conversation_id), "sources": sources, "metrics": metrics})
+
+
+def stream_chat(bot: Bot, question: str, conversation_id: Optional[uuid.UUID]) -> Iterator[str]:
+    """Answer `question` as a stream of server-sent events.
+
+    Emits a `token` event per text fragment and a final `done` event carrying the
+    conversation id, the sources, whether the reply came from the answer cache, and the
+    retrieval / time-to-first-token / total latency in milliseconds.
+    """
+    turn = ChatTurn(bot, question, conversation_id)
+    try:
+        cached = turn.lookup()
+        if cached is not None:
+            yield turn.token(cached)
+        else:
+            for text in get_llm_client().stream(turn.prepare()):
+                yield turn.token(text)
+        turn.remember()
+    except Exception:
+        yield turn.error()
+        return
+    yield turn.done()
+
+
+async def astream_chat(bot: Bot, question: str, conversation_id: Optional[uuid.UUID]) -> AsyncIterator[str]:
+    """Async variant of `stream_chat` for ASGI, so an open stream doesn't hold a thread."""
+    turn = ChatTurn(bot, question, conversation_id)
+    try:
+        cached = await sync_to_async(turn.lookup)()
+        if cached is not None:
+            yield turn.token(cached)
+        else:
+            messages = await sync_to_async(turn.prepare)()
+            async for text in get_llm_client().astream(messages):
+                yield turn.token(text)
+        await sync_to_async(turn.remember)()
+    except Exception:
+        yield turn.error()
+        return
+    yield turn.done()
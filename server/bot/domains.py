@@ -0,0 +1,119 @@
+"""Origin checks against a bot's whitelisted domains.
+
+Each bot's domains are compiled into a `DomainMatcher` and kept per process. A version
+stamp in the shared cache, bumped by `publish_domains` whenever the domains are
+written, tells processes when to rebuild, so checking an origin needs no query.
+"""
+
+import uuid
+from functools import lru_cache
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from core.cache import LocalTTLCache
+from .models import Bot, WhitelistedDomain
+
+_matchers = LocalTTLCache(maxsize=settings.BOT_DOMAIN_CACHE_SIZE, ttl=settings.BOT_DOMAIN_CACHE_TTL)
+
+
+def normalize_host(value: str) -> Optional[str]:
+    """The lowercased host of an origin, URL or bare domain, without port or trailing dot."""
+    value = value.strip().lower()
+    if not value or value == "null":
+        return None
+    try:
+        host = urlsplit(value if "//" in value else f"//{value}").hostname
+    except ValueError:
+        return None
+    return host.rstrip(".") if host else None
+
+
+class DomainMatcher:
+    """Exact hosts plus `*.example.com` wildcards, which match subdomains only.
+
+    A host is checked against a hashed set per label suffix, so a check costs one
+    lookup per label of the host, however many domains the bot has.
+    """
+
+    def __init__(self, domains: Iterable[str], company_id=None):
+        # Of the bot, carried along for the per-company rate limit
+        self.company_id = company_id
+        exact, suffixes = set(), set()
+        for domain in domains:
+            wildcard = domain.strip().startswith("*.")
+            host = normalize_host(domain.strip()[2:] if wildcard else domain)
+            if host:
+                (suffixes if wildcard else exact).add(host)
+        self.exact = frozenset(exact)
+        self.suffixes = frozenset(suffixes)
+
+    def __bool__(self):
+        return bool(self.exact or self.suffixes)
+
+    def matches(self, host: str) -> bool:
+        if host in self.exact:
+            return True
+        position = host.find(".")
+        while position != -1:
+            if host[position + 1 :] in self.suffixes:
+                return True
+            position = host.find(".", position + 1)
+        return False
+
+
+def _version_key(bot_id) -> str:
+    return f"bot-domains:{bot_id}"
+
+
+def publish_domains(bot_id) -> str:
+    """Mark the domains of a bot as changed, so every process rebuilds its matcher."""
+    version = uuid.uuid4().hex
+    cache.set(_version_key(bot_id), version, timeout=None)
+    return version
+
+
+def _matcher(bot_id, version: Optional[str]) -> DomainMatcher:
+    if version is None:
+        version = publish_domains(bot_id)
+    cached = _matchers.get(str(bot_id))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    company_id = Bot.objects.filter(id=bot_id).values_list("company_id", flat=True).first()
+    matcher = DomainMatcher(WhitelistedDomain.objects.filter(bot_id=bot_id).values_list("domain", flat=True), company_id)
+    _matchers.set(str(bot_id), (version, matcher))
+    return matcher
+
+
+def get_domain_matcher(bot_id) -> DomainMatcher:
+    return _matcher(bot_id, cache.get(_version_key(bot_id)))
+
+
+async def aget_domain_matcher(bot_id) -> DomainMatcher:
+    version = await cache.aget(_version_key(bot_id))
+    cached = _matchers.get(str(bot_id))
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+    return await sync_to_async(_matcher)(bot_id, version)
+
+
+@lru_cache(maxsize=None)
+def _always_allowed() -> frozenset:
+    return frozenset(filter(None, (normalize_host(origin) for origin in settings.BOT_ORIGIN_ALWAYS_ALLOWED)))
+
+
+def request_host(request) -> Optional[str]:
+    """The host the request was sent from, per its `Origin` (or `Referer`) header."""
+    origin = request.headers.get("Origin") or request.headers.get("Referer")
+    return normalize_host(origin) if origin else None
+
+
+def is_origin_allowed(matcher: DomainMatcher, host: Optional[str]) -> bool:
+    # Bots without domains aren't restricted yet, and neither are clients that send no
+    # origin (they aren't browsers, so they could send any origin anyway)
+    if host is None or not matcher or host in _always_allowed():
+        return True
+    return matcher.matches(host)
@@ -0,0 +1,126 @@
+"""Bulk knowledge import from JSONL or CSV uploads.
+
+Uploads are decoded and parsed as a stream of lines, and items are inserted in
+`bulk_create` batches inside one transaction: an import either lands completely or
+not at all, and triggers a single training run.
+"""
+
+import codecs
+import csv
+import json
+import logging
+from typing import Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Bot, KnowledgeItem, Polling
+from .tasks.embeddings import create_embeddings
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ("jsonl", "csv")
+KNOWLEDGE_TYPES = {choice for choice, _ in KnowledgeItem._meta.get_field("type").choices}
+
+
+class KnowledgeImportError(ValueError):
+    def __init__(self, line: int, message: str):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    extension = (filename or "").rsplit(".", 1)[-1].lower()
+    return {"jsonl": "jsonl", "ndjson": "jsonl", "csv": "csv"}.get(extension)
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Lines (with their line ending) of UTF-8 `chunks`, decoded as they arrive."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+def _read_jsonl(lines: Iterable[str]) -> Iterator[Tuple[int, dict]]:
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise KnowledgeImportError(number, f"Invalid JSON ({e.msg})") from e
+        if not isinstance(record, dict):
+            raise KnowledgeImportError(number, "Expected a JSON object")
+        yield number, record
+
+
+def _read_csv(lines: Iterable[str]) -> Iterator[Tuple[int, dict]]:
+    reader = csv.DictReader(lines)
+    try:
+        for record in reader:
+            yield reader.line_num, record
+    except csv.Error as e:
+        raise KnowledgeImportError(reader.line_num, str(e)) from e
+
+
+def parse_records(chunks: Iterable[bytes], fmt: str) -> Iterator[Tuple[str, str]]:
+    """`(type, content)` of every record of an upload, validated. `type` defaults to "text"."""
+    reader = _read_jsonl if fmt == "jsonl" else _read_csv
+    try:
+        for number, record in reader(iter_lines(chunks)):
+            item_type = record.get("type") or "text"
+            content = record.get("content")
+            if not isinstance(item_type, str):
+                raise KnowledgeImportError(number, "type must be a string")
+            item_type = item_type.strip()
+            if item_type not in KNOWLEDGE_TYPES:
+                raise KnowledgeImportError(number, f"Unknown type '{item_type}'")
+            if not isinstance(content, str) or not content.strip():
+                raise KnowledgeImportError(number, "Missing content")
+            yield item_type, content
+    except UnicodeDecodeError as e:
+        raise KnowledgeImportError(0, "File is not valid UTF-8") from e
+
+
+def import_knowledge(bot: Bot, chunks: Iterable[bytes], fmt: str, batch_size: Optional[int] = None) -> Polling:
+    """Import the knowledge items of an upload into `bot` and queue its training.
+
+    Progress is reported on an "importing" Polling row, which is returned. It ends with
+    the number of imported items, or becomes an "error" row if the import fails, in
+    which case nothing is imported and the error is raised (`KnowledgeImportError` for
+    an invalid upload).
+    """
+    batch_size = batch_size or settings.KNOWLEDGE_IMPORT_BATCH_SIZE
+    polling = Polling.objects.create(bot=bot, status="importing", progress={"imported": 0})
+    imported = 0
+    try:
+        with transaction.atomic():
+            batch = []
+            for item_type, content in parse_records(chunks, fmt):
+                batch.append(KnowledgeItem(bot=bot, type=item_type, content=content))
+                if len(batch) >= batch_size:
+                    KnowledgeItem.objects.bulk_create(batch)
+                    imported += len(batch)
+                    batch = []
+            KnowledgeItem.objects.bulk_create(batch)
+            imported += len(batch)
+    except Exception as e:
+        # Not left "importing" forever by an unexpected error either
+        error = str(e) if isinstance(e, KnowledgeImportError) else "Import failed"
+        polling.status, polling.completed, polling.success, polling.error = "error", True, False, error
+        polling.save()
+        raise
+
+    polling.completed, polling.success, polling.progress = True, True, {"imported": imported}
+    polling.save()
+    logger.info("Imported %s knowledge items into bot %s", imported, bot.id)
+    create_embeddings(bot)
+    return polling
@@ -0,0 +1,243 @@
+"""Fetching of URL knowledge items.
+
+Pages are fetched with conditional GETs (`If-None-Match` / `If-Modified-Since`), at most
+`CRAWL_CONCURRENCY` at a time, and streamed to storage rather than held in memory.
+The fetcher is configured with the `BOT_URL_FETCHER` setting (a dotted path).
+
+URLs come from tenants, so `UrllibFetcher` only connects to public addresses: the host
+is resolved and every address checked when each connection (redirects included) is
+opened, and the connection goes to the checked address, so a DNS answer can't change
+in between. `CRAWL_ALLOW_PRIVATE_ADDRESSES` lifts this for local development and tests.
+"""
+
+import http.client
+import ipaddress
+import logging
+import socket
+import tempfile
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from bot.models import Bot, KnowledgeItem
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlError(Exception):
+    pass
+
+
+@dataclass
+class FetchResult:
+    """A response; `body` yields the payload in blocks and is empty for a 304."""
+
+    status: int
+    etag: str = ""
+    last_modified: str = ""
+    content_type: str = ""
+    body: Iterator[bytes] = field(default_factory=lambda: iter(()))
+
+
+class Fetcher:
+    """Base class for URL fetchers."""
+
+    def fetch(self, url: str, etag: str = "", last_modified: str = "") -> FetchResult:
+        raise NotImplementedError
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None, *args, **kwargs):
+    """`socket.create_connection` that refuses hosts resolving to non-public addresses."""
+    host, port = address
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    except socket.gaierror as e:
+        raise CrawlError(f"{host} could not be resolved: {e}") from e
+    if not settings.CRAWL_ALLOW_PRIVATE_ADDRESSES and not all(is_public_address(ip) for ip in addresses):
+        raise CrawlError(f"{host} resolves to a private address")
+    error = None
+    for ip in addresses:
+        try:
+            return socket.create_connection((ip, port), timeout, source_address)
+        except OSError as e:
+            error = e
+    raise error
+
+
+class _PublicConnectionMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Set per instance by HTTPConnection.__init__, so it's replaced after it
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPConnection(_PublicConnectionMixin, http.client.HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicConnectionMixin, http.client.HTTPSConnection):
+    # Connects to the checked address, then verifies the certificate against the host name
+    pass
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, request):
+        return self.do_open(_PublicHTTPConnection, request)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, request):
+        return self.do_open(_PublicHTTPSConnection, request, context=self._context)
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, request, fp, code, message, headers, new_url):
+        if urlsplit(new_url).scheme not in ("http", "https"):
+            raise CrawlError(f"{request.full_url} redirects to {new_url}, which is not an http(s) URL")
+        return super().redirect_request(request, fp, code, message, headers, new_url)
+
+
+class UrllibFetcher(Fetcher):
+    user_agent = "ai-customer-service-crawler/1.0"
+
+    def __init__(self):
+        # Only the handlers we need: no proxies from the environment, no ftp:// or file://
+        self.opener = urllib.request.OpenerDirector()
+        for handler in (
+            _PublicHTTPHandler(),
+            _PublicHTTPSHandler(),
+            urllib.request.HTTPDefaultErrorHandler(),
+            _RedirectHandler(),
+            urllib.request.HTTPErrorProcessor(),
+        ):
+            self.opener.add_handler(handler)
+
+    def fetch(self, url: str, etag: str = "", last_modified: str = "") -> FetchResult:
+        headers = {"User-Agent": self.user_agent}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            response = self.opener.open(request, timeout=settings.CRAWL_TIMEOUT_SECONDS)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return FetchResult(status=304, etag=etag, last_modified=last_modified)
+            raise CrawlError(f"{url} answered {e.code}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise CrawlError(f"{url} could not be fetched: {e}") from e
+
+        return FetchResult(
+            status=response.status,
+            etag=response.headers.get("ETag", ""),
+            last_modified=response.headers.get("Last-Modified", ""),
+            content_type=response.headers.get("Content-Type", ""),
+            body=self._read(response),
+        )
+
+    def _read(self, response) -> Iterator[bytes]:
+        with response:
+            while block := response.read(settings.INGEST_READ_BYTES):
+                yield block
+
+
+@lru_cache(maxsize=None)
+def get_fetcher() -> Fetcher:
+    return import_string(settings.BOT_URL_FETCHER)()
+
+
+@dataclass
+class Download:
+    item_id: str
+    result: Optional[FetchResult] = None
+    file_name: str = ""
+    error: str = ""
+
+
+def _download(item: KnowledgeItem, fetcher: Fetcher) -> Download:
+    """Fetch one URL item and save a changed body to storage. Runs in a crawler thread."""
+    download = Download(item_id=item.id)
+    try:
+        if urlsplit(item.content).scheme not in ("http", "https"):
+            raise CrawlError(f"{item.content} is not an http(s) URL")
+        result = fetcher.fetch(item.content, item.etag, item.last_modified)
+        if result.status == 304:
+            download.result = result
+            return download
+        if result.status != 200:
+            raise CrawlError(f"{item.content} answered {result.status}")
+
+        with tempfile.TemporaryFile() as body:
+            size = 0
+            for block in result.body:
+                size += len(block)
+                if size > settings.CRAWL_MAX_BYTES:
+                    raise CrawlError(f"{item.content} is larger than {settings.CRAWL_MAX_BYTES} bytes")
+                body.write(block)
+            body.seek(0)
+            file_field = KnowledgeItem._meta.get_field("file")
+            download.file_name = file_field.storage.save(file_field.generate_filename(item, str(item.id)), File(body))
+        download.result = result
+    except CrawlError as e:
+        download.error = str(e)
+    return download
+
+
+def crawl_bot(bot: Bot, fetcher: Optional[Fetcher] = None, concurrency: Optional[int] = None) -> dict:
+    """Fetch the URL knowledge items of `bot`, conditionally on the validators of their last fetch.
+
+    Changed items get their new body, validators and `updated_at`, so the next
+    `index_bot` re-indexes them. Returns counters for the run.
+    """
+    fetcher = fetcher or get_fetcher()
+    items = list(bot.knowledge_items.filter(type="url").only("id", "bot_id", "content", "file", "etag", "last_modified"))
+    counts = {"fetched": 0, "unchanged": 0, "failed": 0}
+    if not items:
+        return counts
+
+    by_id = {item.id: item for item in items}
+    # Threads only do network and storage IO, the database is updated from this thread
+    with ThreadPoolExecutor(max_workers=concurrency or settings.CRAWL_CONCURRENCY) as pool:
+        downloads = list(pool.map(lambda item: _download(item, fetcher), items))
+
+    now = timezone.now()
+    for download in downloads:
+        item = by_id[download.item_id]
+        if download.error:
+            logger.warning("Crawling knowledge item %s failed: %s", item.id, download.error)
+            counts["failed"] += 1
+        elif download.result.status == 304:
+            KnowledgeItem.objects.filter(id=item.id).update(fetched_at=now)
+            counts["unchanged"] += 1
+        else:
+            # update() rather than save(), saving an item would queue another training run
+            result = download.result
+            KnowledgeItem.objects.filter(id=item.id).update(
+                file=download.file_name,
+                content_type=result.content_type,
+                etag=result.etag,
+                last_modified=result.last_modified,
+                fetched_at=now,
+                updated_at=now,
+            )
+            if item.file:
+                item.file.delete(save=False)
+            counts["fetched"] += 1
+    return counts
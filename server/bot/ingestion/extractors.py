@@ -0,0 +1,179 @@
+"""Incremental text extraction from knowledge files.
+
+Files are read in blocks of `INGEST_READ_BYTES` and text is yielded as soon as it is
+decoded, so memory use doesn't grow with the size of the document. PDFs are read
+page by page with pypdf.
+"""
+
+import codecs
+import re
+from html.parser import HTMLParser
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from django.conf import settings
+
+
+class ExtractionError(ValueError):
+    pass
+
+
+KIND_BY_CONTENT_TYPE = {
+    "text/plain": "text",
+    "text/markdown": "markdown",
+    "text/x-markdown": "markdown",
+    "text/html": "html",
+    "application/xhtml+xml": "html",
+    "application/pdf": "pdf",
+}
+KIND_BY_EXTENSION = {"txt": "text", "md": "markdown", "markdown": "markdown", "html": "html", "htm": "html", "pdf": "pdf"}
+
+
+def detect_kind(name: str = "", content_type: str = "") -> str:
+    """The extractor for a file, by content type, then by file extension. Defaults to plain text."""
+    kind = KIND_BY_CONTENT_TYPE.get(content_type.split(";")[0].strip().lower())
+    if kind is None and "." in name:
+        kind = KIND_BY_EXTENSION.get(name.rsplit(".", 1)[-1].lower())
+    return kind or "text"
+
+
+def charset(content_type: str, default: str = "utf-8") -> str:
+    match = re.search(r"charset=[\"']?([\w.:-]+)", content_type or "", re.IGNORECASE)
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return default
+
+
+def read_blocks(file: BinaryIO, size: Optional[int] = None) -> Iterator[bytes]:
+    size = size or settings.INGEST_READ_BYTES
+    while block := file.read(size):
+        yield block
+
+
+def decode_blocks(blocks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    for block in blocks:
+        text = decoder.decode(block)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+# A line longer than this is passed on in parts, so text without newlines can't grow the buffer
+MAX_LINE_CHARS = 64 * 1024
+
+
+def _lines(texts: Iterable[str]) -> Iterator[str]:
+    buffer = ""
+    for text in texts:
+        buffer += text
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line + "\n"
+        if len(buffer) > MAX_LINE_CHARS:
+            yield buffer
+            buffer = ""
+    if buffer:
+        yield buffer
+
+
+MARKDOWN_RULES = [
+    (re.compile(r"!?\[([^\]]*)\]\([^)]*\)"), r"\1"),  # Links and images keep their text
+    (re.compile(r"^\s{0,3}(#{1,6}|>+|[-*+]|\d+\.)\s+"), ""),  # Headings, quotes, list markers
+    (re.compile(r"(\*\*|__|\*|`)"), ""),  # Emphasis and inline code
+]
+
+
+def extract_markdown(blocks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[str]:
+    fenced = False
+    for line in _lines(decode_blocks(blocks, encoding)):
+        if line.lstrip().startswith("```"):
+            fenced = not fenced
+            continue
+        if not fenced:
+            for pattern, replacement in MARKDOWN_RULES:
+                line = pattern.sub(replacement, line)
+        yield line
+
+
+class _HTMLTextParser(HTMLParser):
+    SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "head"}
+    BLOCK_TAGS = {"p", "div", "section", "article", "li", "br", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "title", "pre", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.pieces = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.pieces.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.pieces.append("\n\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.pieces.append(data)
+
+
+def extract_html(blocks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[str]:
+    """Visible text of an HTML document, with blank lines between blocks."""
+    parser = _HTMLTextParser()
+    for text in decode_blocks(blocks, encoding):
+        parser.feed(text)
+        yield from parser.pieces
+        parser.pieces.clear()
+    parser.close()
+    yield from parser.pieces
+
+
+def extract_pdf(file: BinaryIO) -> Iterator[str]:
+    try:
+        from pypdf import PdfReader
+        from pypdf.errors import PdfReadError
+    except ImportError as e:
+        raise ExtractionError("PDF support requires pypdf") from e
+
+    try:
+        reader = PdfReader(file)
+        for page in reader.pages:
+            yield (page.extract_text() or "") + "\n\n"
+    except PdfReadError as e:
+        raise ExtractionError(f"Invalid PDF: {e}") from e
+
+
+def extract_text(file: BinaryIO, name: str = "", content_type: str = "") -> Iterator[str]:
+    """Text pieces of `file`, for `chunk_text`. `file` must be seekable for PDFs."""
+    kind = detect_kind(name, content_type)
+    if kind == "pdf":
+        return extract_pdf(file)
+    encoding = charset(content_type)
+    if kind == "html":
+        return extract_html(read_blocks(file), encoding)
+    if kind == "markdown":
+        return extract_markdown(read_blocks(file), encoding)
+    return decode_blocks(read_blocks(file), encoding)
+
+
+def knowledge_text(item) -> Iterator[str]:
+    """Text pieces of a KnowledgeItem: its file (upload or fetched page) or its content.
+
+    URL items yield nothing until their page has been fetched.
+    """
+    if item.file:
+        name = item.content if item.type == "file" else item.file.name
+        with item.file.open("rb") as file:
+            yield from extract_text(file, name, item.content_type)
+    elif item.type != "url":
+        yield item.content
@@ -0,0 +1,68 @@
+import re
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from bot.models import AnalyticsRollup, Bot, Feedback, Job, KnowledgeChunk, KnowledgeItem, KnowledgeVersion, Message, Polling, UnansweredQuestion, WhitelistedDomain
+from web_auth.models import User
+
+# A table read in full: SQLite's "SCAN <table>" (but not "SCAN ... USING INDEX", which walks
+# an index), Postgres' "Seq Scan on <table>"
+FULL_SCAN_RE = re.compile(r"\bSCAN (\w+)(?! USING)|Seq Scan on (\w+)")
+
+
+def hot_queries() -> dict:
+    """The queries behind the endpoints and jobs that run most, with placeholder values."""
+    bot_id, company_id, conversation_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    now = timezone.now()
+    return {
+        "bots of a company": Bot.objects.filter(company_id=company_id).order_by("created_at", "id")[: settings.PAGE_SIZE_DEFAULT],
+        "bot of a company": Bot.objects.filter(id=bot_id, company_id=company_id),
+        "bot with its company": Bot.objects.select_related("company").filter(id=bot_id),
+        "user by email": User.objects.filter(email="someone@example.com"),
+        "knowledge items of a bot": KnowledgeItem.objects.filter(bot_id=bot_id).order_by("created_at", "id")[: settings.PAGE_SIZE_DEFAULT],
+        "pollings of a bot": Polling.objects.filter(bot_id=bot_id).order_by("created_at"),
+        "whitelisted domains of a bot": WhitelistedDomain.objects.filter(bot_id=bot_id),
+        "live chunks of a bot": KnowledgeChunk.objects.filter(bot_id=bot_id, retired_in__isnull=True),
+        "knowledge versions of a bot": KnowledgeVersion.objects.filter(bot_id=bot_id, status="ready").order_by("-number"),
+        "conversation history": Message.objects.filter(conversation_id=conversation_id, bot_id=bot_id).order_by("-created_at", "-id")[: 2 * settings.CHAT_HISTORY_TURNS],
+        "analytics rollups": AnalyticsRollup.objects.filter(bot_id=bot_id, period="day", start__gte=now - timedelta(days=30), start__lt=now).order_by("start"),
+        "pending feedback": Feedback.objects.filter(pending=True, id__gt=0).order_by("id")[: settings.ANALYTICS_ROLLUP_BATCH_SIZE],
+        "unanswered questions": UnansweredQuestion.objects.filter(bot_id=bot_id, day__gte=(now - timedelta(days=30)).date(), day__lte=now.date()),
+        "runnable jobs": Job.objects.filter(Q(status="queued", run_after__lte=now) | Q(status="running", locked_until__lt=now)).order_by("run_after"),
+    }
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot queries and fail if any of them reads a whole table (for CI)"
+
+    def handle(self, *args, **options):
+        full_scans = []
+        for name, queryset in hot_queries().items():
+            plan = self._explain(queryset)
+            tables = sorted({table for match in FULL_SCAN_RE.finditer(plan) for table in match.groups() if table})
+            if tables:
+                full_scans.append(name)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN {name} ({', '.join(tables)})"))
+            else:
+                self.stdout.write(f"ok {name}")
+            if options["verbosity"] > 1:
+                self.stdout.write(plan)
+
+        if full_scans:
+            raise CommandError(f"{len(full_scans)} hot queries read a whole table: {', '.join(full_scans)}")
+
+    def _explain(self, queryset) -> str:
+        if connection.vendor != "postgresql":
+            return queryset.explain()
+        with transaction.atomic():
+            # Tables of a test database are small enough that a sequential scan is cheapest,
+            # this makes the planner pick the index whenever there's one
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            return queryset.explain()
@@ -0,0 +1,76 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+
+from bot.models import Bot, Conversation, Message, Polling
+from company.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the write throughput of the configured database under concurrent widget-like traffic. "
+        "Run it once per profile to compare, e.g. with SQLITE_MODE=default and SQLITE_MODE=tuned."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8, help="Concurrent writers, each with its own connection")
+        parser.add_argument("--seconds", type=float, default=10.0, help="How long to write for")
+
+    def handle(self, *args, **options):
+        # Scratch rows, deleted (with everything written under them) at the end
+        company = Company.objects.create(name="Load test")
+        bot = Bot.objects.create(company=company, name="Load test")
+        results = []
+        try:
+            deadline = time.monotonic() + options["seconds"]
+            threads = [threading.Thread(target=self._write, args=(bot, deadline, results)) for _ in range(options["threads"])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            company.delete()
+
+        latencies = sorted(latency for thread_latencies, _ in results for latency in thread_latencies)
+        errors = sum(thread_errors for _, thread_errors in results)
+        writes = len(latencies)
+        self.stdout.write(f"Profile: {self._profile()}, {options['threads']} threads")
+        self.stdout.write(f"{writes} writes in {options['seconds']:g}s: {writes / options['seconds']:.0f} writes/s, {errors} failed (database locked)")
+        if writes:
+            percentiles = statistics.quantiles(latencies, n=100) if writes > 1 else latencies * 99
+            self.stdout.write(f"Latency: p50 {percentiles[49] * 1000:.1f} ms, p99 {percentiles[98] * 1000:.1f} ms")
+
+    def _write(self, bot, deadline: float, results: list):
+        """Write like a busy widget does: a chat message and a Polling progress update per transaction."""
+        latencies, errors = [], 0
+        try:
+            conversation = Conversation.objects.create(bot=bot)
+            polling = Polling.objects.create(bot=bot, status="training")
+            count = 0
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    with transaction.atomic():
+                        Message.objects.create(conversation=conversation, bot=bot, role="user", content=f"Question {count}")
+                        Polling.objects.filter(id=polling.id).update(progress={"messages": count})
+                except OperationalError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+                count += 1
+        finally:
+            results.append((latencies, errors))
+            connection.close()
+
+    def _profile(self) -> str:
+        if connection.vendor != "sqlite":
+            return connection.vendor
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+            cursor.execute("PRAGMA synchronous")
+            synchronous = cursor.fetchone()[0]
+        return f"sqlite, journal_mode={journal_mode}, synchronous={synchronous}"
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bot.analytics import rollup_analytics
+
+
+class Command(BaseCommand):
+    help = "Fold the chat questions and feedback stored since the last run into the analytics rollups (run it from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.ANALYTICS_ROLLUP_BATCH_SIZE, help="Rows folded per transaction")
+
+    def handle(self, *args, **options):
+        counts = rollup_analytics(options["batch_size"])
+        self.stdout.write(", ".join(f"{source}: {count} rows" for source, count in counts.items()))
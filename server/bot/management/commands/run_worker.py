@@ -0,0 +1,68 @@
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from bot.tasks import queue
+
+
+class Command(BaseCommand):
+    help = "Run background jobs from the database-backed job queue with a bounded pool of threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=settings.JOB_WORKER_CONCURRENCY, help="Maximum number of jobs run at once")
+        parser.add_argument("--lease", type=int, default=settings.JOB_LEASE_SECONDS, help="Visibility timeout of a claimed job, in seconds")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="Exit once no runnable jobs are left")
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        lease = options["lease"]
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.stdout.write(f"Worker {worker_id} started with {concurrency} slots")
+        in_flight = {}
+        last_heartbeat = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="job") as pool:
+            while not self.stopping:
+                in_flight = {future: job_id for future, job_id in in_flight.items() if not future.done()}
+
+                claimed = False
+                while len(in_flight) < concurrency:
+                    job = queue.claim(worker_id, lease)
+                    if job is None:
+                        break
+                    claimed = True
+                    in_flight[pool.submit(self._run, job, worker_id)] = job.id
+
+                if in_flight and time.monotonic() - last_heartbeat > lease / 3:
+                    queue.extend_lease(list(in_flight.values()), worker_id, lease)
+                    last_heartbeat = time.monotonic()
+
+                if options["once"] and not claimed and not in_flight:
+                    break
+                if not claimed:
+                    time.sleep(options["poll_interval"])
+
+            self.stdout.write(f"Worker {worker_id} waiting for {len(in_flight)} running jobs")
+
+        self.stdout.write(f"Worker {worker_id} stopped")
+
+    def _run(self, job, worker_id):
+        close_old_connections()
+        try:
+            return queue.run(job, worker_id)
+        finally:
+            connection.close()
+
+    def _stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0004_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgeitem',
+            name='indexed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='polling',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.CreateModel(
+            name='KnowledgeChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('text', models.TextField()),
+                ('embedder', models.CharField(max_length=100)),
+                ('embedding', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='bot.bot')),
+                ('knowledge_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='bot.knowledgeitem')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bot', 'content_hash'], name='chunk_bot_content_hash_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_knowledge_chunks'),
+        ('company', '0002_company_logo_company_primary_color_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bot',
+            index=models.Index(fields=['company', 'created_at', 'id'], name='bot_company_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgeitem',
+            index=models.Index(fields=['bot', 'created_at', 'id'], name='knowledge_bot_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0006_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='polling',
+            name='progress',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='polling',
+            name='status',
+            field=models.CharField(choices=[('importing', 'Importing'), ('started', 'Started'), ('training', 'Training'), ('ready', 'Ready'), ('error', 'Error')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:12
+
+import django.core.files.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0007_polling_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgeitem',
+            name='content_type',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='knowledgeitem',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='knowledgeitem',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='knowledgeitem',
+            name='file',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=django.core.files.storage.FileSystemStorage(location='media'), upload_to='knowledge/'),
+        ),
+        migrations.AddField(
+            model_name='knowledgeitem',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,116 @@
+import hashlib
+import unicodedata
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def normalize(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def share_chunk_contents(apps, schema_editor):
+    KnowledgeChunk = apps.get_model("bot", "KnowledgeChunk")
+    ChunkContent = apps.get_model("bot", "ChunkContent")
+
+    content_ids = {}
+    refs = Counter()
+    batch = []
+    for chunk in KnowledgeChunk.objects.order_by("id").iterator(chunk_size=1000):
+        text = normalize(chunk.text)
+        chunk.content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        key = (chunk.content_hash, chunk.embedder)
+        if key not in content_ids:
+            content_ids[key] = ChunkContent.objects.create(content_hash=chunk.content_hash, embedder=chunk.embedder, text=text, embedding=chunk.embedding).id
+        chunk.content_id = content_ids[key]
+        refs[chunk.content_id] += 1
+        batch.append(chunk)
+        if len(batch) == 1000:
+            KnowledgeChunk.objects.bulk_update(batch, ["content", "content_hash"])
+            batch = []
+    KnowledgeChunk.objects.bulk_update(batch, ["content", "content_hash"])
+
+    for content_id, count in refs.items():
+        ChunkContent.objects.filter(id=content_id).update(ref_count=count)
+
+
+def unshare_chunk_contents(apps, schema_editor):
+    KnowledgeChunk = apps.get_model("bot", "KnowledgeChunk")
+    batch = []
+    for chunk in KnowledgeChunk.objects.select_related("content").order_by("id").iterator(chunk_size=1000):
+        chunk.text, chunk.embedder, chunk.embedding = chunk.content.text, chunk.content.embedder, chunk.content.embedding
+        batch.append(chunk)
+        if len(batch) == 1000:
+            KnowledgeChunk.objects.bulk_update(batch, ["text", "embedder", "embedding"])
+            batch = []
+    KnowledgeChunk.objects.bulk_update(batch, ["text", "embedder", "embedding"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_knowledge_item_sources'),
+    ]
+
+    operations = [
+        # Nullable while they're dropped, so that migrating back can refill them
+        migrations.AlterField(
+            model_name='knowledgechunk',
+            name='text',
+            field=models.TextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='knowledgechunk',
+            name='embedder',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='knowledgechunk',
+            name='embedding',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.CreateModel(
+            name='ChunkContent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('embedder', models.CharField(max_length=100)),
+                ('text', models.TextField()),
+                ('embedding', models.BinaryField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('ref_count', 0)), fields=['ref_count'], name='chunk_content_orphan_idx')],
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'embedder'), name='unique_chunk_content')],
+            },
+        ),
+        migrations.AddField(
+            model_name='knowledgechunk',
+            name='content',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='chunks', to='bot.chunkcontent'),
+        ),
+        migrations.RunPython(share_chunk_contents, unshare_chunk_contents),
+        migrations.AlterField(
+            model_name='knowledgechunk',
+            name='content',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='chunks', to='bot.chunkcontent'),
+        ),
+        migrations.RemoveIndex(
+            model_name='knowledgechunk',
+            name='chunk_bot_content_hash_idx',
+        ),
+        migrations.RemoveField(
+            model_name='knowledgechunk',
+            name='embedder',
+        ),
+        migrations.RemoveField(
+            model_name='knowledgechunk',
+            name='embedding',
+        ),
+        migrations.RemoveField(
+            model_name='knowledgechunk',
+            name='text',
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def queue_training(apps, schema_editor):
+    # Bots are served from their active version only, so every bot is retrained once
+    Bot = apps.get_model("bot", "Bot")
+    Job = apps.get_model("bot", "Job")
+    queued = set(Job.objects.filter(kind="embeddings", status="queued").values_list("key", flat=True))
+    Job.objects.bulk_create(
+        [Job(kind="embeddings", key=f"embeddings:{bot_id}", payload={"bot_id": str(bot_id)}) for bot_id in Bot.objects.values_list("id", flat=True) if f"embeddings:{bot_id}" not in queued],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_chunk_contents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('building', 'Building'), ('ready', 'Ready'), ('failed', 'Failed'), ('archived', 'Archived')], default='building', max_length=20)),
+                ('vector_index', models.CharField(blank=True, default='', max_length=100)),
+                ('keyword_index', models.CharField(blank=True, default='', max_length=100)),
+                ('chunk_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('activated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='knowledgechunk',
+            name='added_in',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='knowledgechunk',
+            name='retired_in',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgechunk',
+            index=models.Index(fields=['bot', 'retired_in'], name='chunk_bot_retired_idx'),
+        ),
+        migrations.AddField(
+            model_name='knowledgeversion',
+            name='bot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='bot.bot'),
+        ),
+        migrations.AddField(
+            model_name='bot',
+            name='active_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='bot.knowledgeversion'),
+        ),
+        migrations.AddConstraint(
+            model_name='knowledgeversion',
+            constraint=models.UniqueConstraint(fields=('bot', 'number'), name='unique_knowledge_version'),
+        ),
+        migrations.RunPython(queue_training, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0011_conversations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnalyticsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('start', models.DateTimeField()),
+                ('conversations', models.PositiveIntegerField(default=0)),
+                ('questions', models.PositiveIntegerField(default=0)),
+                ('unanswered', models.PositiveIntegerField(default=0)),
+                ('thumbs_up', models.PositiveIntegerField(default=0)),
+                ('thumbs_down', models.PositiveIntegerField(default=0)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='bot.bot')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Feedback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation_id', models.UUIDField()),
+                ('rating', models.SmallIntegerField(choices=[(1, 'Up'), (-1, 'Down')])),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feedback', to='bot.bot')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UnansweredQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('question', models.CharField(max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unanswered_questions', to='bot.bot')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='analyticsrollup',
+            constraint=models.UniqueConstraint(fields=('bot', 'period', 'start'), name='unique_analytics_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='unansweredquestion',
+            constraint=models.UniqueConstraint(fields=('bot', 'day', 'question'), name='unique_unanswered_question'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0012_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='polling',
+            index=models.Index(fields=['bot', 'created_at'], name='polling_bot_created_idx'),
+        ),
+    ]
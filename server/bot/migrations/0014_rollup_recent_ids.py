@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_recent_ids(apps, schema_editor):
+    # Everything up to the watermarks was folded, the lag behind them must not be folded again
+    Message = apps.get_model("bot", "Message")
+    Feedback = apps.get_model("bot", "Feedback")
+    RollupWatermark = apps.get_model("bot", "RollupWatermark")
+    sources = {"questions": Message.objects.filter(role="user"), "feedback": Feedback.objects.all()}
+    for watermark in RollupWatermark.objects.filter(source__in=sources):
+        rows = sources[watermark.source].filter(id__gt=watermark.last_id - settings.ANALYTICS_ROLLUP_ID_LAG, id__lte=watermark.last_id)
+        watermark.recent_ids = sorted(rows.values_list("id", flat=True))
+        watermark.save(update_fields=["recent_ids"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0013_polling_bot_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='recent_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(record_recent_ids, migrations.RunPython.noop),
+    ]
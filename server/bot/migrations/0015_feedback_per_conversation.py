@@ -0,0 +1,43 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_folded_feedback(apps, schema_editor):
+    Feedback = apps.get_model("bot", "Feedback")
+    RollupWatermark = apps.get_model("bot", "RollupWatermark")
+    # Feedback was folded by id, like the questions still are
+    watermark = RollupWatermark.objects.filter(source="feedback").first()
+    if watermark is not None:
+        folded = Feedback.objects.filter(id__lte=watermark.last_id - settings.ANALYTICS_ROLLUP_ID_LAG) | Feedback.objects.filter(id__in=watermark.recent_ids)
+        folded.update(pending=False, folded_rating=models.F("rating"))
+        watermark.delete()
+
+    # Only the last vote on a conversation is kept. The counts of the others stay in the
+    # rollups they were folded into.
+    last_votes = {}
+    for feedback_id, bot_id, conversation_id in Feedback.objects.order_by("id").values_list("id", "bot_id", "conversation_id").iterator(chunk_size=2000):
+        last_votes[(bot_id, conversation_id)] = feedback_id
+    Feedback.objects.exclude(id__in=last_votes.values()).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0014_rollup_recent_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feedback',
+            name='folded_rating',
+            field=models.SmallIntegerField(blank=True, choices=[(1, 'Up'), (-1, 'Down')], null=True),
+        ),
+        migrations.AddField(
+            model_name='feedback',
+            name='pending',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(mark_folded_feedback, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0015_feedback_per_conversation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(condition=models.Q(('pending', True)), fields=['id'], name='feedback_pending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedback',
+            constraint=models.UniqueConstraint(fields=('bot', 'conversation_id'), name='unique_conversation_feedback'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 import uuid
 from company.models import Company
+from core.storage import MediaStorage
 from django.utils import timezone
 
 
@@ -9,9 +10,17 @@ class Bot(models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name="bots")
     name = models.CharField(max_length=255)
     tone = models.CharField(max_length=20, choices=[("professional", "Professional"), ("friendly", "Friendly"), ("casual", "Casual"), ("technical", "Technical")], default="professional")
+    # The knowledge version chat is served from, see bot/retrieval/versions.py
+    active_version = models.ForeignKey("KnowledgeVersion", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a company's bots
+            models.Index(fields=["company", "created_at", "id"], name="bot_company_created_idx"),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.company.name})"
 
@@ -21,15 +30,113 @@ class KnowledgeItem(models.Model):
     bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name="knowledge_items")
     type = models.CharField(max_length=10, choices=[("url", "URL"), ("file", "File"), ("text", "Text")])
     content = models.TextField()
+    # Uploaded file, or the last fetched body of a URL, with the validators of that fetch
+    file = models.FileField(storage=MediaStorage(), upload_to="knowledge/", max_length=255, null=True, blank=True)
+    content_type = models.CharField(max_length=255, blank=True, default="")
+    etag = models.CharField(max_length=255, blank=True, default="")
+    last_modified = models.CharField(max_length=64, blank=True, default="")
+    fetched_at = models.DateTimeField(null=True, blank=True)
+    indexed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a bot's knowledge items
+            models.Index(fields=["bot", "created_at", "id"], name="knowledge_bot_created_idx"),
+        ]
+
     def __str__(self):
         return f"{self.get_type_display()} - {self.content[:50]}..."
 
 
+class ChunkContent(models.Model):
+    """Text and embedding of a chunk, shared by all chunks with the same normalized text.
+
+    `ref_count` is the number of KnowledgeChunks using the content. Contents nothing
+    refers to any more are deleted after training runs.
+    """
+
+    content_hash = models.CharField(max_length=64)
+    embedder = models.CharField(max_length=100)
+    text = models.TextField()
+    embedding = models.BinaryField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["content_hash", "embedder"], name="unique_chunk_content"),
+        ]
+        indexes = [
+            # Garbage collection only scans unreferenced contents
+            models.Index(fields=["ref_count"], name="chunk_content_orphan_idx", condition=models.Q(ref_count=0)),
+        ]
+
+    def __str__(self):
+        return f"Chunk content {self.content_hash[:12]} ({self.ref_count} refs)"
+
+
+class KnowledgeChunk(models.Model):
+    """A chunk of a KnowledgeItem: its position and its (shared) content.
+
+    A chunk belongs to the knowledge versions from `added_in` up to, but excluding,
+    `retired_in`. Retired chunks are kept while a version using them is retained.
+    """
+
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name="chunks")
+    knowledge_item = models.ForeignKey(KnowledgeItem, on_delete=models.CASCADE, related_name="chunks")
+    content = models.ForeignKey(ChunkContent, on_delete=models.PROTECT, related_name="chunks")
+    position = models.PositiveIntegerField()
+    content_hash = models.CharField(max_length=64)
+    added_in = models.PositiveIntegerField(default=0)
+    retired_in = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bot", "retired_in"], name="chunk_bot_retired_idx"),
+        ]
+
+    def __str__(self):
+        return f"Chunk {self.position} of {self.knowledge_item_id}"
+
+
+class KnowledgeVersion(models.Model):
+    """The index of a bot built by one training run. Immutable once ready.
+
+    `vector_index` and `keyword_index` name its vector index directory and BM25
+    manifest generation under the bot's index directory.
+    """
+
+    STATUS_CHOICES = [
+        ("building", "Building"),
+        ("ready", "Ready"),
+        ("failed", "Failed"),
+        ("archived", "Archived"),
+    ]
+
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name="versions")
+    number = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="building")
+    vector_index = models.CharField(max_length=100, blank=True, default="")
+    keyword_index = models.CharField(max_length=100, blank=True, default="")
+    chunk_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bot", "number"], name="unique_knowledge_version"),
+        ]
+
+    def __str__(self):
+        return f"Version {self.number} of Bot {self.bot_id} ({self.status})"
+
+
 class Polling(models.Model):
     STATUS_CHOICES = [
+        ("importing", "Importing"),
         ("started", "Started"),
         ("training", "Training"),
         ("ready", "Ready"),
@@ -41,9 +148,17 @@ class Polling(models.Model):
     completed = models.BooleanField(default=False)
     error = models.TextField(null=True, blank=True)
     success = models.BooleanField(null=True)
+    timings = models.JSONField(default=dict, blank=True)
+    progress = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Status snapshots list a bot's pollings in creation order
+            models.Index(fields=["bot", "created_at"], name="polling_bot_created_idx"),
+        ]
+
     def __str__(self):
         return f"Polling {self.id} - {self.status} for Bot {self.bot_id}"
 
@@ -59,3 +174,177 @@ class WhitelistedDomain(models.Model):
 
     def __str__(self):
         return f"{self.domain} (Bot: {self.bot.name})"
+
+
+class Job(models.Model):
+    """A unit of background work leased by `manage.py run_worker`.
+
+    `key` is an idempotency key: at most one job per key may be waiting in the queue,
+    so enqueueing the same work twice returns the job that is already queued. A queued
+    job is not claimed while another job with the same key is still running.
+    """
+
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+
+    kind = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="queued")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["key"], condition=models.Q(status="queued"), name="unique_queued_job_key"),
+        ]
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="job_status_run_after_idx"),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} - {self.kind} ({self.status})"
+
+
+class Conversation(models.Model):
+    """A chat session of a widget visitor with a bot.
+
+    Rows are written in batches by `bot.chat.conversations.MessageWriter`, so
+    `created_at` is the time of the first message rather than of the insert.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name="conversations")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bot", "created_at"], name="conversation_bot_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"Conversation {self.id} with Bot {self.bot_id}"
+
+
+class Message(models.Model):
+    ROLE_CHOICES = [
+        ("user", "User"),
+        ("assistant", "Assistant"),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="messages")
+    # Denormalized from the conversation, so per-bot queries don't need a join
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name="messages")
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+    content = models.TextField()
+    # Sources and latency metrics of assistant replies
+    metadata = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bot", "created_at"], name="message_bot_created_idx"),
+            models.Index(fields=["conversation", "created_at"], name="message_conversation_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.role} message in Conversation {self.conversation_id}"
+
+
+class Feedback(models.Model):
+    """A thumbs up or down given by a widget visitor to the replies of a conversation.
+
+    One per conversation, voting again replaces the rating.
+    """
+
+    RATING_CHOICES = [
+        (1, "Up"),
+        (-1, "Down"),
+    ]
+
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name="feedback")
+    # Not a foreign key, the conversation may still be waiting in the message buffer
+    conversation_id = models.UUIDField()
+    rating = models.SmallIntegerField(choices=RATING_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Until the rollups count the current rating (see bot/analytics.py)
+    pending = models.BooleanField(default=True)
+    # The rating the rollups count, None if none is
+    folded_rating = models.SmallIntegerField(choices=RATING_CHOICES, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bot", "conversation_id"], name="unique_conversation_feedback"),
+        ]
+        indexes = [
+            models.Index(fields=["id"], name="feedback_pending_idx", condition=models.Q(pending=True)),
+        ]
+
+    def __str__(self):
+        return f"Feedback {self.rating:+d} on Conversation {self.conversation_id}"
+
+
+class AnalyticsRollup(models.Model):
+    """Activity counters of a bot over one hour or one (UTC) day, see bot/analytics.py."""
+
+    PERIOD_CHOICES = [
+        ("hour", "Hour"),
+        ("day", "Day"),
+    ]
+
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name="rollups")
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    conversations = models.PositiveIntegerField(default=0)
+    questions = models.PositiveIntegerField(default=0)
+    unanswered = models.PositiveIntegerField(default=0)
+    thumbs_up = models.PositiveIntegerField(default=0)
+    thumbs_down = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bot", "period", "start"], name="unique_analytics_rollup"),
+        ]
+
+    def __str__(self):
+        return f"Rollup of Bot {self.bot_id} for the {self.period} from {self.start}"
+
+
+class UnansweredQuestion(models.Model):
+    """How often a (normalized) question found no knowledge on one day."""
+
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name="unanswered_questions")
+    day = models.DateField()
+    question = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bot", "day", "question"], name="unique_unanswered_question"),
+        ]
+
+    def __str__(self):
+        return f"{self.question} ({self.count} on {self.day})"
+
+
+class RollupWatermark(models.Model):
+    """The last row of a source table folded into the rollups."""
+
+    source = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    # Ids folded within ANALYTICS_ROLLUP_ID_LAG of last_id, the others there are folded late
+    recent_ids = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} rolled up to {self.last_id}"
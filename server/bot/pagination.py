@@ -0,0 +1,52 @@
+"""Keyset (cursor) pagination on `(created_at, id)`.
+
+A cursor is the position of the last row of a page, so fetching the next page is an
+index range scan no matter how deep the client pages, unlike OFFSET.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+
+
+def encode_cursor(created_at: datetime, pk) -> str:
+    payload = json.dumps([created_at.isoformat(), str(pk)]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, pk = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), pk
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def page_limit(limit: Optional[int]) -> int:
+    if limit is None:
+        return settings.PAGE_SIZE_DEFAULT
+    if not 1 <= limit <= settings.PAGE_SIZE_MAX:
+        raise ValueError(f"limit must be between 1 and {settings.PAGE_SIZE_MAX}")
+    return limit
+
+
+def paginate(queryset: QuerySet, cursor: Optional[str], limit: int) -> Tuple[list, Optional[str]]:
+    """One page of `queryset` after `cursor`, and the cursor of the next page (or None)."""
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        try:
+            pk = queryset.model._meta.pk.to_python(pk)
+        except ValidationError as e:
+            raise ValueError("Invalid cursor") from e
+        queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+
+    rows = list(queryset.order_by("created_at", "id")[: limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
@@ -0,0 +1,326 @@
+"""Per-bot BM25 inverted index over KnowledgeChunk text.
+
+The index is a set of immutable segments plus immutable `manifest-<generation>.json`
+files, each naming the segments of one generation and the chunk ids deleted since they
+were written. An update starts from a base generation, only tokenizes chunks that are
+new since then and tombstones removed ones; segments are merged once there are too many
+of them or too many tombstones. Which generation is searched is decided by the bot's
+active knowledge version (see `versions.py`).
+
+Each segment directory holds `.npy` arrays that are memory-mapped on load:
+
+- `doc_ids` (int64, sorted chunk ids) and `doc_lens` (int32 token counts)
+- `terms` (sorted unicode) with `offsets` (int64) into the postings
+- `postings` (uint32 positions in `doc_ids`) and `tfs` (uint16 term frequencies)
+"""
+
+import heapq
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from bot.models import Bot, KnowledgeChunk
+from .vector_index import bot_index_dir
+
+# Keeps product codes, versions and error strings ("ERR-4012", "v2.3.1") as single terms
+TERM_RE = re.compile(r"\w+(?:[\-./:]\w+)*", re.UNICODE)
+
+K1 = 1.2
+B = 0.75
+
+_cache: Dict[str, Tuple[str, "BM25Index"]] = {}
+_cache_lock = threading.Lock()
+
+
+def analyze(text: str) -> List[str]:
+    """Lowercased terms of `text`; compound terms also emit their parts."""
+    terms = []
+    for match in TERM_RE.finditer(text.lower()):
+        term = match.group()
+        terms.append(term)
+        if not term.isalnum():
+            terms.extend(part for part in re.split(r"[\-./:]", term) if part)
+    return terms
+
+
+def bm25_dir(bot_id) -> Path:
+    return bot_index_dir(bot_id) / "bm25"
+
+
+class Segment:
+    FILES = ("doc_ids", "doc_lens", "terms", "offsets", "postings", "tfs")
+
+    def __init__(self, path: Path):
+        self.name = path.name
+        for name in self.FILES:
+            setattr(self, name, np.load(path / f"{name}.npy", mmap_mode="r"))
+
+    def lookup(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """`(positions, tfs)` of a term's postings, or None if the term is absent."""
+        i = int(np.searchsorted(self.terms, term))
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.postings[start:end], self.tfs[start:end]
+
+    @staticmethod
+    def write(path: Path, doc_ids: np.ndarray, doc_lens: np.ndarray, postings: Dict[str, Tuple[list, list]]):
+        path.mkdir(parents=True)
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[term][0]) for term in terms], out=offsets[1:])
+
+        arrays = {
+            "doc_ids": np.asarray(doc_ids, dtype=np.int64),
+            "doc_lens": np.asarray(doc_lens, dtype=np.int32),
+            "terms": np.array(terms, dtype=str) if terms else np.array([], dtype="<U1"),
+            "offsets": offsets,
+            "postings": np.fromiter((p for term in terms for p in postings[term][0]), dtype=np.uint32, count=int(offsets[-1])),
+            "tfs": np.fromiter((min(tf, 65535) for term in terms for tf in postings[term][1]), dtype=np.uint16, count=int(offsets[-1])),
+        }
+        for name, array in arrays.items():
+            np.save(path / f"{name}.npy", array)
+
+    @classmethod
+    def build(cls, path: Path, docs: List[Tuple[int, str]]):
+        """Write a segment from `(chunk_id, text)` pairs."""
+        docs = sorted(docs)
+        postings = defaultdict(lambda: ([], []))
+        doc_lens = []
+        for position, (_, text) in enumerate(docs):
+            terms = analyze(text)
+            doc_lens.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings[term][0].append(position)
+                postings[term][1].append(tf)
+        cls.write(path, [chunk_id for chunk_id, _ in docs], doc_lens, postings)
+
+    @classmethod
+    def merge(cls, path: Path, segments: List["Segment"], deleted: np.ndarray):
+        """Write one segment holding the live documents of `segments`."""
+        alive = [np.isin(segment.doc_ids, deleted, invert=True) for segment in segments]
+        doc_ids = np.concatenate([segment.doc_ids[mask] for segment, mask in zip(segments, alive)])
+        doc_lens = np.concatenate([segment.doc_lens[mask] for segment, mask in zip(segments, alive)])
+        order = np.argsort(doc_ids)
+        doc_ids, doc_lens = doc_ids[order], doc_lens[order]
+        # Old position -> new position, -1 for deleted documents
+        remaps = [np.where(mask, np.searchsorted(doc_ids, segment.doc_ids), -1) for segment, mask in zip(segments, alive)]
+
+        postings = defaultdict(lambda: ([], []))
+        for segment, remap in zip(segments, remaps):
+            for i, term in enumerate(segment.terms):
+                start, end = segment.offsets[i], segment.offsets[i + 1]
+                positions = remap[segment.postings[start:end]]
+                keep = positions >= 0
+                if keep.any():
+                    postings[str(term)][0].extend(positions[keep].tolist())
+                    postings[str(term)][1].extend(segment.tfs[start:end][keep].tolist())
+
+        for term_postings in postings.values():
+            # Keep postings in position order after interleaving segments
+            order = np.argsort(term_postings[0], kind="stable")
+            term_postings[0][:] = np.asarray(term_postings[0])[order].tolist()
+            term_postings[1][:] = np.asarray(term_postings[1])[order].tolist()
+
+        cls.write(path, doc_ids, doc_lens, postings)
+
+
+class BM25Index:
+    def __init__(self, segments: List[Segment], deleted: np.ndarray, doc_count: int, total_len: int):
+        self.segments = segments
+        self.doc_count = doc_count
+        self.avgdl = total_len / doc_count if doc_count else 0.0
+        self.alive = [np.isin(segment.doc_ids, deleted, invert=True) for segment in segments]
+
+    def _idf(self, df: int) -> float:
+        return math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+
+    def _score(self, segment: Segment, positions: np.ndarray, tfs: np.ndarray, idf: float) -> np.ndarray:
+        tfs = tfs.astype(np.float32)
+        lens = segment.doc_lens[positions].astype(np.float32)
+        return idf * tfs * (K1 + 1) / (tfs + K1 * (1 - B + B * lens / self.avgdl))
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k `(chunk_id, score)` pairs by BM25, best first.
+
+        Terms are visited by decreasing score upper bound (MaxScore). Once the bounds of
+        the remaining terms add up to less than the current k-th best score, documents
+        not seen yet can't make the top k, so the remaining posting lists are only probed
+        for existing candidates instead of being scanned.
+        """
+        if not self.doc_count:
+            return []
+
+        terms = []
+        for term in set(analyze(query)):
+            lists = []
+            for segment, alive in zip(self.segments, self.alive):
+                found = segment.lookup(term)
+                if found is not None:
+                    lists.append((segment, alive, *found))
+            # Like Lucene, tombstoned documents count towards df until their segment is merged
+            df = sum(len(positions) for _, _, positions, _ in lists)
+            if df:
+                idf = self._idf(df)
+                terms.append((idf * (K1 + 1), idf, lists))
+        terms.sort(key=lambda term: term[0], reverse=True)
+
+        scores: Dict[int, float] = defaultdict(float)
+        remaining = sum(bound for bound, _, _ in terms)
+        for bound, idf, lists in terms:
+            remaining -= bound
+            essential = len(scores) < k or remaining + bound > heapq.nlargest(k, scores.values())[-1]
+
+            for segment, alive, positions, tfs in lists:
+                if not essential:
+                    candidates = np.array(list(scores), dtype=np.int64)
+                    local = np.searchsorted(segment.doc_ids, candidates)
+                    local = local[(local < len(segment.doc_ids)) & (segment.doc_ids[np.minimum(local, len(segment.doc_ids) - 1)] == candidates)]
+                    hits = np.searchsorted(positions, local)
+                    hits = hits[(hits < len(positions)) & (positions[np.minimum(hits, len(positions) - 1)] == local)]
+                    positions, tfs = positions[hits], tfs[hits]
+
+                keep = alive[positions]
+                positions, tfs = positions[keep], tfs[keep]
+                for chunk_id, score in zip(segment.doc_ids[positions].tolist(), self._score(segment, positions, tfs, idf).tolist()):
+                    scores[chunk_id] += score
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def _manifest_path(root: Path, generation: str) -> Path:
+    return root / f"manifest-{generation}.json"
+
+
+def _read_manifest(root: Path, generation: Optional[str]) -> Optional[dict]:
+    if not generation:
+        return None
+    try:
+        return json.loads(_manifest_path(root, generation).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(root: Path, manifest: dict) -> str:
+    generation = uuid.uuid4().hex
+    manifest["generation"] = generation
+    tmp = root / f"manifest.{generation}.tmp"
+    tmp.write_text(json.dumps(manifest))
+    os.replace(tmp, _manifest_path(root, generation))
+    return generation
+
+
+def update_bm25_index(bot: Bot, base: Optional[str] = None) -> Tuple[str, dict]:
+    """Write a keyword index generation of the live chunks of `bot`, starting from generation `base`.
+
+    Only chunks added since `base` are tokenized, into a new segment; chunks no longer
+    live are tombstoned. Returns the new generation, `base` itself if nothing changed,
+    and counters for the update.
+    """
+    root = bm25_dir(bot.id)
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = _read_manifest(root, base)
+    if manifest is None:
+        base = None
+        manifest = {"generation": None, "segments": [], "deleted": [], "doc_count": 0, "total_len": 0}
+    segments = [Segment(root / name) for name in manifest["segments"]]
+    deleted = set(manifest["deleted"])
+
+    indexed = set()
+    lens = {}
+    for segment in segments:
+        for chunk_id, length in zip(segment.doc_ids.tolist(), segment.doc_lens.tolist()):
+            if chunk_id not in deleted:
+                indexed.add(chunk_id)
+                lens[chunk_id] = length
+
+    live = set(bot.chunks.filter(retired_in__isnull=True).values_list("id", flat=True))
+    added = sorted(live - indexed)
+    removed = indexed - live
+
+    total_len = manifest["total_len"] - sum(lens[chunk_id] for chunk_id in removed)
+    deleted |= removed
+
+    if added:
+        name = f"seg-{uuid.uuid4().hex}"
+        docs = []
+        for i in range(0, len(added), 1000):
+            docs.extend(KnowledgeChunk.objects.filter(id__in=added[i : i + 1000]).values_list("id", "content__text"))
+        Segment.build(root / name, docs)
+        segment = Segment(root / name)
+        segments.append(segment)
+        total_len += int(segment.doc_lens.sum())
+
+    indexed_count = sum(len(segment.doc_ids) for segment in segments)
+    if len(segments) > settings.BOT_BM25_MAX_SEGMENTS or (deleted and len(deleted) > indexed_count * settings.BOT_BM25_MAX_DELETED_RATIO):
+        name = f"seg-{uuid.uuid4().hex}"
+        Segment.merge(root / name, segments, np.fromiter(deleted, dtype=np.int64, count=len(deleted)))
+        segments = [Segment(root / name)]
+        deleted = set()
+
+    generation = base
+    if base is None or added or removed or len(segments) != len(manifest["segments"]):
+        generation = _write_manifest(
+            root,
+            {"segments": [segment.name for segment in segments], "deleted": sorted(deleted), "doc_count": len(live), "total_len": total_len},
+        )
+
+    return generation, {"keyword_added": len(added), "keyword_removed": len(removed), "keyword_segments": len(segments)}
+
+
+def remove_unused_generations(bot_id, keep: Set[str]):
+    """Delete the manifests of a bot not in `keep`, and the segments none of the kept ones use."""
+    root = bm25_dir(bot_id)
+    used = set()
+    for generation in keep:
+        manifest = _read_manifest(root, generation)
+        if manifest is not None:
+            used.update(manifest["segments"])
+
+    for path in root.glob("manifest*"):
+        if path.stem.removeprefix("manifest-") not in keep:
+            path.unlink(missing_ok=True)
+    # Removed segments stay readable for processes that still have them mapped
+    for path in root.glob("seg-*"):
+        if path.name not in used:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def get_bm25_index(bot_id, generation: str) -> Optional[BM25Index]:
+    """Generation `generation` of the keyword index of a bot, loaded once per process."""
+    root = bm25_dir(bot_id)
+
+    key = str(bot_id)
+    cached = _cache.get(key)
+    if cached and cached[0] == generation:
+        return cached[1]
+
+    with _cache_lock:
+        manifest = _read_manifest(root, generation)
+        try:
+            segments = [Segment(root / name) for name in manifest["segments"]] if manifest else None
+        except FileNotFoundError:
+            segments = None
+        if segments is None:
+            # Pruned since the caller read the active version
+            return None
+        index = BM25Index(segments, np.array(manifest["deleted"], dtype=np.int64), manifest["doc_count"], manifest["total_len"])
+        _cache[key] = (generation, index)
+    return index
+
+
+def search(bot_id, generation: str, query: str, k: int) -> List[Tuple[int, float]]:
+    index = get_bm25_index(bot_id, generation)
+    if index is None:
+        return []
+    return index.search(query, k)
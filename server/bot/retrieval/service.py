@@ -0,0 +1,59 @@
+from collections import defaultdict
+from typing import List, Tuple
+
+from django.conf import settings
+
+from bot.models import KnowledgeChunk
+from bot.tasks.embedder import get_embedder
+from . import bm25, vector_index
+from .versions import read_active
+
+SEARCH_MODES = ("hybrid", "vector", "keyword")
+
+# Rank offset of reciprocal rank fusion; 60 is the value from the original RRF paper
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], k: int) -> List[Tuple[int, float]]:
+    """Fuse ranked `(chunk_id, score)` lists by summing `1 / (RRF_K + rank)` per list."""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, start=1):
+            fused[chunk_id] += 1.0 / (RRF_K + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def search_knowledge(bot_id, queries: List[str], k: int = 5, mode: str = "hybrid") -> List[List[dict]]:
+    """Top-k knowledge chunks of a bot for each query, best first.
+
+    `mode` picks embedding similarity, BM25 keyword matching, or both fused with
+    reciprocal rank fusion. The active knowledge version is read once, so both searches
+    see the same version.
+    """
+    if not queries:
+        return []
+    version = read_active(bot_id)
+    if version is None:
+        return [[] for _ in queries]
+
+    if mode == "keyword":
+        hits = [bm25.search(bot_id, version.keywords, query, k) for query in queries]
+    elif mode == "vector":
+        hits = vector_index.search(bot_id, version.vectors, get_embedder().embed(queries), k)
+    else:
+        candidates = max(k, settings.BOT_SEARCH_CANDIDATES)
+        vector_hits = vector_index.search(bot_id, version.vectors, get_embedder().embed(queries), candidates)
+        hits = [reciprocal_rank_fusion([semantic, bm25.search(bot_id, version.keywords, query, candidates)], k) for query, semantic in zip(queries, vector_hits)]
+
+    chunk_ids = {chunk_id for row in hits for chunk_id, _ in row}
+    chunks = KnowledgeChunk.objects.select_related("content").only("id", "knowledge_item_id", "content__text").in_bulk(chunk_ids)
+
+    return [
+        [
+            {"chunk_id": chunk_id, "knowledge_item_id": str(chunks[chunk_id].knowledge_item_id), "score": round(score, 4), "text": chunks[chunk_id].content.text}
+            for chunk_id, score in row
+            # Chunks deleted since the version was built are skipped
+            if chunk_id in chunks
+        ]
+        for row in hits
+    ]
@@ -0,0 +1,264 @@
+"""Per-bot vector index over KnowledgeChunk embeddings.
+
+An index is a directory holding `vectors.npy` (float32, or int8 plus per-row
+`scales.npy` when BOT_INDEX_QUANTIZE is on) and `chunk_ids.npy`. Files are opened with
+`mmap_mode="r"`, so every worker process on a host shares one copy through the page
+cache. Index directories are immutable; which one is searched is decided by the bot's
+active knowledge version (see `versions.py`).
+
+A full scan reads the whole matrix for every query (100 MB at 100k chunks of 256
+dimensions, about 10 ms), so indexes of at least BOT_INDEX_PARTITION_MIN_ROWS rows are
+also partitioned: spherical k-means places about sqrt(rows) centroids
+(`centroids.npy`), and the rows are stored grouped by nearest centroid, partition `i`
+being rows `offsets[i]:offsets[i + 1]` (`offsets.npy`). A query scans only its
+BOT_INDEX_PROBES nearest partitions and ranks their rows exactly, so a row of a
+partition it didn't probe can be missed.
+"""
+
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from bot.models import Bot
+
+# Rows converted to float32 at a time when scoring an int8 index
+_QUANTIZED_BLOCK_ROWS = 4096
+# Rows sampled per centroid to place the centroids, and k-means iterations
+_PARTITION_SAMPLE_ROWS = 64
+_PARTITION_ITERATIONS = 10
+
+_cache: Dict[str, Tuple[str, "VectorIndex"]] = {}
+_cache_lock = threading.Lock()
+
+
+def bot_index_dir(bot_id) -> Path:
+    return Path(settings.BOT_INDEX_ROOT) / str(bot_id)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Columns of the `k` best scores of each row of `scores`, best first."""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+class VectorIndex:
+    def __init__(
+        self,
+        chunk_ids: np.ndarray,
+        vectors: np.ndarray,
+        scales: Optional[np.ndarray] = None,
+        centroids: Optional[np.ndarray] = None,
+        offsets: Optional[np.ndarray] = None,
+    ):
+        self.chunk_ids = chunk_ids
+        self.vectors = vectors
+        self.scales = scales
+        self.centroids = centroids
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    @classmethod
+    def load(cls, path: Path) -> "VectorIndex":
+        def optional(name):
+            return np.load(path / name, mmap_mode="r") if (path / name).exists() else None
+
+        return cls(
+            chunk_ids=np.load(path / "chunk_ids.npy", mmap_mode="r"),
+            vectors=np.load(path / "vectors.npy", mmap_mode="r"),
+            scales=optional("scales.npy"),
+            centroids=optional("centroids.npy"),
+            offsets=optional("offsets.npy"),
+        )
+
+    def rows(self, selection) -> np.ndarray:
+        """Indexed vectors `selection` (a slice or row numbers) as float32."""
+        if self.scales is None:
+            return self.vectors[selection]
+        return self.vectors[selection].astype(np.float32) * self.scales[selection, None]
+
+    def _range_scores(self, queries: np.ndarray, start: int, stop: int) -> np.ndarray:
+        if self.scales is None:
+            return queries @ self.vectors[start:stop].T
+        # Scaled after the product, one multiplication per score instead of per element
+        return (queries @ self.vectors[start:stop].astype(np.float32).T) * self.scales[start:stop]
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Similarity of each query (rows of `queries`) to every indexed vector."""
+        if self.scales is None:
+            return self._range_scores(queries, 0, len(self))
+
+        out = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), _QUANTIZED_BLOCK_ROWS):
+            stop = min(start + _QUANTIZED_BLOCK_ROWS, len(self))
+            out[:, start:stop] = self._range_scores(queries, start, stop)
+        return out
+
+    def search(self, queries: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        """Top-k `(chunk_id, score)` pairs for each query, best first."""
+        if len(self) == 0:
+            return [[] for _ in range(len(queries))]
+
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.centroids is None:
+            scores = self.scores(queries)
+            top = _top_k(scores, k)
+            return [self._hits(row, row_scores[row]) for row, row_scores in zip(top, scores)]
+        return [self._search_partitions(query, k) for query in queries]
+
+    def _search_partitions(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        probes = min(settings.BOT_INDEX_PROBES, len(self.centroids))
+        nearest = _top_k((self.centroids @ query)[None], probes)[0]
+        ranges = [(int(self.offsets[i]), int(self.offsets[i + 1])) for i in nearest]
+        if sum(stop - start for start, stop in ranges) < min(k, len(self)):
+            # Too few rows near the query, everything is ranked
+            scores = self.scores(query[None])
+            top = _top_k(scores, k)[0]
+            return self._hits(top, scores[0, top])
+
+        rows = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+        scores = np.concatenate([self._range_scores(query[None], start, stop)[0] for start, stop in ranges])
+        top = _top_k(scores[None], k)[0]
+        return self._hits(rows[top], scores[top])
+
+    def _hits(self, rows: np.ndarray, scores: np.ndarray) -> List[Tuple[int, float]]:
+        return [(int(self.chunk_ids[i]), float(score)) for i, score in zip(rows, scores)]
+
+
+def _place_centroids(sample: np.ndarray, count: int) -> np.ndarray:
+    """Spherical k-means: `count` unit vectors, each the mean direction of its rows of `sample`."""
+    rng = np.random.default_rng(0)
+    centroids = sample[rng.choice(len(sample), count, replace=False)].copy()
+    for _ in range(_PARTITION_ITERATIONS):
+        nearest = np.argmax(sample @ centroids.T, axis=1)
+        order = np.argsort(nearest, kind="stable")
+        sizes = np.bincount(nearest, minlength=count)
+        used = sizes > 0
+        # A centroid left without rows stays where it was
+        sums = np.add.reduceat(sample[order], (np.cumsum(sizes) - sizes)[used], axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids[used] = sums / np.where(norms > 0, norms, 1)
+    return centroids
+
+
+def partition_index(path: Path):
+    """Group the rows of the index at `path` by nearest centroid, see the module docstring."""
+    index = VectorIndex.load(path)
+    count = len(index)
+    lists = max(int(np.sqrt(count)), 1)
+    sample = np.sort(np.random.default_rng(0).choice(count, min(count, lists * _PARTITION_SAMPLE_ROWS), replace=False))
+    centroids = _place_centroids(index.rows(sample), lists)
+
+    nearest = np.empty(count, dtype=np.int64)
+    for start in range(0, count, _QUANTIZED_BLOCK_ROWS):
+        stop = min(start + _QUANTIZED_BLOCK_ROWS, count)
+        nearest[start:stop] = np.argmax(index.rows(slice(start, stop)) @ centroids.T, axis=1)
+    order = np.argsort(nearest, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(nearest, minlength=lists)))).astype(np.int64)
+
+    # Written next to the originals, then renamed over them
+    names = [name for name in ("chunk_ids", "vectors", "scales") if (path / f"{name}.npy").exists()]
+    for name in names:
+        source = getattr(index, name)
+        target = np.lib.format.open_memmap(path / f"{name}.tmp.npy", mode="w+", dtype=source.dtype, shape=source.shape)
+        for start in range(0, count, _QUANTIZED_BLOCK_ROWS):
+            target[start : start + _QUANTIZED_BLOCK_ROWS] = source[order[start : start + _QUANTIZED_BLOCK_ROWS]]
+        target.flush()
+        del target
+    del index
+    for name in names:
+        os.replace(path / f"{name}.tmp.npy", path / f"{name}.npy")
+    np.save(path / "centroids.npy", centroids.astype(np.float32))
+    np.save(path / "offsets.npy", offsets)
+
+
+def build_vector_index(bot: Bot, quantize: Optional[bool] = None) -> str:
+    """Write a fresh index for `bot` from the embeddings of its live chunks. Returns its name."""
+    quantize = settings.BOT_INDEX_QUANTIZE if quantize is None else quantize
+    root = bot_index_dir(bot.id)
+    root.mkdir(parents=True, exist_ok=True)
+    name = f"vectors-{uuid.uuid4().hex}"
+    path = root / name
+    path.mkdir()
+
+    chunks = bot.chunks.filter(retired_in__isnull=True)
+    count = chunks.count()
+    dim = settings.BOT_EMBEDDING_DIM
+    chunk_ids = np.lib.format.open_memmap(path / "chunk_ids.npy", mode="w+", dtype=np.int64, shape=(count,))
+    vectors = np.lib.format.open_memmap(path / "vectors.npy", mode="w+", dtype=np.int8 if quantize else np.float32, shape=(count, dim))
+    scales = np.lib.format.open_memmap(path / "scales.npy", mode="w+", dtype=np.float32, shape=(count,)) if quantize else None
+
+    row = 0
+    for chunk_id, embedding in chunks.order_by("id").values_list("id", "content__embedding").iterator(chunk_size=2000):
+        if row == count:
+            # Chunks added after counting are picked up by the next build
+            break
+        vector = np.frombuffer(embedding, dtype=np.float32)
+        chunk_ids[row] = chunk_id
+        if quantize:
+            scale = float(np.abs(vector).max()) / 127 or 1.0
+            vectors[row] = np.round(vector / scale).astype(np.int8)
+            scales[row] = scale
+        else:
+            vectors[row] = vector
+        row += 1
+
+    for array in (chunk_ids, vectors, scales):
+        if array is not None:
+            array.flush()
+    if row < count:
+        # Chunks deleted while building: rewrite the arrays at their real length
+        np.save(path / "chunk_ids.npy", np.array(chunk_ids[:row]))
+        np.save(path / "vectors.npy", np.array(vectors[:row]))
+        if quantize:
+            np.save(path / "scales.npy", np.array(scales[:row]))
+    del chunk_ids, vectors, scales
+    if row >= settings.BOT_INDEX_PARTITION_MIN_ROWS:
+        partition_index(path)
+    return name
+
+
+def remove_unused_indexes(bot_id, keep: Set[str]):
+    """Delete the index directories of a bot not named in `keep`."""
+    root = bot_index_dir(bot_id)
+    # Removed directories stay readable for processes that still have them mapped
+    for path in root.glob("vectors-*"):
+        if path.name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def get_vector_index(bot_id, name: str) -> Optional[VectorIndex]:
+    """The index `name` of a bot, memory-mapped once per process."""
+    root = bot_index_dir(bot_id)
+    key = str(bot_id)
+    cached = _cache.get(key)
+    if cached and cached[0] == name:
+        return cached[1]
+
+    with _cache_lock:
+        try:
+            index = VectorIndex.load(root / name)
+        except FileNotFoundError:
+            # Pruned since the caller read the active version
+            return None
+        _cache[key] = (name, index)
+    return index
+
+
+def search(bot_id, name: str, query_vectors: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+    index = get_vector_index(bot_id, name)
+    if index is None:
+        return [[] for _ in range(len(query_vectors))]
+    return index.search(query_vectors, k)
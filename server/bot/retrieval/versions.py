@@ -0,0 +1,89 @@
+"""Knowledge versions of a bot and the pointer to the one chat is served from.
+
+Every training run builds a new KnowledgeVersion next to the active one: chunks it
+drops are retired rather than deleted, and it gets its own vector index directory and
+BM25 generation. Publishing replaces the `ACTIVE` file in the bot's index directory
+with an atomic rename, so a search reads the index names of one version at once and
+keeps using them even if another version is published meanwhile. The last
+`BOT_KNOWLEDGE_VERSIONS_KEPT` ready versions stay on disk for rollback.
+"""
+
+import json
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from bot.chat.answer_cache import bump_knowledge_version
+from bot.models import Bot, KnowledgeVersion
+from bot.tasks.chunk_store import delete_chunks
+from . import bm25, vector_index
+
+
+@dataclass(frozen=True)
+class ActiveVersion:
+    number: int
+    vectors: str
+    keywords: str
+
+
+def read_active(bot_id) -> Optional[ActiveVersion]:
+    """The version a bot is served from, None before its first training run."""
+    try:
+        pointer = json.loads((vector_index.bot_index_dir(bot_id) / "ACTIVE").read_text())
+    except FileNotFoundError:
+        return None
+    return ActiveVersion(pointer["number"], pointer["vectors"], pointer["keywords"])
+
+
+def create_version(bot: Bot) -> KnowledgeVersion:
+    last = bot.versions.order_by("-number").values_list("number", flat=True).first()
+    return KnowledgeVersion.objects.create(bot=bot, number=(last or 0) + 1)
+
+
+def activate_version(version: KnowledgeVersion):
+    """Serve `version` from now on. Also used to roll back to a retained version."""
+    root = vector_index.bot_index_dir(version.bot_id)
+    root.mkdir(parents=True, exist_ok=True)
+    pointer = root / f"ACTIVE.{uuid.uuid4().hex}"
+    pointer.write_text(json.dumps({"number": version.number, "vectors": version.vector_index, "keywords": version.keyword_index}))
+    os.replace(pointer, root / "ACTIVE")
+
+    version.status = "ready"
+    version.activated_at = timezone.now()
+    with transaction.atomic():
+        KnowledgeVersion.objects.filter(id=version.id).update(status=version.status, activated_at=version.activated_at)
+        # update() rather than save(), saving the bot would queue another training run
+        Bot.objects.filter(id=version.bot_id).update(active_version=version)
+    # Cached answers may quote knowledge the version doesn't have
+    bump_knowledge_version(version.bot_id)
+
+
+def prune_versions(bot: Bot) -> dict:
+    """Archive the versions of `bot` past retention and delete their chunks and index files.
+
+    The active version is always retained, even after a rollback to an old one.
+    Returns counters for the run.
+    """
+    kept = list(bot.versions.filter(status="ready").order_by("-number")[: settings.BOT_KNOWLEDGE_VERSIONS_KEPT])
+    active_id = Bot.objects.filter(id=bot.id).values_list("active_version_id", flat=True).first()
+    if active_id is not None and active_id not in {version.id for version in kept}:
+        kept.extend(bot.versions.filter(id=active_id))
+    if not kept:
+        return {"versions_archived": 0, "chunks_pruned": 0}
+
+    archived = bot.versions.filter(status="ready").exclude(id__in=[version.id for version in kept]).update(status="archived")
+    # A chunk retired in version N belongs to the versions before N only
+    oldest = min(version.number for version in kept)
+    pruned = bot.chunks.filter(retired_in__lte=oldest)
+    count = pruned.count()
+    if count:
+        delete_chunks(pruned)
+
+    vector_index.remove_unused_indexes(bot.id, {version.vector_index for version in kept})
+    bm25.remove_unused_generations(bot.id, {version.keyword_index for version in kept})
+    return {"versions_archived": archived, "chunks_pruned": count}
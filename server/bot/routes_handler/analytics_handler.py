@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Optional
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from ninja import Router
+
+from ..analytics import PERIODS, acsv_lines, csv_lines, get_analytics
+from ..models import Bot
+
+router = Router()
+
+PERIOD_LENGTHS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+# Range served when `since` is omitted
+DEFAULT_PERIODS = {"hour": 48, "day": 30}
+
+
+def analytics_range(period: str, since: Optional[datetime], until: Optional[datetime]):
+    """Validated `(since, until)` for a period size, naive datetimes taken as UTC."""
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    until = until or timezone.now()
+    since = since or until - PERIOD_LENGTHS[period] * DEFAULT_PERIODS[period]
+    since, until = [moment if timezone.is_aware(moment) else moment.replace(tzinfo=dt_timezone.utc) for moment in (since, until)]
+    if since >= until:
+        raise ValueError("since must be before until")
+    if until - since > PERIOD_LENGTHS[period] * settings.ANALYTICS_MAX_PERIODS:
+        raise ValueError(f"At most {settings.ANALYTICS_MAX_PERIODS} {period}s can be requested at once")
+    return since, until
+
+
+@router.get("/bot/{bot_id}/analytics", response={200: dict, 400: dict, 404: dict})
+def get_bot_analytics(request, bot_id: str, period: str = "day", since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Conversation, question, unanswered and feedback counts per hour or day, read from the rollups."""
+    try:
+        since, until = analytics_range(period, since, until)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+
+    if not Bot.objects.filter(id=bot_id, company=request.company).exists():
+        return 404, {"error": "Bot not found"}
+
+    return 200, {"period": period, "since": since, "until": until, **get_analytics(bot_id, period, since, until)}
+
+
+@router.get("/bot/{bot_id}/analytics/export", response={200: None, 400: dict, 404: dict})
+def export_bot_analytics(request, bot_id: str, period: str = "day", since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """The rollups of a range as CSV, streamed row by row."""
+    try:
+        since, until = analytics_range(period, since, until)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+
+    if not Bot.objects.filter(id=bot_id, company=request.company).exists():
+        return 404, {"error": "Bot not found"}
+
+    lines = acsv_lines if isinstance(request, ASGIRequest) else csv_lines
+    response = StreamingHttpResponse(lines(bot_id, period, since, until), content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="analytics-{bot_id}-{period}.csv"'
+    return response
@@ -1,8 +1,28 @@
-from ninja import Router, Schema
+import os
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Prefetch
+from django.db.models.functions import Length, Substr
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, StreamingHttpResponse
+from ninja import File, Router, Schema
+from ninja.files import UploadedFile
 from typing import List, Optional
-from ..models import Bot, KnowledgeItem
+from ..models import Bot, Feedback, KnowledgeItem, KnowledgeVersion
 from company.models import Company
+from ..pagination import page_limit, paginate
+from ..domains import publish_domains
+from ..importing import IMPORT_FORMATS, KnowledgeImportError, detect_format, import_knowledge
+from ..chat.conversations import parse_conversation_id
+from ..chat.service import astream_chat, stream_chat
+from ..retrieval.service import SEARCH_MODES, search_knowledge
+from ..retrieval.versions import activate_version
+from ..status import aget_status_snapshot, aget_status_token, astatus_events, await_status_change, status_events
 from ..tasks.embeddings import create_embeddings
+from ..widget import invalidate_widget_config
 from ..models import WhitelistedDomain
 
 router = Router()
@@ -21,12 +41,84 @@ class BotCreateSchema(Schema):
 
 
 class BotResponseSchema(Schema):
+    id: Optional[str] = None
+    name: Optional[str] = None
+    tone: Optional[str] = None
+    company: Optional[dict] = None
+    knowledge_items: Optional[List[dict]] = None
+    whitelisted_domains: Optional[List[str]] = None
+
+
+# Fields selectable with `?fields=`; "knowledge_items.content" adds item bodies
+BOT_FIELDS = ("id", "name", "tone", "company", "knowledge_items", "knowledge_items.content", "whitelisted_domains")
+
+
+def parse_bot_fields(fields: Optional[str]) -> set:
+    if not fields:
+        return set(BOT_FIELDS)
+    selected = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = selected - set(BOT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    if "knowledge_items.content" in selected:
+        selected.add("knowledge_items")
+    return selected
+
+
+def bots_queryset(selected: set):
+    """Bots with the relations needed for `selected` fields prefetched in one query each."""
+    bots = Bot.objects.only("id", "name", "tone", "company_id", "created_at")
+    if "knowledge_items" in selected:
+        items = KnowledgeItem.objects.only("id", "bot_id", "type").order_by("created_at", "id")
+        if "knowledge_items.content" in selected:
+            items = items.only("id", "bot_id", "type", "content")
+        bots = bots.prefetch_related(Prefetch("knowledge_items", queryset=items))
+    if "whitelisted_domains" in selected:
+        bots = bots.prefetch_related(Prefetch("whitelisted_domains", queryset=WhitelistedDomain.objects.only("id", "bot_id", "domain")))
+    return bots
+
+
+def set_next_cursor(request, response: HttpResponse, next_cursor: Optional[str]):
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+        query = request.GET.copy()
+        query["cursor"] = next_cursor
+        response["Link"] = f'<{request.path}?{query.urlencode()}>; rel="next"'
+
+
+def serialize_bot(bot: Bot, company: Company, selected: set) -> dict:
+    data = {
+        "id": str(bot.id),
+        "name": bot.name,
+        "tone": bot.tone,
+        "company": {"id": str(company.id), "name": company.name},
+    }
+    data = {field: value for field, value in data.items() if field in selected}
+    if "knowledge_items" in selected:
+        with_content = "knowledge_items.content" in selected
+        data["knowledge_items"] = [
+            {"id": str(item.id), "type": item.type, **({"content": item.content} if with_content else {})} for item in bot.knowledge_items.all()
+        ]
+    if "whitelisted_domains" in selected:
+        data["whitelisted_domains"] = [str(domain.domain) for domain in bot.whitelisted_domains.all()]
+    return data
+
+
+class KnowledgeItemPreviewSchema(Schema):
     id: str
-    name: str
-    tone: str
-    company: dict
-    knowledge_items: List[dict]
-    whitelisted_domains: List[str]
+    type: str
+    preview: str
+    length: int
+    created_at: str
+    updated_at: str
+
+
+class KnowledgeItemResponseSchema(Schema):
+    id: str
+    type: str
+    content: str
+    created_at: str
+    updated_at: str
 
 
 class BotStatusSchema(Schema):
@@ -38,6 +130,50 @@ class WhitelistedDomainSchema(Schema):
     domains: List[str]
 
 
+class SearchSchema(Schema):
+    queries: List[str]
+    k: int = 5
+    mode: str = "hybrid"
+
+
+class SearchHitSchema(Schema):
+    chunk_id: int
+    knowledge_item_id: str
+    score: float
+    text: str
+
+
+class SearchResponseSchema(Schema):
+    results: List[List[SearchHitSchema]]
+
+
+class ChatSchema(Schema):
+    message: str
+    # From the `done` event of the previous turn; omitted to start a conversation
+    conversation_id: Optional[str] = None
+
+
+class DirectUploadSchema(Schema):
+    file_name: str
+    content_type: str = "application/octet-stream"
+    size: int
+
+
+class DirectUploadCompleteSchema(Schema):
+    # As returned with the presigned upload
+    key: str
+    file_name: str
+    content_type: str = ""
+
+
+class FeedbackSchema(Schema):
+    conversation_id: str
+    rating: str
+
+
+FEEDBACK_RATINGS = {"up": 1, "down": -1}
+
+
 @router.post("/bot", response={201: dict})
 def create_bot(request, data: BotCreateSchema):
     try:
@@ -48,13 +184,11 @@ def create_bot(request, data: BotCreateSchema):
     # If no name provided, use company name + " Bot"
     bot_name = data.name or f"{company.name} Bot"
 
-    bot = Bot.objects.create(company=company, name=bot_name, tone=data.tone)
-
-    # Create knowledge items if provided
-    knowledge_items = []
-    for item in data.knowledge_items:
-        knowledge_item = KnowledgeItem.objects.create(bot=bot, type=item.type, content=item.content)
-        knowledge_items.append({"id": str(knowledge_item.id), "type": knowledge_item.type, "content": knowledge_item.content})
+    # One transaction and one insert for all knowledge items
+    with transaction.atomic():
+        bot = Bot.objects.create(company=company, name=bot_name, tone=data.tone)
+        created_items = KnowledgeItem.objects.bulk_create([KnowledgeItem(bot=bot, type=item.type, content=item.content) for item in data.knowledge_items])
+    knowledge_items = [{"id": str(item.id), "type": item.type, "content": item.content} for item in created_items]
 
     # Set off async task to create embeddings
     create_embeddings(bot=bot)
@@ -62,66 +196,67 @@ def create_bot(request, data: BotCreateSchema):
     return 201, {"id": str(bot.id), "name": bot.name, "tone": bot.tone, "company": {"id": str(company.id), "name": company.name}, "knowledge_items": knowledge_items}
 
 
-@router.get("/bots", response={200: List[BotResponseSchema]})
-def list_bots(request):
+@router.get("/bots", response={200: List[BotResponseSchema], 400: dict, 404: dict}, exclude_unset=True)
+def list_bots(request, response: HttpResponse, fields: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """Bots of the company, oldest first. The `X-Next-Cursor` header holds the cursor of the next page."""
     try:
         company = request.company
     except Company.DoesNotExist:
         return 404, {"error": "Company not found"}
 
-    bots = Bot.objects.filter(company=company)
-    response = []
-
-    for bot in bots:
-        knowledge_items = [{"id": str(item.id), "type": item.type, "content": item.content} for item in bot.knowledge_items.all()]
-        whitelisted_domains = [str(domain.domain) for domain in bot.whitelisted_domains.all()]
+    try:
+        selected = parse_bot_fields(fields)
+        bots, next_cursor = paginate(bots_queryset(selected).filter(company=company), cursor, page_limit(limit))
+    except ValueError as e:
+        return 400, {"error": str(e)}
+
+    set_next_cursor(request, response, next_cursor)
+    return 200, [serialize_bot(bot, company, selected) for bot in bots]
+
+
+@router.get("/bot/{bot_id}/status", response={200: BotStatusSchema, 304: None, 404: dict})
+async def get_bot_status(request, bot_id: str, response: HttpResponse, since: Optional[str] = None, wait: int = 0):
+    """Training status of a bot.
+
+    Send the last `ETag` back as `If-None-Match` (or `since`) to get a `304` while nothing
+    changed; add `wait` to long-poll for up to that many seconds for a change.
+    """
+    cursor = since or request.headers.get("If-None-Match", "").strip('"')
+    if cursor and wait > 0:
+        token = await await_status_change(bot_id, cursor, min(wait, settings.BOT_STATUS_MAX_WAIT_SECONDS))
+    else:
+        token = await aget_status_token(bot_id)
+    if cursor == token:
+        return HttpResponseNotModified(headers={"ETag": f'"{token}"'})
 
-        response.append(
-            {
-                "id": str(bot.id),
-                "name": bot.name,
-                "tone": bot.tone,
-                "company": {"id": str(company.id), "name": company.name},
-                "knowledge_items": knowledge_items,
-                "whitelisted_domains": whitelisted_domains,
-            }
-        )
+    try:
+        bot = await Bot.objects.select_related("company").aget(id=bot_id)
+    except Bot.DoesNotExist:
+        return 404, {"error": "Bot not found"}
 
-    return 200, response
+    snapshot = await aget_status_snapshot(bot)
+    if not snapshot["pollings"]:
+        # task hasn't started yet or it failed, restart it
+        await sync_to_async(create_embeddings)(bot)
+    response["ETag"] = f'"{token}"'
+    return 200, snapshot
 
 
-@router.get("/bot/{bot_id}/status", response={200: BotStatusSchema})
-def get_bot_status(request, bot_id: str):
+@router.get("/bot/{bot_id}/status/stream", response={200: None, 404: dict})
+async def stream_bot_status(request, bot_id: str):
+    """Server-sent training status, pushed whenever a Polling row changes."""
     try:
-        bot = Bot.objects.get(id=bot_id)
-        polling_items = list(
-            bot.pollings.values(
-                "id",
-                "status",
-                "completed",
-                "error",
-                "success",
-                "created_at",
-                "updated_at",
-            ).order_by("created_at")
-        )
-        if not polling_items:
-            # task hasn't started yet or it failed, restart it
-            create_embeddings(bot)
-        return 200, {
-            "bot": {
-                "id": bot.id,
-                "name": bot.name,
-                "tone": bot.tone,
-                "company": {"id": str(bot.company.id), "name": bot.company.name},
-                "created_at": bot.created_at.isoformat(),
-                "updated_at": bot.updated_at.isoformat(),
-            },
-            "pollings": polling_items,
-        }
+        bot = await Bot.objects.select_related("company").aget(id=bot_id)
     except Bot.DoesNotExist:
         return 404, {"error": "Bot not found"}
 
+    last_token = request.headers.get("Last-Event-ID")
+    events = astatus_events(bot, last_token) if isinstance(request, ASGIRequest) else status_events(bot, last_token)
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 
 @router.post("/bot/{bot_id}/domains", response={200: dict})
 def update_whitelisted_domains(request, bot_id: str, domains: WhitelistedDomainSchema):
@@ -138,6 +273,9 @@ def update_whitelisted_domains(request, bot_id: str, domains: WhitelistedDomainS
             if domain.strip():  # Only create for non-empty domains
                 domain_objects.append(WhitelistedDomain(bot=bot, domain=domain.strip()))
         WhitelistedDomain.objects.bulk_create(domain_objects)
+        transaction.on_commit(lambda: publish_domains(bot.id))
+        # bulk_create sends no post_save
+        transaction.on_commit(lambda: invalidate_widget_config(bot.id))
 
         return 200, {"message": "Domains updated successfully", "domains": domains.domains}
     except Bot.DoesNotExist:
@@ -146,22 +284,236 @@ def update_whitelisted_domains(request, bot_id: str, domains: WhitelistedDomainS
         return 500, {"error": str(e)}
 
 
-@router.get("/bot/{bot_id}", response={200: BotResponseSchema})
-def get_bot(request, bot_id: str):
+@router.post("/bot/{bot_id}/knowledge/import", response={201: dict, 400: dict, 404: dict})
+def import_knowledge_items(request, bot_id: str, file: UploadedFile = File(...), format: Optional[str] = None):
+    """Bulk import knowledge items from a JSONL or CSV upload with `type` and `content` fields."""
+    try:
+        bot = Bot.objects.get(id=bot_id, company=request.company)
+    except Bot.DoesNotExist:
+        return 404, {"error": "Bot not found"}
+
+    fmt = format or detect_format(file.name)
+    if fmt not in IMPORT_FORMATS:
+        return 400, {"error": f"format must be one of {', '.join(IMPORT_FORMATS)}"}
+
+    try:
+        polling = import_knowledge(bot, file.chunks(), fmt)
+    except KnowledgeImportError as e:
+        return 400, {"error": str(e)}
+    return 201, {"imported": polling.progress["imported"], "polling_id": polling.id}
+
+
+@router.post("/bot/{bot_id}/knowledge/file", response={201: dict, 404: dict})
+def upload_knowledge_file(request, bot_id: str, file: UploadedFile = File(...)):
+    """Add a text, markdown, HTML or PDF file to the bot's knowledge. It is parsed when the bot trains."""
+    try:
+        bot = Bot.objects.get(id=bot_id, company=request.company)
+    except Bot.DoesNotExist:
+        return 404, {"error": "Bot not found"}
+
+    item = KnowledgeItem.objects.create(bot=bot, type="file", content=file.name, file=file, content_type=file.content_type or "")
+    return 201, {"id": str(item.id), "type": item.type, "content": item.content}
+
+
+def direct_upload_prefix(bot) -> str:
+    return f"knowledge/uploads/{bot.id}/"
+
+
+@router.post("/bot/{bot_id}/knowledge/file/presign", response={200: dict, 400: dict, 404: dict})
+def presign_knowledge_file(request, bot_id: str, data: DirectUploadSchema):
+    """A presigned POST to upload a knowledge file straight to object storage.
+
+    Post the file to `url` with `fields`, then register it with `/knowledge/file/complete`.
+    """
+    try:
+        bot = Bot.objects.get(id=bot_id, company=request.company)
+    except Bot.DoesNotExist:
+        return 404, {"error": "Bot not found"}
+    if not settings.USE_S3:
+        return 400, {"error": "Direct uploads need object storage, upload to /knowledge/file instead"}
+    if not 0 < data.size <= settings.KNOWLEDGE_DIRECT_UPLOAD_MAX_BYTES:
+        return 400, {"error": f"Files must be between 1 and {settings.KNOWLEDGE_DIRECT_UPLOAD_MAX_BYTES} bytes"}
+
+    storage = KnowledgeItem._meta.get_field("file").storage
+    key = f"{direct_upload_prefix(bot)}{uuid.uuid4().hex}/{storage.get_valid_name(data.file_name)}"
+    upload = storage.presigned_upload(key, data.content_type, data.size)
+    return 200, {"key": key, "url": upload["url"], "fields": upload["fields"], "expires_in": storage.querystring_expire}
+
+
+@router.post("/bot/{bot_id}/knowledge/file/complete", response={201: dict, 400: dict, 404: dict})
+def complete_knowledge_file(request, bot_id: str, data: DirectUploadCompleteSchema):
+    """Add a file uploaded with `/knowledge/file/presign` to the bot's knowledge."""
+    try:
+        bot = Bot.objects.get(id=bot_id, company=request.company)
+    except Bot.DoesNotExist:
+        return 404, {"error": "Bot not found"}
+
+    storage = KnowledgeItem._meta.get_field("file").storage
+    # Only keys handed out for this bot, so a file can't be claimed by another company
+    if not settings.USE_S3 or not data.key.startswith(direct_upload_prefix(bot)) or ".." in data.key or not storage.exists(data.key):
+        return 400, {"error": "No such upload"}
+
+    item = KnowledgeItem.objects.create(bot=bot, type="file", content=data.file_name, file=data.key, content_type=data.content_type)
+    return 201, {"id": str(item.id), "type": item.type, "content": item.content}
+
+
+@router.get("/bot/{bot_id}/knowledge/{item_id}/file", response={200: None, 302: None, 404: dict})
+def download_knowledge_file(request, bot_id: str, item_id: str):
+    """The file of a knowledge item; a redirect to a presigned URL with object storage."""
+    item = KnowledgeItem.objects.filter(id=item_id, bot_id=bot_id, bot__company=request.company).first()
+    if item is None or not item.file:
+        return 404, {"error": "Knowledge file not found"}
+
+    file_name = item.content if item.type == "file" else os.path.basename(item.file.name)
+    if settings.USE_S3:
+        return HttpResponseRedirect(item.file.storage.presigned_download(item.file.name, file_name))
+    return FileResponse(item.file.open("rb"), as_attachment=True, filename=file_name, content_type=item.content_type or None)
+
+
+@router.get("/bot/{bot_id}", response={200: BotResponseSchema, 400: dict, 404: dict}, exclude_unset=True)
+def get_bot(request, bot_id: str, fields: Optional[str] = None):
+    try:
+        selected = parse_bot_fields(fields)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+
     try:
         company = request.company
 
-        bot = Bot.objects.get(id=bot_id, company=company)
-        knowledge_items = [{"id": str(item.id), "type": item.type, "content": item.content} for item in bot.knowledge_items.all()]
-        whitelisted_domains = [str(domain.domain) for domain in bot.whitelisted_domains.all()]
-
-        return 200, {
-            "id": str(bot.id),
-            "name": bot.name,
-            "tone": bot.tone,
-            "company": {"id": str(bot.company.id), "name": bot.company.name},
-            "knowledge_items": knowledge_items,
-            "whitelisted_domains": whitelisted_domains,
-        }
+        bot = bots_queryset(selected).get(id=bot_id, company=company)
+        return 200, serialize_bot(bot, company, selected)
     except Bot.DoesNotExist:
         return 404, {"error": "Bot not found"}
+
+
+@router.get("/bot/{bot_id}/knowledge", response={200: List[KnowledgeItemPreviewSchema], 400: dict, 404: dict})
+def list_knowledge_items(request, bot_id: str, response: HttpResponse, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """Knowledge items of a bot with content previews, oldest first.
+
+    Full bodies are fetched one at a time from `/bot/{bot_id}/knowledge/{item_id}`. The
+    `X-Next-Cursor` header holds the cursor of the next page.
+    """
+    if not Bot.objects.filter(id=bot_id, company=request.company).exists():
+        return 404, {"error": "Bot not found"}
+
+    items = (
+        KnowledgeItem.objects.filter(bot_id=bot_id)
+        .only("id", "type", "created_at", "updated_at")
+        .annotate(preview=Substr("content", 1, settings.KNOWLEDGE_PREVIEW_CHARS), length=Length("content"))
+    )
+    try:
+        items, next_cursor = paginate(items, cursor, page_limit(limit))
+    except ValueError as e:
+        return 400, {"error": str(e)}
+
+    set_next_cursor(request, response, next_cursor)
+    return 200, [
+        {
+            "id": str(item.id),
+            "type": item.type,
+            "preview": item.preview,
+            "length": item.length,
+            "created_at": item.created_at.isoformat(),
+            "updated_at": item.updated_at.isoformat(),
+        }
+        for item in items
+    ]
+
+
+@router.get("/bot/{bot_id}/knowledge/{item_id}", response={200: KnowledgeItemResponseSchema, 404: dict})
+def get_knowledge_item(request, bot_id: str, item_id: str):
+    item = KnowledgeItem.objects.filter(id=item_id, bot_id=bot_id, bot__company=request.company).first()
+    if item is None:
+        return 404, {"error": "Knowledge item not found"}
+
+    return 200, {
+        "id": str(item.id),
+        "type": item.type,
+        "content": item.content,
+        "created_at": item.created_at.isoformat(),
+        "updated_at": item.updated_at.isoformat(),
+    }
+
+
+@router.post("/bot/{bot_id}/search", response={200: SearchResponseSchema, 400: dict, 404: dict})
+def search_bot(request, bot_id: str, data: SearchSchema):
+    if not 1 <= data.k <= settings.BOT_SEARCH_MAX_K:
+        return 400, {"error": f"k must be between 1 and {settings.BOT_SEARCH_MAX_K}"}
+    if data.mode not in SEARCH_MODES:
+        return 400, {"error": f"mode must be one of {', '.join(SEARCH_MODES)}"}
+
+    if not Bot.objects.filter(id=bot_id, company=request.company).exists():
+        return 404, {"error": "Bot not found"}
+
+    return 200, {"results": search_knowledge(bot_id, data.queries, data.k, data.mode)}
+
+
+def serialize_version(version: KnowledgeVersion, active_version_id) -> dict:
+    return {
+        "number": version.number,
+        "status": version.status,
+        "active": version.id == active_version_id,
+        "chunk_count": version.chunk_count,
+        "created_at": version.created_at.isoformat(),
+        "activated_at": version.activated_at.isoformat() if version.activated_at else None,
+    }
+
+
+@router.get("/bot/{bot_id}/versions", response={200: List[dict], 404: dict})
+def list_versions(request, bot_id: str):
+    """Knowledge versions of the bot, newest first."""
+    bot = Bot.objects.filter(id=bot_id, company=request.company).only("id", "active_version_id").first()
+    if bot is None:
+        return 404, {"error": "Bot not found"}
+    return 200, [serialize_version(version, bot.active_version_id) for version in bot.versions.order_by("-number")]
+
+
+@router.post("/bot/{bot_id}/versions/{number}/activate", response={200: dict, 400: dict, 404: dict})
+def activate_bot_version(request, bot_id: str, number: int):
+    """Serve a retained knowledge version again, e.g. to roll back a bad training run."""
+    version = KnowledgeVersion.objects.filter(bot_id=bot_id, bot__company=request.company, number=number).first()
+    if version is None:
+        return 404, {"error": "Version not found"}
+    if version.status != "ready":
+        return 400, {"error": f"Version {number} is {version.status} and can't be activated"}
+
+    activate_version(version)
+    return 200, serialize_version(version, version.id)
+
+
+@router.post("/bot/{bot_id}/chat", response={200: None, 400: dict, 404: dict})
+async def chat(request, bot_id: str, data: ChatSchema):
+    if not data.message.strip():
+        return 400, {"error": "Message is required"}
+
+    bot = await Bot.objects.select_related("company").filter(id=bot_id).afirst()
+    if bot is None:
+        return 404, {"error": "Bot not found"}
+
+    # Under ASGI the reply streams from an async generator without holding a thread;
+    # WSGI servers can only iterate a sync generator without buffering the whole body.
+    stream = astream_chat if isinstance(request, ASGIRequest) else stream_chat
+    response = StreamingHttpResponse(stream(bot, data.message.strip(), parse_conversation_id(data.conversation_id)), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@router.post("/bot/{bot_id}/feedback", response={200: dict, 201: dict, 400: dict, 404: dict})
+async def give_feedback(request, bot_id: str, data: FeedbackSchema):
+    """Thumbs up or down from the widget on a conversation's replies, replacing an earlier one."""
+    conversation_id = parse_conversation_id(data.conversation_id)
+    if conversation_id is None:
+        return 400, {"error": "conversation_id must be a UUID"}
+    if data.rating not in FEEDBACK_RATINGS:
+        return 400, {"error": f"rating must be one of {', '.join(FEEDBACK_RATINGS)}"}
+
+    if not await Bot.objects.filter(id=bot_id).aexists():
+        return 404, {"error": "Bot not found"}
+
+    # Pending again, so the rollups swap the rating they counted for this one
+    _, created = await Feedback.objects.aupdate_or_create(
+        bot_id=bot_id, conversation_id=conversation_id, defaults={"rating": FEEDBACK_RATINGS[data.rating], "pending": True}
+    )
+    return 201 if created else 200, {"conversation_id": str(conversation_id), "rating": data.rating}
@@ -0,0 +1,39 @@
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags
+from ninja import Router
+
+from ..widget import cached_widget_config, get_widget_config
+
+router = Router()
+
+
+@router.get("/widget/{bot_id}/config", response={200: None, 304: None, 404: dict})
+async def get_widget_config_view(request, bot_id: str):
+    """Tone, branding and allowed domains of a bot in one cacheable payload for the widget.
+
+    Public, so browsers and CDNs may keep it for `max-age` and serve it stale while they
+    revalidate; send the `ETag` back as `If-None-Match` to get a `304`.
+    """
+    try:
+        bot_id = uuid.UUID(bot_id)
+    except ValueError:
+        return JsonResponse({"error": "Bot not found"}, status=404)
+
+    config = cached_widget_config(bot_id) or await sync_to_async(get_widget_config)(bot_id)
+    if config is None:
+        return JsonResponse({"error": "Bot not found"}, status=404)
+
+    etag, body = config
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.WIDGET_CONFIG_MAX_AGE}, stale-while-revalidate={settings.WIDGET_CONFIG_STALE_WHILE_REVALIDATE}",
+    }
+    if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+    # Weak comparison, as If-None-Match calls for
+    if "*" in if_none_match or etag in if_none_match or f"W/{etag}" in if_none_match:
+        return HttpResponseNotModified(headers=headers)
+    return HttpResponse(body, content_type="application/json", headers=headers)
@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from company.models import Company
+from .chat.answer_cache import bump_knowledge_version
+from .models import Bot, KnowledgeItem, Polling, WhitelistedDomain
+from .status import publish_status
+from .tasks.chunk_store import release_chunks
+from .tasks.embeddings import create_embeddings
+from .widget import invalidate_widget_config
+
+
+def schedule_reindex(bot_id):
+    """Queue a training run for the bot once the current transaction commits."""
+
+    def reindex():
+        # The bot may be gone if the item was removed by a cascading bot delete
+        bot = Bot.objects.filter(id=bot_id).first()
+        if bot is not None:
+            create_embeddings(bot)
+
+    transaction.on_commit(reindex)
+
+
+def knowledge_changed(bot_id):
+    transaction.on_commit(lambda: bump_knowledge_version(bot_id))
+    schedule_reindex(bot_id)
+
+
+@receiver(post_save, sender=Bot)
+def bot_saved(sender, instance, **kwargs):
+    # The tone and name are part of the prompt, so cached answers no longer apply
+    bot_id = instance.id
+    transaction.on_commit(lambda: bump_knowledge_version(bot_id))
+    transaction.on_commit(lambda: invalidate_widget_config(bot_id))
+
+
+@receiver(post_delete, sender=Bot)
+@receiver(post_save, sender=WhitelistedDomain)
+@receiver(post_delete, sender=WhitelistedDomain)
+def widget_config_changed(sender, instance, **kwargs):
+    bot_id = instance.id if sender is Bot else instance.bot_id
+    transaction.on_commit(lambda: invalidate_widget_config(bot_id))
+
+
+@receiver(post_save, sender=Company)
+def company_branding_changed(sender, instance, **kwargs):
+    # The company's colors and logo are part of its bots' widget configuration
+    company_id = instance.id
+    transaction.on_commit(lambda: invalidate_widget_config(*Bot.objects.filter(company_id=company_id).values_list("id", flat=True)))
+
+
+@receiver(post_save, sender=KnowledgeItem)
+def knowledge_item_saved(sender, instance, **kwargs):
+    knowledge_changed(instance.bot_id)
+
+
+@receiver(pre_delete, sender=KnowledgeItem)
+def knowledge_item_deleting(sender, instance, **kwargs):
+    # Runs for cascading bot deletes too, before the chunks are gone
+    release_chunks(instance.chunks.all())
+
+
+@receiver(post_delete, sender=KnowledgeItem)
+def knowledge_item_deleted(sender, instance, **kwargs):
+    if instance.file:
+        file = instance.file
+        transaction.on_commit(lambda: file.delete(save=False))
+    knowledge_changed(instance.bot_id)
+
+
+@receiver(post_save, sender=Polling)
+@receiver(post_delete, sender=Polling)
+def polling_changed(sender, instance, **kwargs):
+    bot_id = instance.bot_id
+    transaction.on_commit(lambda: publish_status(bot_id))
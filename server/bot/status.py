@@ -0,0 +1,129 @@
+"""Training status snapshots and change cursors.
+
+Every Polling write publishes a status token for its bot to the shared cache. The token
+is derived from the bot's pollings (count, last id, last update), so all processes
+agree on it. Clients send it back as `If-None-Match` (or `since`) and get a `304`
+without a database query while it is unchanged; the status stream only queries the
+database when the token moves.
+"""
+
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+
+from .models import Bot, Polling
+
+POLLING_FIELDS = ("id", "status", "completed", "error", "success", "timings", "progress", "created_at", "updated_at")
+
+
+def _token_key(bot_id) -> str:
+    return f"bot-status:{bot_id}"
+
+
+def compute_status_token(bot_id) -> str:
+    stats = Polling.objects.filter(bot_id=bot_id).aggregate(count=Count("id"), last_id=Max("id"), last_update=Max("updated_at"))
+    last_update = int(stats["last_update"].timestamp() * 1_000_000) if stats["last_update"] else 0
+    return f"{stats['count']}.{stats['last_id'] or 0}.{last_update}"
+
+
+def publish_status(bot_id) -> str:
+    """Recompute the status token of a bot and share it with all processes."""
+    token = compute_status_token(bot_id)
+    cache.set(_token_key(bot_id), token, timeout=None)
+    return token
+
+
+def get_status_token(bot_id) -> str:
+    return cache.get(_token_key(bot_id)) or publish_status(bot_id)
+
+
+async def aget_status_token(bot_id) -> str:
+    return await cache.aget(_token_key(bot_id)) or await sync_to_async(publish_status)(bot_id)
+
+
+async def await_status_change(bot_id, token: str, timeout: float) -> str:
+    """Wait up to `timeout` seconds for the status token to move away from `token`."""
+    deadline = time.monotonic() + timeout
+    current = await aget_status_token(bot_id)
+    while current == token and time.monotonic() < deadline:
+        await asyncio.sleep(settings.BOT_STATUS_CHECK_SECONDS)
+        current = await aget_status_token(bot_id)
+    return current
+
+
+def _snapshot(bot: Bot, pollings: list) -> dict:
+    return {
+        "bot": {
+            "id": bot.id,
+            "name": bot.name,
+            "tone": bot.tone,
+            "company": {"id": str(bot.company.id), "name": bot.company.name},
+            "created_at": bot.created_at.isoformat(),
+            "updated_at": bot.updated_at.isoformat(),
+        },
+        "pollings": pollings,
+    }
+
+
+def get_status_snapshot(bot: Bot) -> dict:
+    return _snapshot(bot, list(bot.pollings.values(*POLLING_FIELDS).order_by("created_at")))
+
+
+async def aget_status_snapshot(bot: Bot) -> dict:
+    return _snapshot(bot, [polling async for polling in bot.pollings.values(*POLLING_FIELDS).order_by("created_at")])
+
+
+def _status_event(token: str, snapshot: dict) -> str:
+    return f"id: {token}\nevent: status\ndata: {json.dumps(snapshot, cls=DjangoJSONEncoder)}\n\n"
+
+
+def _is_finished(snapshot: dict) -> bool:
+    # A finished import is followed by training, so only training's end is final
+    return bool(snapshot["pollings"]) and snapshot["pollings"][-1]["status"] in ("ready", "error")
+
+
+def status_events(bot: Bot, last_token: Optional[str]) -> Iterator[str]:
+    """Server-sent status snapshots of `bot`, one per token change, until training finishes."""
+    yield f"retry: {settings.BOT_STATUS_RETRY_MS}\n\n"
+    deadline = time.monotonic() + settings.BOT_STATUS_STREAM_SECONDS
+    last_sent = time.monotonic()
+
+    while time.monotonic() < deadline:
+        token = get_status_token(bot.id)
+        if token != last_token:
+            snapshot = get_status_snapshot(bot)
+            yield _status_event(token, snapshot)
+            last_token, last_sent = token, time.monotonic()
+            if _is_finished(snapshot):
+                return
+        elif time.monotonic() - last_sent > settings.BOT_STATUS_KEEPALIVE_SECONDS:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        time.sleep(settings.BOT_STATUS_CHECK_SECONDS)
+
+
+async def astatus_events(bot: Bot, last_token: Optional[str]) -> AsyncIterator[str]:
+    """Async variant of `status_events` for ASGI, so an idle stream doesn't hold a thread."""
+    yield f"retry: {settings.BOT_STATUS_RETRY_MS}\n\n"
+    deadline = time.monotonic() + settings.BOT_STATUS_STREAM_SECONDS
+    last_sent = time.monotonic()
+
+    while time.monotonic() < deadline:
+        token = await aget_status_token(bot.id)
+        if token != last_token:
+            snapshot = await aget_status_snapshot(bot)
+            yield _status_event(token, snapshot)
+            last_token, last_sent = token, time.monotonic()
+            if _is_finished(snapshot):
+                return
+        elif time.monotonic() - last_sent > settings.BOT_STATUS_KEEPALIVE_SECONDS:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        await asyncio.sleep(settings.BOT_STATUS_CHECK_SECONDS)
@@ -0,0 +1,98 @@
+"""Content-addressed storage of chunk texts and embeddings.
+
+Chunks with the same normalized text (under the same embedder) share one ChunkContent,
+so a help center uploaded to many bots is embedded and stored once. Each content
+counts the chunks referring to it; contents left without references are deleted by
+`collect_garbage`.
+"""
+
+import hashlib
+import unicodedata
+from collections import Counter, defaultdict
+from typing import List, Tuple
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, F, QuerySet
+
+from bot.models import ChunkContent, KnowledgeChunk
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _adjust_ref_counts(counts: Counter, sign: int):
+    # One UPDATE per distinct count, most chunks of a batch reference distinct contents
+    by_count = defaultdict(list)
+    for content_id, count in counts.items():
+        by_count[count].append(content_id)
+    for count, content_ids in by_count.items():
+        for i in range(0, len(content_ids), 500):
+            ChunkContent.objects.filter(id__in=content_ids[i : i + 500]).update(ref_count=F("ref_count") + sign * count)
+
+
+def _create_contents(embedder, texts: dict, hashes: List[str], timer):
+    with timer.stage("embed"):
+        vectors = embedder.embed([texts[chunk_hash] for chunk_hash in hashes]).astype(np.float32)
+    # Another worker may have stored the same text meanwhile, its row wins
+    ChunkContent.objects.bulk_create(
+        [ChunkContent(content_hash=chunk_hash, embedder=embedder.name, text=texts[chunk_hash], embedding=vector.tobytes()) for chunk_hash, vector in zip(hashes, vectors)],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+def store_chunks(embedder, pending: List[Tuple[KnowledgeChunk, str]], timer) -> int:
+    """Insert `(chunk, text)` pairs, linking each chunk to the shared content of its text.
+
+    Only texts no bot has stored yet are embedded. Returns how many were.
+    """
+    texts = {chunk.content_hash: normalize_text(text) for chunk, text in pending}
+    known = set(ChunkContent.objects.filter(embedder=embedder.name, content_hash__in=texts).values_list("content_hash", flat=True))
+    missing = [chunk_hash for chunk_hash in texts if chunk_hash not in known]
+    # Embedding happens outside the transaction, it may take a while
+    if missing:
+        _create_contents(embedder, texts, missing, timer)
+
+    with timer.stage("store"), transaction.atomic():
+        # Locked, so garbage collection can't delete a content before it is referenced
+        lookup = ChunkContent.objects.select_for_update().filter(embedder=embedder.name, content_hash__in=texts)
+        content_ids = dict(lookup.values_list("content_hash", "id"))
+        collected = [chunk_hash for chunk_hash in texts if chunk_hash not in content_ids]
+        if collected:
+            # Unreferenced contents deleted since the lookup above
+            _create_contents(embedder, texts, collected, timer)
+            content_ids = dict(lookup.values_list("content_hash", "id"))
+            missing += collected
+
+        chunks = []
+        for chunk, _ in pending:
+            chunk.content_id = content_ids[chunk.content_hash]
+            chunks.append(chunk)
+        KnowledgeChunk.objects.bulk_create(chunks, batch_size=500)
+        _adjust_ref_counts(Counter(chunk.content_id for chunk in chunks), 1)
+
+    return len(missing)
+
+
+def release_chunks(chunks: QuerySet):
+    """Drop the references of `chunks`, which are about to be deleted, to their contents."""
+    rows = chunks.order_by().values("content_id").annotate(count=Count("id")).values_list("content_id", "count")
+    _adjust_ref_counts(Counter(dict(rows)), -1)
+
+
+def delete_chunks(chunks: QuerySet):
+    with transaction.atomic():
+        release_chunks(chunks)
+        chunks.delete()
+
+
+def collect_garbage() -> int:
+    """Delete the contents no chunk refers to any more. Returns how many were deleted."""
+    deleted, _ = ChunkContent.objects.filter(ref_count=0, chunks__isnull=True).delete()
+    return deleted
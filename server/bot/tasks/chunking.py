@@ -0,0 +1,84 @@
+"""Sentence-aware text chunking with token overlap.
+
+Input is an iterable of text pieces so that large documents can be streamed through
+without holding the whole text in memory.
+"""
+
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+# A sentence buffer longer than this is cut at the last whitespace, so text without
+# punctuation (logs, tables) can't grow the buffer without bound.
+MAX_SENTENCE_CHARS = 8000
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text)
+
+
+def count_tokens(text: str) -> int:
+    return sum(1 for _ in TOKEN_RE.finditer(text))
+
+
+def split_sentences(pieces: Iterable[str]) -> Iterator[str]:
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        parts = SENTENCE_END_RE.split(buffer)
+        buffer = parts.pop()
+        for part in parts:
+            if part.strip():
+                yield part.strip()
+
+        while len(buffer) > MAX_SENTENCE_CHARS:
+            cut = buffer.rfind(" ", 0, MAX_SENTENCE_CHARS)
+            cut = cut if cut > 0 else MAX_SENTENCE_CHARS
+            if buffer[:cut].strip():
+                yield buffer[:cut].strip()
+            buffer = buffer[cut:]
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def _split_long_sentence(sentence: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+    starts = [match.start() for match in TOKEN_RE.finditer(sentence)]
+    for i in range(0, len(starts), max_tokens):
+        end = starts[i + max_tokens] if i + max_tokens < len(starts) else len(sentence)
+        part = sentence[starts[i] : end].strip()
+        yield part, min(max_tokens, len(starts) - i)
+
+
+def chunk_text(pieces: Iterable[str], max_tokens: int = 200, overlap_tokens: int = 40) -> Iterator[str]:
+    """Group sentences into chunks of at most `max_tokens` tokens.
+
+    Consecutive chunks share up to `overlap_tokens` tokens of trailing sentences.
+    Sentences longer than `max_tokens` are split on token boundaries.
+    """
+    window: List[Tuple[str, int]] = []
+    size = 0
+
+    for sentence in split_sentences(pieces):
+        count = count_tokens(sentence)
+        parts = _split_long_sentence(sentence, max_tokens) if count > max_tokens else [(sentence, count)]
+
+        for part, part_count in parts:
+            if window and size + part_count > max_tokens:
+                yield " ".join(text for text, _ in window)
+
+                kept, kept_size = [], 0
+                for text, text_count in reversed(window):
+                    if kept_size + text_count > overlap_tokens or kept_size + text_count + part_count > max_tokens:
+                        break
+                    kept.append((text, text_count))
+                    kept_size += text_count
+                window, size = kept[::-1], kept_size
+
+            window.append((part, part_count))
+            size += part_count
+
+    if window:
+        yield " ".join(text for text, _ in window)
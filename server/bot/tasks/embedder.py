@@ -0,0 +1,64 @@
+"""Text embedders used by the training pipeline.
+
+The active embedder is configured with the `BOT_EMBEDDER` setting (a dotted path).
+Embedders return L2-normalised float32 vectors, so a dot product is a cosine similarity.
+"""
+
+import zlib
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .chunking import tokenize
+
+
+class Embedder:
+    """Base class for embedders. Subclasses set `name` and `dim` and implement `embed`."""
+
+    name = "base"
+    dim = 0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Return a `(len(texts), dim)` float32 matrix of unit-length vectors."""
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic offline embedder built from hashed word and character n-grams.
+
+    Words, word bigrams and character trigrams are hashed into `dim` signed buckets,
+    so the same text always maps to the same vector without any model download.
+    """
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or settings.BOT_EMBEDDING_DIM
+        self.name = f"hashing-{self.dim}"
+
+    def _features(self, text: str):
+        words = [token for token in tokenize(text.lower()) if token.isalnum()]
+        yield from words
+        for first, second in zip(words, words[1:]):
+            yield f"{first} {second}"
+        for word in words:
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i : i + 3]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+@lru_cache(maxsize=None)
+def get_embedder() -> Embedder:
+    return import_string(settings.BOT_EMBEDDER)()
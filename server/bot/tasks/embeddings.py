@@ -1,30 +1,191 @@
-from bot.models import Bot, Polling
-from threading import Thread
+import logging
 import time
-import random
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Optional
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
 
-def simulate_training(bot: Bot):
-    try:
-        # Create initial training polling item
-        Polling.objects.create(bot=bot, status="training", completed=False, error=None, success=None)
-        print(f"Created training polling item for bot {bot.id}")
+from bot.ingestion.crawler import crawl_bot
+from bot.ingestion.extractors import ExtractionError, knowledge_text
+from bot.models import Bot, KnowledgeChunk, KnowledgeItem, KnowledgeVersion, Polling
+from bot.status import publish_status
+from bot.retrieval.bm25 import update_bm25_index
+from bot.retrieval.vector_index import build_vector_index
+from bot.retrieval.versions import activate_version, create_version, prune_versions, read_active
+from bot.tasks import queue
+from .chunk_store import collect_garbage, content_hash, delete_chunks, store_chunks
+from .chunking import chunk_text
+from .embedder import get_embedder
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """Accumulates wall-clock milliseconds per pipeline stage."""
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[f"{name}_ms"] += (time.perf_counter() - start) * 1000
+
+    def timed(self, name, iterable):
+        """Iterate `iterable`, counting the time spent producing its items as stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def as_dict(self):
+        return {key: round(value, 2) for key, value in self.timings.items()}
+
+
+def index_bot(bot: Bot, timer: StageTimer, version: Optional[int] = None) -> dict:
+    """Chunk and embed the knowledge items of `bot` that changed since they were last indexed.
+
+    Chunks are matched by content hash, so an edited item only adds the chunks whose text
+    changed, and only texts new to every bot are embedded. When building knowledge version
+    `version`, stale chunks are retired in it rather than deleted, so the versions before
+    it keep their chunks. Returns counters for the run.
+    """
+    embedder = get_embedder()
+    started_at = timezone.now()
+    counts = {"items": 0, "items_failed": 0, "chunks": 0, "chunks_embedded": 0, "chunks_deleted": 0}
+    live = bot.chunks.filter(retired_in__isnull=True)
+
+    def remove(chunks):
+        if version is None:
+            delete_chunks(chunks)
+        else:
+            chunks.update(retired_in=version)
+
+    # Vectors from another embedder are not comparable, so everything is re-embedded
+    force = live.exclude(content__embedder=embedder.name).exists()
+    if force:
+        remove(live)
+    items = bot.knowledge_items.all()
+    if not force:
+        items = items.filter(Q(indexed_at__isnull=True) | Q(updated_at__gt=F("indexed_at")))
 
-        # Simulate training process
-        time.sleep(random.randint(3, 5))  # Random time between 3-5 seconds
+    pending = []
+    indexed_ids = []
+
+    for item in items.iterator(chunk_size=100):
+        existing = defaultdict(list)
+        previous_ids = []
+        for chunk_id, chunk_hash, position in item.chunks.filter(retired_in__isnull=True).values_list("id", "content_hash", "position"):
+            existing[chunk_hash].append((chunk_id, position))
+            previous_ids.append(chunk_id)
+
+        # Chunks are streamed from the source and embedded in batches, so a large
+        # document never has to fit in memory
+        moved = []
+        chunk_count = 0
+        chunks = chunk_text(knowledge_text(item), settings.BOT_CHUNK_MAX_TOKENS, settings.BOT_CHUNK_OVERLAP_TOKENS)
+        try:
+            for position, text in enumerate(timer.timed("chunk", chunks)):
+                chunk_hash = content_hash(text)
+                chunk_count += 1
+                if existing[chunk_hash]:
+                    chunk_id, old_position = existing[chunk_hash].pop()
+                    if old_position != position:
+                        moved.append(KnowledgeChunk(id=chunk_id, position=position))
+                else:
+                    pending.append((KnowledgeChunk(bot=bot, knowledge_item=item, position=position, content_hash=chunk_hash, added_in=version or 0), text))
+                if len(pending) >= settings.BOT_EMBEDDING_BATCH_SIZE:
+                    counts["chunks_embedded"] += store_chunks(embedder, pending, timer)
+                    pending = []
+        except ExtractionError as e:
+            # Left unindexed with its previous chunks, so the next run retries it. The chunks
+            # added for it so far go, stored or not.
+            pending = [entry for entry in pending if entry[0].knowledge_item_id != item.id]
+            with timer.stage("store"):
+                delete_chunks(item.chunks.filter(retired_in__isnull=True).exclude(id__in=previous_ids))
+            logger.warning("Skipping knowledge item %s: %s", item.id, e)
+            counts["items_failed"] += 1
+            continue
+
+        stale_ids = [chunk_id for rows in existing.values() for chunk_id, _ in rows]
+        with timer.stage("store"):
+            if stale_ids:
+                remove(KnowledgeChunk.objects.filter(id__in=stale_ids))
+            if moved:
+                KnowledgeChunk.objects.bulk_update(moved, ["position"], batch_size=500)
+
+        counts["items"] += 1
+        counts["chunks"] += chunk_count
+        counts["chunks_deleted"] += len(stale_ids)
+        indexed_ids.append(item.id)
+
+    if pending:
+        counts["chunks_embedded"] += store_chunks(embedder, pending, timer)
+
+    with timer.stage("store"):
+        for i in range(0, len(indexed_ids), 500):
+            KnowledgeItem.objects.filter(id__in=indexed_ids[i : i + 500]).update(indexed_at=started_at)
+
+    return counts
+
+
+def training_failed(payload: dict, error: str):
+    KnowledgeVersion.objects.filter(bot_id=payload["bot_id"], status="building").update(status="failed")
+    Polling.objects.create(bot_id=payload["bot_id"], status="error", completed=True, error=error, success=False)
+
+
+@queue.handler("embeddings", on_failure=training_failed)
+def train_bot(payload: dict):
+    try:
+        bot = Bot.objects.get(id=payload["bot_id"])
+    except Bot.DoesNotExist:
+        # Bot was deleted while the job waited in the queue
+        return
 
-        # Create ready polling item
-        Polling.objects.create(bot=bot, status="ready", completed=True, error=None, success=True)
-        print(f"Created ready polling item for bot {bot.id}")
+    polling = Polling.objects.create(bot=bot, status="training", completed=False, error=None, success=None)
+    timer = StageTimer()
+    with timer.stage("total"):
+        # Chat keeps being served from the active version until the new one is published
+        version = create_version(bot)
+        with timer.stage("fetch"):
+            crawl_counts = crawl_bot(bot)
+        counts = {**crawl_counts, **index_bot(bot, timer, version.number)}
+        with timer.stage("index"):
+            version.vector_index = build_vector_index(bot)
+        with timer.stage("keyword_index"):
+            active = read_active(bot.id)
+            version.keyword_index, keyword_counts = update_bm25_index(bot, active.keywords if active else None)
+            counts.update(keyword_counts)
+        version.chunk_count = bot.chunks.filter(retired_in__isnull=True).count()
+        version.save(update_fields=["vector_index", "keyword_index", "chunk_count"])
+        activate_version(version)
+        with timer.stage("prune"):
+            counts.update(prune_versions(bot))
+        with timer.stage("collect"):
+            counts["contents_collected"] = collect_garbage()
 
-    except Exception as e:
-        print(f"Error in training simulation: {str(e)}")
+    timings = {**timer.as_dict(), **counts, "version": version.number}
+    Polling.objects.filter(id=polling.id).update(timings=timings)
+    publish_status(bot.id)
+    Polling.objects.create(bot=bot, status="ready", completed=True, error=None, success=True, timings=timings)
+    logger.info("Indexed bot %s: %s", bot.id, timings)
 
 
 def create_embeddings(bot: Bot):
-    # TODO: use celery later
-    Polling.objects.create(bot=bot, status="started", completed=False, error=None, success=None)
-    thread = Thread(target=simulate_training, args=(bot,))
-    thread.daemon = True
-    thread.start()
-    return True
+    """Queue a training run for `bot`. Returns False if one is already queued."""
+    with transaction.atomic():
+        _, created = queue.enqueue("embeddings", key=f"embeddings:{bot.id}", payload={"bot_id": str(bot.id)})
+        if created:
+            Polling.objects.create(bot=bot, status="started", completed=False, error=None, success=None)
+    return created
@@ -0,0 +1,155 @@
+"""Database-backed job queue.
+
+Jobs live in the `Job` table and are leased by `manage.py run_worker`. A lease is a
+visibility timeout: if a worker dies mid-job, the job becomes claimable again once
+`locked_until` passes. Claims are compare-and-set UPDATEs, so the queue works on SQLite
+and Postgres alike without a broker.
+"""
+
+import logging
+import random
+from datetime import timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from bot.models import Job
+
+logger = logging.getLogger(__name__)
+
+_handlers: Dict[str, Tuple[Callable, Optional[Callable]]] = {}
+
+
+def handler(kind: str, on_failure: Optional[Callable] = None):
+    """Register `func(payload)` as the handler for jobs of `kind`.
+
+    `on_failure(payload, error)` runs once a job has used up all of its attempts.
+    """
+
+    def decorator(func):
+        _handlers[kind] = (func, on_failure)
+        return func
+
+    return decorator
+
+
+def enqueue(kind: str, key: str, payload: Optional[dict] = None, max_attempts: Optional[int] = None) -> Tuple[Job, bool]:
+    """Queue a job unless one with the same key is already waiting.
+
+    Returns `(job, created)`.
+    """
+    existing = Job.objects.filter(key=key, status="queued").first()
+    if existing:
+        return existing, False
+
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(
+                kind=kind,
+                key=key,
+                payload=payload or {},
+                max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+            )
+        return job, True
+    except IntegrityError:
+        # Lost the race against a concurrent enqueue of the same key
+        return Job.objects.get(key=key, status="queued"), False
+
+
+def claim(worker_id: str, lease_seconds: int) -> Optional[Job]:
+    """Lease the next runnable job for `worker_id`, or return None if there is none."""
+    now = timezone.now()
+    candidates = (
+        Job.objects.filter(Q(status="queued", run_after__lte=now) | Q(status="running", locked_until__lt=now))
+        .order_by("run_after")
+        .values_list("id", "key", "status", "locked_until", "attempts", "max_attempts")[:20]
+    )
+
+    for job_id, key, status, locked_until, attempts, max_attempts in candidates:
+        if status == "queued" and Job.objects.filter(key=key, status="running", locked_until__gte=now).exists():
+            # Same work is still in flight, pick it up after that run finishes
+            continue
+
+        if status == "running" and attempts >= max_attempts:
+            # Lease expired on the final attempt: the worker died, give up on the job
+            if Job.objects.filter(id=job_id, status="running", locked_until=locked_until).update(status="failed", last_error="Lease expired", locked_by=None, locked_until=None, updated_at=now):
+                _run_failure_hook(Job.objects.get(id=job_id), "Lease expired")
+            continue
+
+        claimed = Job.objects.filter(id=job_id, status=status, locked_until=locked_until).update(
+            status="running",
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=lease_seconds),
+            attempts=F("attempts") + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+
+    return None
+
+
+def extend_lease(job_ids, worker_id: str, lease_seconds: int) -> int:
+    """Push back the visibility timeout of jobs still being worked on by `worker_id`."""
+    return Job.objects.filter(id__in=job_ids, status="running", locked_by=worker_id).update(
+        locked_until=timezone.now() + timedelta(seconds=lease_seconds),
+    )
+
+
+def run(job: Job, worker_id: str) -> bool:
+    """Execute a leased job and record the outcome. Returns True on success."""
+    func, _ = _handlers.get(job.kind, (None, None))
+    try:
+        if func is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        func(job.payload)
+    except Exception as e:
+        logger.exception("Job %s (%s) failed on attempt %s", job.id, job.kind, job.attempts)
+        _fail(job, worker_id, str(e))
+        return False
+
+    Job.objects.filter(id=job.id, locked_by=worker_id).update(status="done", locked_by=None, locked_until=None, last_error=None, updated_at=timezone.now())
+    return True
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with jitter for the retry after `attempts` failed attempts."""
+    delay = min(settings.JOB_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), settings.JOB_RETRY_MAX_SECONDS)
+    return delay + random.uniform(0, delay / 10)
+
+
+def _fail(job: Job, worker_id: str, error: str):
+    now = timezone.now()
+    leased = Job.objects.filter(id=job.id, locked_by=worker_id)
+
+    if job.attempts >= job.max_attempts:
+        if leased.update(status="failed", last_error=error, locked_by=None, locked_until=None, updated_at=now):
+            _run_failure_hook(job, error)
+        return
+
+    try:
+        with transaction.atomic():
+            leased.update(
+                status="queued",
+                last_error=error,
+                locked_by=None,
+                locked_until=None,
+                run_after=now + timedelta(seconds=backoff_seconds(job.attempts)),
+                updated_at=now,
+            )
+    except IntegrityError:
+        # The same work was queued again while this attempt ran; the fresh job covers the retry
+        leased.update(status="failed", last_error=error, locked_by=None, locked_until=None, updated_at=now)
+
+
+def _run_failure_hook(job: Job, error: str):
+    _, on_failure = _handlers.get(job.kind, (None, None))
+    if on_failure is None:
+        return
+    try:
+        on_failure(job.payload, error)
+    except Exception:
+        logger.exception("Failure hook for job %s (%s) raised", job.id, job.kind)
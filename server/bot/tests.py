@@ -1,3 +1,995 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock, skipUnless
+from urllib.request import Request, urlopen
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from company.models import Company
+from core.ratelimit import CacheRateLimiter, LocalRateLimiter
+from core.tenants import get_company
+from .analytics import rollup_analytics
+from .chat.context import Session, build_messages, load_session
+from .chat.conversations import message_writer, parse_conversation_id, record_turn
+from .domains import DomainMatcher, get_domain_matcher, is_origin_allowed, normalize_host
+from .importing import import_knowledge
+from .ingestion.crawler import CrawlError, UrllibFetcher, crawl_bot, is_public_address
+from .ingestion.extractors import ExtractionError, extract_text
+from .models import AnalyticsRollup, Bot, ChunkContent, Conversation, Feedback, Job, KnowledgeChunk, KnowledgeItem, Message, Polling, WhitelistedDomain
+from .retrieval import bm25
+from .retrieval.service import reciprocal_rank_fusion, search_knowledge
+from .retrieval.vector_index import VectorIndex, get_vector_index, partition_index
+from .retrieval.versions import read_active
+from .status import get_status_token, publish_status
+from .tasks import queue
+from .tasks.chunk_store import collect_garbage
+from .tasks.chunking import chunk_text, count_tokens
+from .tasks.embedder import HashingEmbedder
+from .tasks.embeddings import StageTimer, create_embeddings, index_bot, train_bot
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+
+    def test_create_embeddings_is_idempotent(self):
+        self.assertTrue(create_embeddings(self.bot))
+        self.assertFalse(create_embeddings(self.bot))
+        self.assertEqual(Job.objects.filter(key=f"embeddings:{self.bot.id}").count(), 1)
+        self.assertEqual(Polling.objects.filter(bot=self.bot, status="started").count(), 1)
+
+    def test_claim_leases_job_once(self):
+        job, _ = queue.enqueue("noop", key="noop:1")
+        claimed = queue.claim("worker-a", lease_seconds=60)
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNone(queue.claim("worker-b", lease_seconds=60))
+
+    def test_expired_lease_is_reclaimed(self):
+        job, _ = queue.enqueue("noop", key="noop:1")
+        queue.claim("worker-a", lease_seconds=60)
+        Job.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        claimed = queue.claim("worker-b", lease_seconds=60)
+        self.assertEqual(claimed.locked_by, "worker-b")
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job, _ = queue.enqueue("unknown", key="unknown:1", max_attempts=2)
+        self.assertFalse(queue.run(queue.claim("worker-a", lease_seconds=60), "worker-a"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "queued")
+        self.assertGreater(job.run_after, timezone.now())
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertFalse(queue.run(queue.claim("worker-a", lease_seconds=60), "worker-a"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+
+    def test_queued_job_waits_for_running_job_with_same_key(self):
+        queue.enqueue("noop", key="noop:1")
+        queue.claim("worker-a", lease_seconds=60)
+        queue.enqueue("noop", key="noop:1")
+        self.assertIsNone(queue.claim("worker-b", lease_seconds=60))
+
+
+class ChunkingTests(TestCase):
+    def test_chunks_respect_token_limit_and_overlap(self):
+        text = " ".join(f"Sentence number {i} is here." for i in range(50))
+        chunks = list(chunk_text([text], max_tokens=30, overlap_tokens=8))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(count_tokens(chunk) <= 30 for chunk in chunks))
+        # Trailing sentence of one chunk starts the next one
+        self.assertTrue(chunks[1].startswith(chunks[0].split(". ")[-1]))
+
+    def test_hashing_embedder_is_deterministic(self):
+        embedder = HashingEmbedder(dim=64)
+        first, second = embedder.embed(["reset my password", "reset my password"])
+        self.assertEqual(first.tobytes(), second.tobytes())
+        self.assertAlmostEqual(float(first @ first), 1.0, places=5)
+
+
+class IndexingTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+
+    def test_editing_an_item_only_reembeds_changed_chunks(self):
+        paragraphs = [f"Topic {i}. " + "Details about this topic. " * 30 for i in range(4)]
+        item = KnowledgeItem.objects.create(bot=self.bot, type="text", content="\n\n".join(paragraphs))
+        counts = index_bot(self.bot, StageTimer())
+        self.assertEqual(counts["chunks_embedded"], counts["chunks"])
+
+        self.assertEqual(index_bot(self.bot, StageTimer())["items"], 0)
+
+        paragraphs[-1] = "Topic 3 was rewritten. " + "New details. " * 30
+        item.content = "\n\n".join(paragraphs)
+        item.save()
+        counts = index_bot(self.bot, StageTimer())
+        self.assertEqual(counts["items"], 1)
+        self.assertGreater(counts["chunks_embedded"], 0)
+        self.assertLess(counts["chunks_embedded"], counts["chunks"])
+        self.assertEqual(item.chunks.count(), counts["chunks"])
+
+    @override_settings(BOT_EMBEDDING_BATCH_SIZE=1)
+    def test_failed_extraction_keeps_the_previous_chunks(self):
+        item = KnowledgeItem.objects.create(bot=self.bot, type="text", content="Refunds are issued within 5 days.")
+        index_bot(self.bot, StageTimer())
+        chunk_ids = set(item.chunks.values_list("id", flat=True))
+        item.save()
+
+        def failing_text(item):
+            yield "Refunds are now issued within 2 days. " * 200
+            raise ExtractionError("truncated file")
+
+        with mock.patch("bot.tasks.embeddings.knowledge_text", failing_text):
+            counts = index_bot(self.bot, StageTimer())
+        self.assertEqual((counts["items"], counts["items_failed"]), (0, 1))
+        self.assertEqual(set(item.chunks.values_list("id", flat=True)), chunk_ids)
+        self.assertEqual(sum(ChunkContent.objects.values_list("ref_count", flat=True)), len(chunk_ids))
+
+    def test_identical_chunks_share_content_across_bots(self):
+        content = "\n\n".join(f"Topic {i}. " + "Shared help center text. " * 30 for i in range(3))
+        KnowledgeItem.objects.create(bot=self.bot, type="text", content=content)
+        first = index_bot(self.bot, StageTimer())
+
+        clone = Bot.objects.create(company=self.company, name="Clone")
+        # Whitespace differences don't matter
+        KnowledgeItem.objects.create(bot=clone, type="text", content=content.replace(". ", ".   "))
+        second = index_bot(clone, StageTimer())
+        self.assertEqual(second["chunks"], first["chunks"])
+        self.assertEqual(second["chunks_embedded"], 0)
+        self.assertEqual(ChunkContent.objects.count(), first["chunks"])
+        self.assertEqual(set(ChunkContent.objects.values_list("ref_count", flat=True)), {2})
+
+        # Deleting a bot releases its references, the last reference frees the content
+        clone.delete()
+        self.assertEqual(set(ChunkContent.objects.values_list("ref_count", flat=True)), {1})
+        self.assertEqual(collect_garbage(), 0)
+        self.bot.knowledge_items.all().delete()
+        self.assertEqual(collect_garbage(), first["chunks"])
+        self.assertFalse(ChunkContent.objects.exists())
+
+
+class VectorIndexTests(TestCase):
+    def test_search_returns_top_k_in_score_order(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((500, 32)).astype(np.float32)
+        index = VectorIndex(np.arange(500, dtype=np.int64) + 1000, vectors)
+        queries = vectors[[3, 42]]
+
+        results = index.search(queries, k=5)
+        for query, row in zip(queries, results):
+            expected = np.argsort(-(vectors @ query))[:5] + 1000
+            self.assertEqual([chunk_id for chunk_id, _ in row], expected.tolist())
+
+    def test_partitioned_index_ranks_the_rows_near_the_query_exactly(self):
+        rng = np.random.default_rng(0)
+        topics = rng.standard_normal((40, 32)).astype(np.float32)
+        vectors = topics[rng.integers(0, 40, 3000)] + 0.3 * rng.standard_normal((3000, 32)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = vectors[[3, 42, 2999]]
+        expected = [[chunk_id for chunk_id, _ in hits] for hits in VectorIndex(np.arange(3000, dtype=np.int64), vectors).search(queries, k=5)]
+
+        with tempfile.TemporaryDirectory() as root:
+            path = Path(root)
+            np.save(path / "chunk_ids.npy", np.arange(3000, dtype=np.int64))
+            np.save(path / "vectors.npy", vectors)
+            partition_index(path)
+            index = VectorIndex.load(path)
+            self.assertEqual(len(index.centroids), 54)
+            # Rows are regrouped, chunk ids along with them
+            self.assertEqual(sorted(index.chunk_ids.tolist()), list(range(3000)))
+            np.testing.assert_array_equal(index.vectors, vectors[index.chunk_ids])
+            with override_settings(BOT_INDEX_PROBES=8):
+                results = index.search(queries, k=5)
+        self.assertEqual([[chunk_id for chunk_id, _ in hits] for hits in results], expected)
+
+    def test_index_is_built_and_searched_from_chunks(self):
+        company = Company.objects.create(name="Acme")
+        bot = Bot.objects.create(company=company, name="Acme Bot")
+        KnowledgeItem.objects.create(bot=bot, type="text", content="Reset your password from the account settings page.")
+        KnowledgeItem.objects.create(bot=bot, type="text", content="Invoices are emailed on the first day of each month.")
+
+        for quantize, partition_min_rows in ((False, 20000), (True, 20000), (False, 1)):
+            with tempfile.TemporaryDirectory() as root, override_settings(BOT_INDEX_ROOT=root, BOT_INDEX_QUANTIZE=quantize, BOT_INDEX_PARTITION_MIN_ROWS=partition_min_rows):
+                train_bot({"bot_id": str(bot.id)})
+                index = get_vector_index(bot.id, read_active(bot.id).vectors)
+                self.assertEqual((len(index), index.centroids is not None), (2, partition_min_rows == 1))
+                [hits] = search_knowledge(bot.id, ["how do I reset my password"], k=1)
+                self.assertIn("password", hits[0]["text"])
+
+
+class BM25IndexTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        self.root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(BOT_INDEX_ROOT=self.root.name, BOT_BM25_MAX_SEGMENTS=3)
+        self.settings.enable()
+        self.generation = None
+
+    def tearDown(self):
+        self.settings.disable()
+        self.root.cleanup()
+
+    def update(self):
+        self.generation, stats = bm25.update_bm25_index(self.bot, self.generation)
+        return stats
+
+    def add_item(self, content):
+        item = KnowledgeItem.objects.create(bot=self.bot, type="text", content=content)
+        index_bot(self.bot, StageTimer())
+        self.update()
+        return item
+
+    def test_exact_product_code_ranks_first(self):
+        self.add_item("Error ERR-4012 means the card was declined by the bank.")
+        self.add_item("Errors during checkout are usually caused by network problems.")
+        [(chunk_id, _)] = bm25.search(self.bot.id, self.generation, "what is ERR-4012", k=1)
+        self.assertIn("ERR-4012", self.bot.chunks.get(id=chunk_id).content.text)
+
+    def test_incremental_updates_match_full_rebuild(self):
+        items = [self.add_item(f"Article {i} about shipping, returns and refunds number {i}.") for i in range(6)]
+        deleted_chunk_ids = set(items[2].chunks.values_list("id", flat=True))
+        items[2].delete()
+        items[4].delete()
+        stats = self.update()
+        self.assertEqual(stats["keyword_removed"], 2)
+        self.assertLessEqual(stats["keyword_segments"], 3)
+
+        incremental = bm25.search(self.bot.id, self.generation, "refunds number 3", k=4)
+        shutil.rmtree(bm25.bm25_dir(self.bot.id))
+        self.generation = None
+        self.update()
+        rebuilt = bm25.search(self.bot.id, self.generation, "refunds number 3", k=4)
+
+        self.assertEqual(incremental[0][0], rebuilt[0][0])
+        self.assertEqual({chunk_id for chunk_id, _ in incremental}, {chunk_id for chunk_id, _ in rebuilt})
+        self.assertFalse(deleted_chunk_ids & {chunk_id for chunk_id, _ in incremental})
+
+    def test_reciprocal_rank_fusion_rewards_agreement(self):
+        fused = reciprocal_rank_fusion([[(1, 0.9), (2, 0.8)], [(2, 12.0), (3, 7.0)]], k=3)
+        self.assertEqual(fused[0][0], 2)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class KnowledgeVersionTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        get_company()
+        self.root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(BOT_INDEX_ROOT=self.root.name, BOT_KNOWLEDGE_VERSIONS_KEPT=2)
+        self.settings.enable()
+        self.item = KnowledgeItem.objects.create(bot=self.bot, type="text", content="Refunds are paid within 14 days.")
+        train_bot({"bot_id": str(self.bot.id)})
+
+    def tearDown(self):
+        self.settings.disable()
+        self.root.cleanup()
+
+    def answer(self):
+        [[hit]] = search_knowledge(self.bot.id, ["how long do refunds take"], k=1)
+        return hit["text"]
+
+    def retrain(self, content):
+        KnowledgeItem.objects.filter(id=self.item.id).update(content=content, updated_at=timezone.now())
+        train_bot({"bot_id": str(self.bot.id)})
+
+    def test_training_publishes_a_new_version_and_keeps_the_old_one(self):
+        version = read_active(self.bot.id)
+        [pinned] = bm25.search(self.bot.id, version.keywords, "refunds", k=1)
+        self.retrain("Refunds are paid within 30 days.")
+
+        self.assertEqual(read_active(self.bot.id).number, version.number + 1)
+        self.assertIn("30 days", self.answer())
+        # A search that read the previous pointer still finishes against its version
+        self.assertEqual(bm25.search(self.bot.id, version.keywords, "refunds", k=1), [pinned])
+        old_chunk = KnowledgeChunk.objects.get(id=pinned[0])
+        self.assertEqual(old_chunk.retired_in, version.number + 1)
+
+        response = self.client.post(f"/rest/v1/bot/{self.bot.id}/versions/{version.number}/activate")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("14 days", self.answer())
+        self.bot.refresh_from_db()
+        self.assertEqual(self.bot.active_version.number, version.number)
+
+    def test_versions_past_retention_are_pruned(self):
+        for days in (30, 60, 90):
+            self.retrain(f"Refunds are paid within {days} days.")
+
+        response = self.client.get(f"/rest/v1/bot/{self.bot.id}/versions")
+        self.assertEqual([(version["number"], version["status"], version["active"]) for version in response.json()], [(4, "ready", True), (3, "ready", False), (2, "archived", False), (1, "archived", False)])
+        # Only the chunks of versions 3 and 4 are left, and only their index files
+        self.assertEqual(sorted(self.bot.chunks.values_list("content__text", flat=True)), ["Refunds are paid within 60 days.", "Refunds are paid within 90 days."])
+        self.assertEqual(len(list(Path(self.root.name, str(self.bot.id)).glob("vectors-*"))), 2)
+
+        response = self.client.post(f"/rest/v1/bot/{self.bot.id}/versions/1/activate")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, CONVERSATION_WRITE_BACKGROUND=False)
+class ChatTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        self.root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(BOT_INDEX_ROOT=self.root.name)
+        self.settings.enable()
+        KnowledgeItem.objects.create(bot=self.bot, type="text", content="You can reset your password from the account settings page. It takes a minute.")
+        train_bot({"bot_id": str(self.bot.id)})
+
+    def tearDown(self):
+        self.settings.disable()
+        self.root.cleanup()
+
+    def read_events(self, response):
+        body = b"".join(response.streaming_content).decode()
+        events = []
+        for block in body.strip().split("\n\n"):
+            event, data = block.split("\n")
+            events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return events
+
+    def test_chat_streams_tokens_then_metrics(self):
+        response = self.client.post(f"/rest/v1/bot/{self.bot.id}/chat", {"message": "How do I reset my password?"}, content_type="application/json")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+
+        events = self.read_events(response)
+        self.assertTrue(all(event == "token" for event, _ in events[:-1]))
+        self.assertEqual("".join(data["text"] for _, data in events[:-1]), "You can reset your password from the account settings page.")
+        event, data = events[-1]
+        self.assertEqual(event, "done")
+        self.assertLessEqual(data["metrics"]["ttft_ms"], data["metrics"]["total_ms"])
+
+    def ask(self, message, conversation_id=None):
+        data = {"message": message, "conversation_id": conversation_id} if conversation_id else {"message": message}
+        events = self.read_events(self.client.post(f"/rest/v1/bot/{self.bot.id}/chat", data, content_type="application/json"))
+        return "".join(data["text"] for event, data in events if event == "token"), events[-1][1]
+
+    def test_messages_are_written_in_batches(self):
+        # Drop messages buffered by other tests
+        message_writer.flush()
+        reply, done = self.ask("How do I reset my password?")
+        self.ask("Thanks, and how long does it take?", done["conversation_id"])
+        other_bot = Bot.objects.create(company=self.company, name="Other Bot")
+        record_turn(other_bot.id, parse_conversation_id(done["conversation_id"]), "Hijack?", timezone.now(), "No")
+        self.assertFalse(Message.objects.exists())
+
+        # Bots, new conversations, their owners and the messages, whatever the batch size
+        with self.assertNumQueries(6):
+            self.assertEqual(message_writer.flush(), 4)
+        conversation = Conversation.objects.get()
+        self.assertEqual(str(conversation.id), done["conversation_id"])
+        self.assertEqual(
+            list(conversation.messages.order_by("created_at", "id").values_list("role", "content")),
+            [("user", "How do I reset my password?"), ("assistant", reply), ("user", "Thanks, and how long does it take?"), ("assistant", reply)],
+        )
+        self.assertEqual(conversation.messages.filter(role="assistant").first().metadata["sources"], done["sources"])
+
+    def test_repeated_questions_are_answered_from_cache(self):
+        text, done = self.ask("How do I reset my password?")
+        self.assertFalse(done["metrics"]["cached"])
+
+        # Only the bot is loaded, retrieval and generation are skipped
+        with self.assertNumQueries(1):
+            cached_text, cached_done = self.ask("how do I reset   my password")
+        self.assertTrue(cached_done["metrics"]["cached"])
+        self.assertEqual((cached_text, cached_done["sources"]), (text, done["sources"]))
+
+        with override_settings(BOT_ANSWER_CACHE_SIMILARITY=0.5):
+            self.assertTrue(self.ask("How can I reset the password?")[1]["metrics"]["cached"])
+        self.assertFalse(self.ask("How can I reset the password?")[1]["metrics"]["cached"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            KnowledgeItem.objects.create(bot=self.bot, type="text", content="Passwords can also be reset by support.")
+        self.assertFalse(self.ask("How do I reset my password?")[1]["metrics"]["cached"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bot.tone = "friendly"
+            self.bot.save()
+        self.assertFalse(self.ask("How do I reset my password?")[1]["metrics"]["cached"])
+
+    def test_follow_ups_are_answered_with_the_conversation_history(self):
+        _, done = self.ask("How do I reset my password?")
+        # The bot and the retrieved chunks; the conversation comes from the cache
+        with self.assertNumQueries(2):
+            _, follow_up = self.ask("How long does it take?", done["conversation_id"])
+        self.assertFalse(follow_up["metrics"]["cached"])
+        session = load_session(self.bot.id, done["conversation_id"])
+        self.assertEqual([turn.question for turn in session.turns], ["How do I reset my password?", "How long does it take?"])
+
+        # Once the session left the cache, its turns are read back from the stored messages
+        message_writer.flush()
+        cache.clear()
+        self.assertEqual(len(load_session(self.bot.id, done["conversation_id"]).turns), 2)
+
+    def test_context_fits_the_token_budget(self):
+        session = Session()
+        for i in range(20):
+            session.add_turn(f"Question number {i} about my order?", f"Answer number {i}. " + "More detail. " * 30)
+        self.assertLessEqual(len(session.turns), settings.CHAT_HISTORY_TURNS)
+        self.assertIn("Answer number 13.", session.summary)
+        self.assertNotIn("Answer number 0.", session.summary)
+
+        chunks = [{"chunk_id": i, "text": f"Passage {i}. " + "Knowledge text. " * 100} for i in range(4)]
+        with override_settings(CHAT_CONTEXT_TOKENS=1300):
+            messages, used = build_messages(self.bot, "Where is my order?", chunks, session)
+            self.assertLessEqual(sum(count_tokens(message["content"]) for message in messages), settings.CHAT_CONTEXT_TOKENS)
+        self.assertEqual([chunk["chunk_id"] for chunk in used], [0, 1])
+        self.assertEqual(messages[-1], {"role": "user", "content": "Where is my order?"})
+        self.assertEqual(messages[-2]["content"], session.turns[-1].answer)
+
+    async def test_chat_streams_from_async_generator_under_asgi(self):
+        response = await self.async_client.post(f"/rest/v1/bot/{self.bot.id}/chat", {"message": "How do I reset my password?"}, content_type="application/json")
+        self.assertTrue(response.is_async)
+        body = "".join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertIn("event: done", body)
+
+    def test_chat_unknown_bot(self):
+        response = self.client.post("/rest/v1/bot/00000000-0000-0000-0000-000000000000/chat", {"message": "hi"}, content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        get_company()
+        self.noon = datetime(2026, 3, 2, 12, 15, tzinfo=dt_timezone.utc)
+
+    def ask(self, conversation, question, at, answered=True, opening=False):
+        Message.objects.create(conversation=conversation, bot=self.bot, role="user", content=question, metadata={"opening": opening, "answered": answered}, created_at=at)
+        Message.objects.create(conversation=conversation, bot=self.bot, role="assistant", content="...", created_at=at)
+
+    def test_rollups_are_incremental_and_served_by_the_endpoints(self):
+        first = Conversation.objects.create(bot=self.bot, created_at=self.noon)
+        self.ask(first, "Do you ship to Mars?", self.noon, answered=False, opening=True)
+        self.ask(first, "How do I return an order?", self.noon + timedelta(minutes=5))
+        response = self.client.post(f"/rest/v1/bot/{self.bot.id}/feedback", {"conversation_id": str(first.id), "rating": "up"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        Feedback.objects.filter(bot=self.bot).update(created_at=self.noon)
+
+        self.assertEqual(rollup_analytics(batch_size=1), {"questions": 2, "feedback": 1})
+        self.assertEqual(rollup_analytics(), {"questions": 0, "feedback": 0})
+
+        # Inserted late by the message buffer, still folded into its own hour
+        second = Conversation.objects.create(bot=self.bot, created_at=self.noon)
+        self.ask(second, "do you ship to mars", self.noon + timedelta(minutes=1), answered=False, opening=True)
+        self.ask(second, "Thanks!", self.noon + timedelta(hours=1))
+        Feedback.objects.create(bot=self.bot, conversation_id=second.id, rating=-1, created_at=self.noon)
+        self.assertEqual(rollup_analytics(), {"questions": 2, "feedback": 1})
+
+        query = {"period": "hour", "since": "2026-03-02T00:00:00Z", "until": "2026-03-03T00:00:00Z"}
+        data = self.client.get(f"/rest/v1/bot/{self.bot.id}/analytics", query).json()
+        self.assertEqual([(row["start"][11:16], row["questions"]) for row in data["series"]], [("12:00", 3), ("13:00", 1)])
+        self.assertEqual(
+            data["totals"],
+            {"conversations": 2, "questions": 4, "unanswered": 2, "thumbs_up": 1, "thumbs_down": 1, "satisfaction": 0.5},
+        )
+        self.assertEqual(data["top_unanswered"], [{"question": "do you ship to mars", "count": 2}])
+
+        response = self.client.get(f"/rest/v1/bot/{self.bot.id}/analytics/export", {**query, "period": "day"})
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, ["start,conversations,questions,unanswered,thumbs_up,thumbs_down", "2026-03-02T00:00:00+00:00,2,4,2,1,1"])
+
+    def test_rows_committed_behind_the_watermark_are_folded_once(self):
+        conversation = Conversation.objects.create(bot=self.bot, created_at=self.noon)
+        for message_id, question in [(10, "Do you ship to Mars?"), (20, "And to Venus?")]:
+            Message.objects.create(id=message_id, conversation=conversation, bot=self.bot, role="user", content=question, metadata={"answered": True}, created_at=self.noon)
+        self.assertEqual(rollup_analytics(), {"questions": 2, "feedback": 0})
+
+        # A concurrent transaction took its id before the folded rows, and committed after
+        Message.objects.create(id=15, conversation=conversation, bot=self.bot, role="user", content="Late", metadata={"answered": True}, created_at=self.noon)
+        self.assertEqual(rollup_analytics(), {"questions": 1, "feedback": 0})
+        self.assertEqual(rollup_analytics(), {"questions": 0, "feedback": 0})
+        self.assertEqual(AnalyticsRollup.objects.get(bot=self.bot, period="day").questions, 3)
+
+    def test_a_conversation_counts_its_last_vote_only(self):
+        conversation = Conversation.objects.create(bot=self.bot, created_at=self.noon)
+        url = f"/rest/v1/bot/{self.bot.id}/feedback"
+        response = self.client.post(url, {"conversation_id": str(conversation.id), "rating": "up"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(rollup_analytics(), {"questions": 0, "feedback": 1})
+
+        for rating in ("down", "down"):
+            response = self.client.post(url, {"conversation_id": str(conversation.id), "rating": rating}, content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(Feedback.objects.filter(bot=self.bot).count(), 1)
+        self.assertEqual(rollup_analytics(), {"questions": 0, "feedback": 1})
+        rollup = AnalyticsRollup.objects.get(bot=self.bot, period="day")
+        self.assertEqual((rollup.thumbs_up, rollup.thumbs_down), (0, 1))
+
+    def test_feedback_on_unknown_conversations_is_ignored(self):
+        other_bot = Bot.objects.create(company=self.company, name="Other Bot")
+        elsewhere = Conversation.objects.create(bot=other_bot, created_at=self.noon)
+        buffered = uuid.uuid4()
+        Feedback.objects.create(bot=self.bot, conversation_id=elsewhere.id, rating=1, created_at=self.noon)
+        Feedback.objects.create(bot=self.bot, conversation_id=uuid.uuid4(), rating=1, created_at=self.noon)
+        Feedback.objects.create(bot=self.bot, conversation_id=buffered, rating=-1)
+        self.assertEqual(rollup_analytics(batch_size=1), {"questions": 0, "feedback": 0})
+        self.assertFalse(AnalyticsRollup.objects.exists())
+        # Still waiting for its conversation to be written
+        self.assertEqual(list(Feedback.objects.filter(pending=True).values_list("conversation_id", flat=True)), [buffered])
+
+        Conversation.objects.create(id=buffered, bot=self.bot)
+        self.assertEqual(rollup_analytics(), {"questions": 0, "feedback": 1})
+
+    def test_invalid_ranges_are_rejected(self):
+        response = self.client.get(f"/rest/v1/bot/{self.bot.id}/analytics", {"period": "hour", "since": "2020-01-01T00:00:00Z"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f"/rest/v1/bot/{self.bot.id}/analytics", {"period": "week"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class BotStatusTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        Polling.objects.create(bot=self.bot, status="started")
+        publish_status(self.bot.id)
+
+    def test_unchanged_status_is_not_modified_without_db_access(self):
+        response = self.client.get(f"/rest/v1/bot/{self.bot.id}/status")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/rest/v1/bot/{self.bot.id}/status", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Polling.objects.create(bot=self.bot, status="ready", completed=True, success=True)
+        publish_status(self.bot.id)
+        response = self.client.get(f"/rest/v1/bot/{self.bot.id}/status", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_stream_pushes_snapshot_and_ends_when_training_finishes(self):
+        Polling.objects.create(bot=self.bot, status="ready", completed=True, success=True)
+        publish_status(self.bot.id)
+        response = self.client.get(f"/rest/v1/bot/{self.bot.id}/status/stream")
+        body = b"".join(response.streaming_content).decode()
+        self.assertIn(f"id: {get_status_token(self.bot.id)}", body)
+        self.assertIn('"status": "ready"', body)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class BotQueryCountTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        # Warm the tenant cache, so the counts don't depend on test order
+        get_company()
+
+    def create_bots(self, count):
+        for i in range(count):
+            bot = Bot.objects.create(company=self.company, name=f"Bot {i}")
+            KnowledgeItem.objects.bulk_create([KnowledgeItem(bot=bot, type="text", content=f"Item {j}") for j in range(3)])
+            WhitelistedDomain.objects.create(bot=bot, domain=f"bot{i}.example.com")
+
+    def test_list_bots_query_count_does_not_grow_with_bots(self):
+        for total in (1, 10):
+            self.create_bots(total - Bot.objects.count())
+            # bots, knowledge items, whitelisted domains
+            with self.assertNumQueries(3):
+                response = self.client.get("/rest/v1/bots")
+            self.assertEqual(len(response.json()), total)
+            self.assertEqual(len(response.json()[0]["knowledge_items"]), 3)
+
+    def test_list_bots_projection_skips_relations_and_content(self):
+        self.create_bots(5)
+        with self.assertNumQueries(1):
+            response = self.client.get("/rest/v1/bots?fields=id,name")
+        self.assertEqual(set(response.json()[0]), {"id", "name"})
+
+        with self.assertNumQueries(2):
+            response = self.client.get("/rest/v1/bots?fields=id,knowledge_items")
+        self.assertEqual(set(response.json()[0]["knowledge_items"][0]), {"id", "type"})
+
+        self.assertEqual(self.client.get("/rest/v1/bots?fields=secret").status_code, 400)
+
+    def test_get_bot_query_count(self):
+        self.create_bots(1)
+        bot = Bot.objects.get()
+        with self.assertNumQueries(3):
+            response = self.client.get(f"/rest/v1/bot/{bot.id}")
+        self.assertEqual(response.json()["whitelisted_domains"], ["bot0.example.com"])
+        self.assertEqual(response.json()["company"]["name"], "Acme")
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+
+    def test_bots_are_paged_by_cursor(self):
+        Bot.objects.bulk_create([Bot(company=self.company, name=f"Bot {i}") for i in range(7)])
+        seen, cursor = [], None
+        while True:
+            response = self.client.get("/rest/v1/bots", {"fields": "id", "limit": 3, **({"cursor": cursor} if cursor else {})})
+            seen.extend(bot["id"] for bot in response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        self.assertEqual(self.client.get("/rest/v1/bots", {"cursor": "garbage"}).status_code, 400)
+
+    def test_knowledge_listing_returns_previews(self):
+        bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        item = KnowledgeItem.objects.create(bot=bot, type="text", content="x" * 5000)
+        with override_settings(KNOWLEDGE_PREVIEW_CHARS=100):
+            [listed] = self.client.get(f"/rest/v1/bot/{bot.id}/knowledge").json()
+        self.assertEqual(len(listed["preview"]), 100)
+        self.assertEqual(listed["length"], 5000)
+
+        full = self.client.get(f"/rest/v1/bot/{bot.id}/knowledge/{item.id}").json()
+        self.assertEqual(len(full["content"]), 5000)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, CONVERSATION_WRITE_BACKGROUND=False)
+class OriginCheckTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        get_company()
+
+    def chat(self, origin):
+        return self.client.post(f"/rest/v1/bot/{self.bot.id}/chat", {"message": "hi"}, content_type="application/json", HTTP_ORIGIN=origin)
+
+    def test_matcher_exact_and_wildcard_hosts(self):
+        matcher = DomainMatcher(["Example.com", "*.shop.example.org", "https://app.acme.io:8443/path"])
+        self.assertTrue(matcher.matches("example.com"))
+        self.assertFalse(matcher.matches("www.example.com"))
+        self.assertTrue(matcher.matches("eu.store.shop.example.org"))
+        self.assertFalse(matcher.matches("shop.example.org"))
+        self.assertFalse(matcher.matches("evilshop.example.org"))
+        self.assertTrue(matcher.matches("app.acme.io"))
+        self.assertEqual(normalize_host("https://Example.com.:443"), "example.com")
+
+    def test_chat_is_rejected_from_other_origins(self):
+        self.client.post(f"/rest/v1/bot/{self.bot.id}/domains", {"domains": ["*.acme.com"]}, content_type="application/json")
+        self.assertEqual(self.chat("https://help.acme.com").status_code, 200)
+        self.assertEqual(self.chat("https://evil.com").status_code, 403)
+        self.assertEqual(self.chat("http://localhost:5173").status_code, 200)
+
+        # The matcher is rebuilt once the domains change, and cached until then
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/rest/v1/bot/{self.bot.id}/domains", {"domains": ["evil.com"]}, content_type="application/json")
+        self.assertEqual(self.chat("https://evil.com").status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertTrue(is_origin_allowed(get_domain_matcher(self.bot.id), "evil.com"))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, RATE_LIMIT_BOT_IP=(2, 60), RATE_LIMIT_COMPANY=(3, 60))
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        get_company()
+
+    def feedback(self, ip="203.0.113.7", bot=None):
+        bot = bot or self.bot
+        return self.client.post(f"/rest/v1/bot/{bot.id}/feedback", {"conversation_id": str(uuid.uuid4()), "rating": "up"}, content_type="application/json", REMOTE_ADDR=ip)
+
+    def test_limits_per_bot_and_ip_then_per_company(self):
+        self.assertEqual([self.feedback().status_code for _ in range(3)], [201, 201, 429])
+        self.assertGreaterEqual(int(self.feedback()["Retry-After"]), 30)
+        # Another visitor of the same company still gets through, until the company's limit
+        self.assertEqual(self.feedback(ip="198.51.100.1").status_code, 201)
+        other_bot = Bot.objects.create(company=self.company, name="Other Bot")
+        self.assertEqual(self.feedback(ip="198.51.100.1", bot=other_bot).status_code, 429)
+
+    def test_backoff_doubles_for_repeat_offenders(self):
+        for limiter in (LocalRateLimiter(), CacheRateLimiter()):
+            key = f"bot-ip:{uuid.uuid4()}"
+            waits = [limiter.check(key, (1, 1), backoff=True) for _ in range(3)]
+            self.assertEqual(waits[0], 0)
+            # While blocked, the remaining time is reported without a new strike
+            self.assertTrue(0 < waits[2] <= waits[1] <= 2)
+            with mock.patch("time.time", return_value=time.time() + 3), mock.patch("time.monotonic", return_value=time.monotonic() + 3):
+                self.assertEqual(limiter.check(key, (1, 1), backoff=True), 0)
+                self.assertGreater(limiter.check(key, (1, 1), backoff=True), 1.5)
+
+
+class WidgetConfigTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme", primary_color="#111111")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot", tone="friendly")
+        WhitelistedDomain.objects.create(bot=self.bot, domain="acme.com")
+
+    def get(self, **headers):
+        return self.client.get(f"/rest/v1/widget/{self.bot.id}/config", **headers)
+
+    def test_config_is_cached_and_revalidated_by_etag(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["tone"], "friendly")
+        self.assertEqual(response.json()["primary_color"], "#111111")
+        self.assertEqual(response.json()["domains"], ["acme.com"])
+        self.assertIn("stale-while-revalidate=", response["Cache-Control"])
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.primary_color = "#222222"
+            self.company.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["primary_color"], "#222222")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_unknown_bot(self):
+        self.assertEqual(self.client.get(f"/rest/v1/widget/{uuid.uuid4()}/config").status_code, 404)
+        self.assertEqual(self.client.get("/rest/v1/widget/not-a-bot/config").status_code, 404)
+
+
+class DatabaseProfileTests(TransactionTestCase):
+    def test_sqlite_pragmas_and_write_load_test(self):
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA synchronous")
+                self.assertEqual(cursor.fetchone()[0], 1 if settings.SQLITE_PRAGMAS.get("synchronous") == "NORMAL" else 2)
+        out = io.StringIO()
+        call_command("load_test_writes", threads=2, seconds=0.2, stdout=out)
+        self.assertIn("writes/s", out.getvalue())
+        # The scratch rows are gone
+        self.assertFalse(Bot.objects.exists())
+        self.assertFalse(Message.objects.exists())
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = io.StringIO()
+        call_command("explain_queries", stdout=out)
+        self.assertNotIn("FULL SCAN", out.getvalue())
+
+        queries = {"pollings by status": Polling.objects.filter(status="ready")}
+        with mock.patch("bot.management.commands.explain_queries.hot_queries", return_value=queries):
+            with self.assertRaisesMessage(CommandError, "pollings by status"):
+                call_command("explain_queries", stdout=io.StringIO())
+
+
+class KnowledgeImportTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        get_company()
+
+    def upload(self, name, body, **params):
+        return self.client.post(f"/rest/v1/bot/{self.bot.id}/knowledge/import" + ("?format=" + params["format"] if params else ""), {"file": SimpleUploadedFile(name, body.encode())})
+
+    def test_jsonl_import_inserts_in_batches_and_queues_one_job(self):
+        body = "\n".join(json.dumps({"content": f"Answer {i}"}) for i in range(25)) + "\n\n"
+        with override_settings(KNOWLEDGE_IMPORT_BATCH_SIZE=10), CaptureQueriesContext(connection) as queries:
+            response = self.upload("faq.jsonl", body)
+        inserts = [query for query in queries if query["sql"].startswith('INSERT INTO "bot_knowledgeitem"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["imported"], 25)
+        self.assertEqual(self.bot.knowledge_items.count(), 25)
+        self.assertEqual(Job.objects.filter(key=f"embeddings:{self.bot.id}").count(), 1)
+        polling = Polling.objects.get(id=response.json()["polling_id"])
+        self.assertEqual((polling.status, polling.completed, polling.progress), ("importing", True, {"imported": 25}))
+
+    def test_csv_import_with_quoted_newlines(self):
+        body = 'type,content\ntext,"Line one\nline two"\nurl,https://acme.com/faq\n'
+        response = self.upload("faq.txt", body, format="csv")
+        self.assertEqual(response.json()["imported"], 2)
+        self.assertEqual(set(self.bot.knowledge_items.values_list("content", flat=True)), {"Line one\nline two", "https://acme.com/faq"})
+
+    def test_invalid_record_rolls_back_whole_import(self):
+        body = json.dumps({"content": "ok"}) + "\n" + json.dumps({"type": "video", "content": "x"}) + "\n"
+        response = self.upload("faq.jsonl", body)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Line 2", response.json()["error"])
+        self.assertEqual(self.bot.knowledge_items.count(), 0)
+        self.assertEqual(self.bot.pollings.get().status, "error")
+        self.assertEqual(self.upload("faq.pdf", "x").status_code, 400)
+
+    def test_fields_of_the_wrong_type_are_rejected(self):
+        for record in ({"type": 1, "content": "x"}, {"type": ["text"], "content": "x"}, {"content": 42}):
+            response = self.upload("faq.jsonl", json.dumps({"content": "ok"}) + "\n" + json.dumps(record) + "\n")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("Line 2", response.json()["error"])
+        self.assertEqual(self.bot.knowledge_items.count(), 0)
+
+    def test_unexpected_errors_fail_the_polling(self):
+        with mock.patch.object(KnowledgeItem.objects, "bulk_create", side_effect=RuntimeError("disk full")), self.assertRaises(RuntimeError):
+            import_knowledge(self.bot, [b'{"content": "ok"}\n'], "jsonl")
+        polling = self.bot.pollings.get()
+        self.assertEqual((polling.status, polling.completed, polling.success, polling.error), ("error", True, False, "Import failed"))
+
+
+class StubPageHandler(BaseHTTPRequestHandler):
+    """Serves one HTML page with an ETag, answering 304 to a matching If-None-Match."""
+
+    etag = '"v1"'
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/refunds")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = b"<html><head><title>x</title><script>var secret = 1;</script></head><body><h1>Refunds</h1><p>Refunds are issued within 5 days.</p></body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class IngestionTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubPageHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.shutdown)
+
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.bot = Bot.objects.create(company=self.company, name="Acme Bot")
+        get_company()
+
+    def tearDown(self):
+        for item in self.bot.knowledge_items.exclude(file=""):
+            item.file.delete(save=False)
+
+    def test_html_and_markdown_extraction(self):
+        html = b"<p>Hello <b>world</b></p><style>p {}</style><script>alert(1)</script><p>Bye</p>"
+        self.assertEqual("".join(extract_text(io.BytesIO(html), "page.html")).split(), ["Hello", "world", "Bye"])
+        markdown = b"# Title\n\nSee [the docs](https://acme.com) for **more**.\n```\ncode\n```\n"
+        self.assertEqual("".join(extract_text(io.BytesIO(markdown), "notes.md")).split(), ["Title", "See", "the", "docs", "for", "more.", "code"])
+
+    def test_large_file_is_read_in_fixed_blocks(self):
+        reads = []
+
+        class TrackedFile(io.BytesIO):
+            def read(self, size=-1):
+                reads.append(size)
+                return super().read(size)
+
+        body = ("A sentence about shipping policies. " * 100 + "\n\n").encode() * 200
+        with override_settings(INGEST_READ_BYTES=4096):
+            chunks = list(chunk_text(extract_text(TrackedFile(body), "big.txt"), 200, 40))
+        self.assertGreater(len(chunks), 100)
+        self.assertEqual(set(reads), {4096})
+
+    def test_crawler_only_connects_to_public_addresses(self):
+        fetcher = UrllibFetcher()
+        for url in [f"http://127.0.0.1:{self.server.server_port}/refunds", "http://169.254.169.254/latest/meta-data/", "http://[::ffff:10.0.0.1]/"]:
+            with self.assertRaisesMessage(CrawlError, "private address"):
+                fetcher.fetch(url)
+        # Redirects are checked too: the first hop passes as public, the second doesn't
+        with mock.patch("bot.ingestion.crawler.is_public_address", side_effect=[True, False]):
+            with self.assertRaisesMessage(CrawlError, "private address"):
+                fetcher.fetch(f"http://127.0.0.1:{self.server.server_port}/moved")
+        self.assertFalse(is_public_address("100.64.0.1"))
+        self.assertTrue(is_public_address("93.184.216.34"))
+
+    @override_settings(CRAWL_ALLOW_PRIVATE_ADDRESSES=True)
+    def test_crawl_uses_conditional_get_and_indexes_page_text(self):
+        url = f"http://127.0.0.1:{self.server.server_port}/refunds"
+        item = KnowledgeItem.objects.create(bot=self.bot, type="url", content=url)
+        self.assertEqual(crawl_bot(self.bot)["fetched"], 1)
+        item.refresh_from_db()
+        self.assertEqual(item.etag, '"v1"')
+
+        counts = index_bot(self.bot, StageTimer())
+        self.assertEqual(counts["items"], 1)
+        text = " ".join(item.chunks.values_list("content__text", flat=True))
+        self.assertIn("Refunds are issued within 5 days.", text)
+        self.assertNotIn("secret", text)
+
+        self.assertEqual(crawl_bot(self.bot), {"fetched": 0, "unchanged": 1, "failed": 0})
+        self.assertEqual(index_bot(self.bot, StageTimer())["items"], 0)
+
+        KnowledgeItem.objects.create(bot=self.bot, type="url", content="file:///etc/passwd")
+        self.assertEqual(crawl_bot(self.bot)["failed"], 1)
+
+    def test_uploaded_file_is_indexed(self):
+        upload = SimpleUploadedFile("guide.md", b"## Setup\n\nInstall the **widget** snippet.\n", content_type="text/markdown")
+        response = self.client.post(f"/rest/v1/bot/{self.bot.id}/knowledge/file", {"file": upload})
+        self.assertEqual(response.status_code, 201)
+        index_bot(self.bot, StageTimer())
+        item = KnowledgeItem.objects.get(id=response.json()["id"])
+        self.assertEqual(list(item.chunks.values_list("content__text", flat=True)), ["Setup Install the widget snippet."])
+
+        response = self.client.get(f"/rest/v1/bot/{self.bot.id}/knowledge/{item.id}/file")
+        self.assertEqual(b"".join(response.streaming_content), b"## Setup\n\nInstall the **widget** snippet.\n")
+        self.assertIn('filename="guide.md"', response["Content-Disposition"])
+
+    def test_direct_uploads_need_object_storage(self):
+        response = self.client.post(f"/rest/v1/bot/{self.bot.id}/knowledge/file/presign", {"file_name": "guide.pdf", "size": 1024}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f"/rest/v1/bot/{self.bot.id}/knowledge/file/complete", {"key": "knowledge/guide.pdf", "file_name": "guide.pdf"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(os.getenv("S3_TEST_ENDPOINT_URL"), "Set S3_TEST_ENDPOINT_URL to a MinIO or moto server to run")
+@override_settings(
+    AWS_ACCESS_KEY_ID=os.getenv("S3_TEST_ACCESS_KEY_ID", "testing"),
+    AWS_SECRET_ACCESS_KEY=os.getenv("S3_TEST_SECRET_ACCESS_KEY", "testing"),
+    AWS_STORAGE_BUCKET_NAME="ai-customer-service-test",
+    AWS_S3_REGION_NAME="us-east-1",
+    AWS_S3_CUSTOM_DOMAIN=None,
+    AWS_S3_ENDPOINT_URL=os.getenv("S3_TEST_ENDPOINT_URL"),
+    AWS_S3_ADDRESSING_STYLE="path",
+    AWS_S3_MAX_POOL_CONNECTIONS=4,
+    AWS_S3_MULTIPART_THRESHOLD=5 * 1024 * 1024,
+    AWS_S3_MULTIPART_CHUNKSIZE=5 * 1024 * 1024,
+    AWS_S3_MAX_CONCURRENCY=2,
+    AWS_QUERYSTRING_EXPIRE=60,
+    AWS_PUBLIC_MEDIA_ACL="public-read",
+)
+class S3StorageTests(TestCase):
+    def setUp(self):
+        from core.s3 import S3MediaStorage
+
+        self.storage = S3MediaStorage()
+        self.storage.bucket.meta.client.create_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
+
+    def test_multipart_upload_and_presigned_urls(self):
+        body = bytes(range(256)) * (11 * 4096)  # 11 MiB, three parts
+        name = self.storage.save("knowledge/big.bin", SimpleUploadedFile("big.bin", body))
+        self.addCleanup(self.storage.delete, name)
+        self.assertEqual(self.storage.size(name), len(body))
+        with urlopen(self.storage.presigned_download(name, "big.bin")) as response:
+            self.assertEqual(response.read(), body)
+
+        upload = self.storage.presigned_upload("knowledge/direct.txt", "text/plain", 1024)
+        self.addCleanup(self.storage.delete, "knowledge/direct.txt")
+        boundary = uuid.uuid4().hex
+        parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode() for key, value in upload["fields"].items()]
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="direct.txt"\r\n\r\n'.encode() + b"uploaded directly\r\n")
+        request = Request(upload["url"], b"".join(parts) + f"--{boundary}--\r\n".encode(), {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        urlopen(request).close()
+        with self.storage.open("knowledge/direct.txt") as file:
+            self.assertEqual(file.read(), b"uploaded directly")
+
+    def test_public_images_have_unsigned_urls(self):
+        from core.s3 import S3PublicMediaStorage
+
+        storage = S3PublicMediaStorage()
+        name = storage.save("company_logos/logo.png", SimpleUploadedFile("logo.png", b"logo"))
+        self.addCleanup(storage.delete, name)
+        url = storage.url(name)
+        self.assertNotIn("X-Amz-Signature", url)
+        with urlopen(url) as response:
+            self.assertEqual(response.read(), b"logo")
+        self.assertIn("X-Amz-Signature", self.storage.url(name))
@@ -0,0 +1,69 @@
+"""The public configuration the chat widget loads on every page view.
+
+A bot's tone, branding and whitelisted domains are rendered once into a compact JSON
+body with a strong ETag, a hash of the `updated_at` of the bot, its company and its
+domains, and kept per process for `WIDGET_CONFIG_CACHE_TTL` seconds. Saving a bot,
+company or domains drops the entries of this process (see bot/signals.py); other
+processes pick the change up within the TTL, as browsers and CDNs do within `max-age`.
+"""
+
+import hashlib
+import json
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+from core.cache import LocalTTLCache
+from core.images import derivative_urls
+from .models import Bot, WhitelistedDomain
+
+_configs = LocalTTLCache(maxsize=settings.WIDGET_CONFIG_CACHE_SIZE, ttl=settings.WIDGET_CONFIG_CACHE_TTL)
+
+
+def build_widget_config(bot_id) -> Optional[Tuple[str, bytes]]:
+    """`(etag, body)` of a bot's widget configuration, None if there's no such bot."""
+    bot = Bot.objects.select_related("company").filter(id=bot_id).first()
+    if bot is None:
+        return None
+    company = bot.company
+    domains = list(WhitelistedDomain.objects.filter(bot_id=bot_id).order_by("domain").values_list("domain", "updated_at"))
+
+    stamps = [bot.updated_at, company.updated_at] + [updated_at for _, updated_at in domains]
+    # Domains also go in, so deleting one changes the tag
+    source = "|".join([stamp.isoformat() for stamp in stamps] + [domain for domain, _ in domains])
+    etag = f'"{hashlib.sha256(source.encode()).hexdigest()[:32]}"'
+    body = json.dumps(
+        {
+            "bot_id": str(bot.id),
+            "name": bot.name,
+            "tone": bot.tone,
+            "company": company.name,
+            "primary_color": company.primary_color,
+            "secondary_color": company.secondary_color,
+            "logo_url": company.logo.url if company.logo else None,
+            "logo_variants": derivative_urls(company.logo_variants, company.logo.storage),
+            "domains": [domain for domain, _ in domains],
+        },
+        separators=(",", ":"),
+    ).encode()
+    return etag, body
+
+
+def get_widget_config(bot_id) -> Optional[Tuple[str, bytes]]:
+    config = _configs.get(str(bot_id))
+    if config is None:
+        config = build_widget_config(bot_id)
+        if config is None:
+            return None
+        _configs.set(str(bot_id), config)
+    return config
+
+
+def cached_widget_config(bot_id) -> Optional[Tuple[str, bytes]]:
+    """The configuration if this process has it, for async views to skip the thread hop."""
+    return _configs.get(str(bot_id))
+
+
+def invalidate_widget_config(*bot_ids):
+    for bot_id in bot_ids:
+        _configs.delete(str(bot_id))
@@ -1,6 +1,6 @@
 from django.db import models
 import uuid
-from core.storage import MediaStorage
+from core.storage import PublicMediaStorage
 
 
 class Company(models.Model):
@@ -8,7 +8,9 @@ class Company(models.Model):
     name = models.CharField(max_length=255)
     primary_color = models.CharField(max_length=7, default="#3B82F6")  # Hex color
     secondary_color = models.CharField(max_length=7, default="#10B981")  # Hex color
-    logo = models.ImageField(storage=MediaStorage(), upload_to="company_logos/", null=True, blank=True)
+    logo = models.ImageField(storage=PublicMediaStorage(), upload_to="company_logos/", null=True, blank=True)
+    # Resized copies of the logo, see core/images.py
+    logo_variants = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -1,9 +1,10 @@
 from ninja import Router
 from ninja.schema import Schema
-from typing import Optional
+from typing import Dict, Optional
 from django.http import HttpRequest
 
-from ..models import Company
+from core.images import ImageError, create_derivatives, derivative_urls
+from core.tenants import aresolve_company
 
 router = Router()
 
@@ -20,6 +21,8 @@ class CompanyResponseSchema(Schema):
     primary_color: str
     secondary_color: str
     logo_url: Optional[str] = None
+    # {format: {width: url}}
+    logo_variants: Dict[str, Dict[str, str]] = {}
 
 
 @router.get(
@@ -27,13 +30,13 @@ class CompanyResponseSchema(Schema):
     response=CompanyResponseSchema,
     # auth=django_auth,
 )
-def get_company(request):
-    company = Company.objects.first()
+async def get_company(request):
+    # Async so the widget's branding lookup doesn't take a thread under ASGI
 
     # TODO: uncomment later
     # if not request.user.is_authenticated:
     #     return 403, {"detail": "Authentication required"}
-    company = request.company
+    company = await aresolve_company(request)
 
     return {
         "id": str(company.id),
@@ -41,6 +44,7 @@ def get_company(request):
         "primary_color": company.primary_color,
         "secondary_color": company.secondary_color,
         "logo_url": company.logo.url if company.logo else None,
+        "logo_variants": derivative_urls(company.logo_variants, company.logo.storage),
     }
 
 
@@ -64,6 +68,10 @@ def create_company(request: HttpRequest):
     company.secondary_color = secondary_color
 
     if logo:
+        try:
+            company.logo_variants = create_derivatives(logo, company.logo.storage, "company_logos")
+        except ImageError as e:
+            return 400, {"detail": str(e)}
         company.logo = logo
 
     company.save()
@@ -74,6 +82,7 @@ def create_company(request: HttpRequest):
         "primary_color": company.primary_color,
         "secondary_color": company.secondary_color,
         "logo_url": company.logo.url if company.logo else None,
+        "logo_variants": derivative_urls(company.logo_variants, company.logo.storage),
     }
 
 
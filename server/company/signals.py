@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.tenants import invalidate_company
+from .models import Company
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def company_changed(sender, instance, **kwargs):
+    # Again on commit, in case another request cached the old row in between
+    invalidate_company(instance.id)
+    transaction.on_commit(lambda: invalidate_company(instance.id))
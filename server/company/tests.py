@@ -1,3 +1,90 @@
-from django.test import TestCase
+from io import BytesIO
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from core.tenants import get_company
+from web_auth.models import User
+from .models import Company
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TenantResolutionTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+
+    def test_company_is_cached_and_invalidated_on_save(self):
+        self.assertEqual(get_company(self.company.id).name, "Acme")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_company(self.company.id).name, "Acme")
+
+        self.company.name = "Acme Inc"
+        self.company.save()
+        self.assertEqual(get_company(self.company.id).name, "Acme Inc")
+
+    def test_cached_company_is_not_shared_between_callers(self):
+        get_company(self.company.id).name = "Changed"
+        self.assertEqual(get_company(self.company.id).name, "Acme")
+
+    def test_request_resolves_session_users_company(self):
+        other = Company.objects.create(name="Globex")
+        user = User.objects.create_user(username="jane", email="jane@globex.com", password="secret-pass", company=other)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/rest/v1/company").json()["name"], "Globex")
+
+    def test_request_without_user_falls_back_to_first_company(self):
+        self.assertEqual(self.client.get("/rest/v1/company").json()["name"], "Acme")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CompanyLogoTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Acme")
+        self.storage = Company._meta.get_field("logo").storage
+        self.stored = []
+
+    def tearDown(self):
+        for name in self.stored:
+            self.storage.delete(name)
+
+    def upload_logo(self, data: bytes):
+        logo = SimpleUploadedFile("logo.png", data, content_type="image/png")
+        response = self.client.post("/rest/v1/company", {"name": "Acme", "logo": logo})
+        company = Company.objects.get(id=self.company.id)
+        if company.logo:
+            self.stored += [company.logo.name] + [name for names in company.logo_variants.values() for name in names.values()]
+        return response
+
+    def test_logo_gets_resized_derivatives_served_with_ranges(self):
+        buffer = BytesIO()
+        Image.new("RGBA", (300, 150), (255, 0, 0, 128)).save(buffer, "PNG")
+        response = self.upload_logo(buffer.getvalue())
+        self.assertEqual(response.status_code, 201)
+        variants = response.json()["logo_variants"]
+        # Never upscaled past the original width
+        self.assertEqual(sorted(variants["webp"], key=int), ["64", "128", "256", "300"])
+        self.assertEqual(sorted(variants), ["png", "webp"])
+
+        url = variants["webp"]["64"]
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        body = b"".join(response.streaming_content)
+        self.assertEqual(Image.open(BytesIO(body)).size, (64, 32))
+
+        response = self.client.get(url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 2-5/{len(body)}")
+        self.assertEqual(b"".join(response.streaming_content), body[2:6])
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f"bytes={len(body)}-").status_code, 416)
+
+    def test_invalid_logo_is_rejected(self):
+        self.assertEqual(self.upload_logo(b"not an image").status_code, 400)
+
+    def test_private_media_is_not_served(self):
+        name = self.storage.save("knowledge/secret.txt", ContentFile(b"private"))
+        self.stored.append(name)
+        for path in [name, f"company_logos/../{name}", f"company_logos/%2e%2e/{name}", f"company_logos/./../{name}", "company_logos/../../manage.py"]:
+            self.assertEqual(self.client.get(f"/media/{path}").status_code, 404, path)
@@ -0,0 +1,12 @@
+"""Per-connection database setup."""
+
+from django.conf import settings
+
+
+def configure_connection(sender, connection, **kwargs):
+    """Apply `SQLITE_PRAGMAS` to a new SQLite connection (connected to `connection_created`)."""
+    if connection.vendor != "sqlite" or not settings.SQLITE_PRAGMAS:
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,71 @@
+"""Resized derivatives of uploaded images (company logos, profile pictures).
+
+An upload is decoded once and re-encoded at each of `IMAGE_DERIVATIVE_WIDTHS` (never
+upscaled) in each of `IMAGE_DERIVATIVE_FORMATS`. Each derivative is named after the
+hash of its bytes, so it never changes under its URL and can be cached forever, and
+identical derivatives are stored once. Models keep the names in a JSON field shaped
+`{format: {width: name}}`, see `derivative_urls` for what the API returns.
+"""
+
+import hashlib
+from io import BytesIO
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Formats without an alpha channel get RGB
+ALPHA_FORMATS = {"webp", "png"}
+
+
+class ImageError(ValueError):
+    pass
+
+
+def _encode(image: Image.Image, format: str) -> bytes:
+    buffer = BytesIO()
+    if format == "webp":
+        image.save(buffer, "WEBP", quality=settings.IMAGE_DERIVATIVE_QUALITY, method=6)
+    elif format == "png":
+        image.save(buffer, "PNG", optimize=True)
+    else:
+        image.save(buffer, format.upper(), quality=settings.IMAGE_DERIVATIVE_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def create_derivatives(upload, storage, directory: str) -> Dict[str, Dict[str, str]]:
+    """Store the derivatives of an uploaded image under `directory` and return their names.
+
+    Raises ImageError if the upload isn't an image Pillow can decode.
+    """
+    try:
+        with Image.open(upload) as source:
+            source.load()
+            image = ImageOps.exif_transpose(source)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ImageError("Not a valid image") from e
+    finally:
+        # The original is saved too
+        upload.seek(0)
+
+    widths = sorted({min(width, image.width) for width in settings.IMAGE_DERIVATIVE_WIDTHS})
+    variants = {}
+    for format in settings.IMAGE_DERIVATIVE_FORMATS:
+        mode = "RGBA" if format in ALPHA_FORMATS and image.mode in ("RGBA", "LA", "P") else "RGB"
+        converted = image.convert(mode)
+        variants[format] = {}
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = converted if width == image.width else converted.resize((width, height), Image.LANCZOS)
+            data = _encode(resized, format)
+            name = f"{directory.rstrip('/')}/derivatives/{hashlib.sha256(data).hexdigest()[:24]}.{format}"
+            if not storage.exists(name):
+                storage.save(name, ContentFile(data))
+            variants[format][str(width)] = name
+    return variants
+
+
+def derivative_urls(variants: Optional[dict], storage) -> Dict[str, Dict[str, str]]:
+    """`{format: {width: url}}` for the stored derivative names of an image."""
+    return {format: {width: storage.url(name) for width, name in names.items()} for format, names in (variants or {}).items()}
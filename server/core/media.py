@@ -0,0 +1,134 @@
+"""Serving public media (logos, profile pictures) from the local filesystem storage.
+
+Only paths under `MEDIA_PUBLIC_PREFIXES` are served; uploaded knowledge files stay
+private. Image derivatives are named after their content, so they're cacheable forever.
+
+With `MEDIA_ACCEL_REDIRECT_PREFIX` set, the response only names the file in an
+`X-Accel-Redirect` header and nginx sends it (ranges included) with sendfile. Otherwise
+the file goes out as a FileResponse, which WSGI servers hand to `wsgi.file_wrapper`
+(sendfile under gunicorn); a `Range` request gets a 206 of a file view limited to the
+range, which keeps the file descriptor so the wrapper can still sendfile it.
+"""
+
+import mimetypes
+import os
+import posixpath
+import re
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags
+
+from .storage import PublicMediaStorage
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class FileRange:
+    """File-like view of `length` bytes of an open file, from its current position."""
+
+    def __init__(self, file, length: int):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive `(start, end)` of a single byte range, None to send the whole file.
+
+    Raises ValueError if the range lies past the end of the file. Multiple ranges are
+    answered with the whole file, which clients must accept.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def public_media_path(path: str) -> Optional[str]:
+    """The file of a public media path, None if it isn't one (or climbs out of one)."""
+    # Checked on the normalized path, or company_logos/../knowledge/ would pass
+    if ".." in path.split("/") or "\\" in path:
+        return None
+    path = posixpath.normpath(path)
+    prefix = next((prefix for prefix in settings.MEDIA_PUBLIC_PREFIXES if path.startswith(prefix)), None)
+    if prefix is None:
+        return None
+    storage = PublicMediaStorage()
+    try:
+        full_path = os.path.realpath(storage.path(path))
+    except SuspiciousFileOperation:
+        return None
+    # And the file must still be under the prefix once symlinks are resolved
+    if not full_path.startswith(os.path.realpath(storage.path(prefix)) + os.sep):
+        return None
+    return full_path
+
+
+def serve_media(request, path: str):
+    full_path = public_media_path(path)
+    if full_path is None:
+        raise Http404
+    path = posixpath.normpath(path)
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": IMMUTABLE if "/derivatives/" in path else f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}",
+    }
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        return HttpResponseNotModified(headers=headers)
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+
+    if settings.MEDIA_ACCEL_REDIRECT_PREFIX:
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + path
+        return response
+
+    byte_range = None
+    # A range of an older version of the file would be garbage, If-Range asks for all of it then
+    if request.headers.get("Range") and request.headers.get("If-Range", etag) == etag:
+        try:
+            byte_range = parse_range(request.headers["Range"], stat.st_size)
+        except ValueError:
+            return HttpResponse(status=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+
+    file = open(full_path, "rb")
+    if byte_range is None:
+        return FileResponse(file, content_type=content_type, headers=headers)
+    start, end = byte_range
+    file.seek(start)
+    response = FileResponse(FileRange(file, end - start + 1), status=206, content_type=content_type, headers=headers)
+    response["Content-Length"] = str(end - start + 1)
+    response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    return response
@@ -1,13 +1,145 @@
-from django.shortcuts import get_object_or_404
-from web_auth.models import User
-from company.models import Company
+import math
+import re
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.functional import SimpleLazyObject
+
+from bot.domains import aget_domain_matcher, get_domain_matcher, is_origin_allowed, request_host
+
+from .ratelimit import client_ip, get_rate_limiter
+from .tenants import resolve_company
+
 
 class CompanyMiddleware:
+    """Sets `request.company`, resolved (from the tenant cache) on first access only.
+
+    Async views can't trigger the lazy lookup, they use `core.tenants.aresolve_company`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        request.company = Company.objects.first() # TODO: REMOVE LATER
-        # if hasattr(request, 'user') and request.user.is_authenticated:
-        #     request.company = get_object_or_404(Company, users=request.user)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.company = SimpleLazyObject(lambda: resolve_company(request))
         return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.company = SimpleLazyObject(lambda: resolve_company(request))
+        return await self.get_response(request)
+
+
+class OriginMiddleware:
+    """Rejects widget requests from origins outside the bot's whitelisted domains.
+
+    Applies to the paths in `BOT_ORIGIN_CHECKED_PATHS`, whose `bot_id` group names the bot.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = [re.compile(path) for path in settings.BOT_ORIGIN_CHECKED_PATHS]
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _bot_id(self, request):
+        for path in self.paths:
+            match = path.match(request.path_info)
+            if match:
+                return match.group("bot_id")
+        return None
+
+    def _valid_bot_id(self, request):
+        bot_id = self._bot_id(request)
+        if bot_id is None:
+            return None
+        try:
+            return uuid.UUID(bot_id)
+        except ValueError:
+            return None  # Not a bot, the view answers with a 404
+
+    def _check(self, request, bot_id, matcher):
+        if not is_origin_allowed(matcher, request_host(request)):
+            return JsonResponse({"error": "Origin not allowed"}, status=403)
+        # For RateLimitMiddleware
+        request.widget_bot_id = bot_id
+        request.widget_company_id = matcher.company_id
+        return None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        bot_id = self._valid_bot_id(request)
+        if bot_id:
+            rejected = self._check(request, bot_id, get_domain_matcher(bot_id))
+            if rejected:
+                return rejected
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        bot_id = self._valid_bot_id(request)
+        if bot_id:
+            rejected = self._check(request, bot_id, await aget_domain_matcher(bot_id))
+            if rejected:
+                return rejected
+        return await self.get_response(request)
+
+
+class RateLimitMiddleware:
+    """Limits widget requests per (bot, client IP), with backoff for repeat offenders, and
+    per company of the bot. Answers 429 with `Retry-After` when a limit is hit.
+
+    Runs after OriginMiddleware, which identifies the bot, so a check needs no query.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _keys(self, request):
+        bot_id = getattr(request, "widget_bot_id", None)
+        if bot_id is None or not settings.RATE_LIMIT_ENABLED:
+            return []
+        keys = [(f"bot-ip:{bot_id}:{client_ip(request)}", settings.RATE_LIMIT_BOT_IP, True)]
+        if request.widget_company_id is not None:
+            # No backoff, one abusive client mustn't lock out a company's other visitors
+            keys.append((f"company:{request.widget_company_id}", settings.RATE_LIMIT_COMPANY, False))
+        return keys
+
+    def _too_many(self, wait: float) -> JsonResponse:
+        response = JsonResponse({"error": "Too many requests"}, status=429)
+        response["Retry-After"] = str(math.ceil(wait))
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        limiter = get_rate_limiter()
+        for key, limit, backoff in self._keys(request):
+            wait = limiter.check(key, limit, backoff)
+            if wait:
+                return self._too_many(wait)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        limiter = get_rate_limiter()
+        for key, limit, backoff in self._keys(request):
+            wait = await limiter.acheck(key, limit, backoff)
+            if wait:
+                return self._too_many(wait)
+        return await self.get_response(request)
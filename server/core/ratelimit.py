@@ -0,0 +1,162 @@
+"""Request rate limits for the widget endpoints.
+
+A limit is `(requests, seconds)`. The limiter is configured with the `RATE_LIMIT_BACKEND`
+setting (a dotted path):
+
+- `LocalRateLimiter` keeps a token bucket per key in process memory, so a check is a
+  dict lookup and some arithmetic. Each worker process enforces the limit on its own.
+- `CacheRateLimiter` keeps a sliding window counter per key in the shared cache, so the
+  limit holds across workers, for two cache round trips per allowed request.
+
+Keys limited with `backoff` are blocked for the wait doubled at each repeated
+violation (up to `RATE_LIMIT_MAX_BACKOFF` seconds), until they have behaved for
+`RATE_LIMIT_STRIKE_TTL` seconds.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .cache import LocalTTLCache
+
+Limit = Tuple[int, float]
+
+
+def _backoff(wait: float, strikes: int) -> float:
+    return min(max(wait, 1.0) * 2 ** (strikes - 1), settings.RATE_LIMIT_MAX_BACKOFF)
+
+
+def client_ip(request) -> str:
+    """The client address, taken from `X-Forwarded-For` behind `RATE_LIMIT_PROXY_COUNT` proxies."""
+    if settings.RATE_LIMIT_PROXY_COUNT:
+        forwarded = [part.strip() for part in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if part.strip()]
+        if len(forwarded) >= settings.RATE_LIMIT_PROXY_COUNT:
+            return forwarded[-settings.RATE_LIMIT_PROXY_COUNT]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+class RateLimiter:
+    """Base class for rate limiters."""
+
+    def check(self, key: str, limit: Limit, backoff: bool = False) -> float:
+        """Count a request against `key`. Returns 0 if it is allowed, else the seconds to wait."""
+        raise NotImplementedError
+
+    async def acheck(self, key: str, limit: Limit, backoff: bool = False) -> float:
+        return self.check(key, limit, backoff)
+
+
+class LocalRateLimiter(RateLimiter):
+    def __init__(self):
+        self.buckets = OrderedDict()  # key -> [tokens, last refill]
+        self.lock = threading.Lock()
+        self.penalties = LocalTTLCache(maxsize=settings.RATE_LIMIT_LOCAL_KEYS, ttl=settings.RATE_LIMIT_STRIKE_TTL)
+
+    def _take(self, key: str, limit: Limit) -> float:
+        requests, seconds = limit
+        rate = requests / seconds
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [float(requests), now]
+                # Evicting an idle key only forgets a bucket that had refilled anyway
+                if len(self.buckets) > settings.RATE_LIMIT_LOCAL_KEYS:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            tokens = min(float(requests), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    def check(self, key: str, limit: Limit, backoff: bool = False) -> float:
+        now = time.time()
+        penalty = self.penalties.get(key) if backoff else None
+        if penalty is not None and penalty[0] > now:
+            return penalty[0] - now
+        wait = self._take(key, limit)
+        if wait and backoff:
+            strikes = penalty[1] + 1 if penalty else 1
+            wait = _backoff(wait, strikes)
+            self.penalties.set(key, (now + wait, strikes), ttl=wait + settings.RATE_LIMIT_STRIKE_TTL)
+        return wait
+
+
+class CacheRateLimiter(RateLimiter):
+    """Sliding window counter: this window's count plus the previous window's, weighted by
+    how much of it still overlaps the last `seconds`."""
+
+    def _keys(self, key: str, seconds: float, now: float) -> Tuple[str, str, str]:
+        window = int(now // seconds)
+        return f"ratelimit:{key}:{window}", f"ratelimit:{key}:{window - 1}", f"ratelimit-penalty:{key}"
+
+    def _wait(self, limit: Limit, now: float, current: int, previous: int) -> float:
+        requests, seconds = limit
+        elapsed = now % seconds / seconds
+        if previous * (1 - elapsed) + current + 1 <= requests:
+            return 0.0
+        if current + 1 > requests:
+            # Wait for the next window, and for this one to weigh little enough in it
+            return (1 - elapsed) * seconds + max(0.0, 1 - (requests - 1) / current) * seconds
+        return (1 - (requests - 1 - current) / previous - elapsed) * seconds
+
+    def _penalty(self, wait: float, penalty: Optional[tuple], now: float) -> Tuple[float, tuple, float]:
+        strikes = penalty[1] + 1 if penalty else 1
+        wait = _backoff(wait, strikes)
+        return wait, (now + wait, strikes), wait + settings.RATE_LIMIT_STRIKE_TTL
+
+    def check(self, key: str, limit: Limit, backoff: bool = False) -> float:
+        now = time.time()
+        current_key, previous_key, penalty_key = self._keys(key, limit[1], now)
+        values = cache.get_many([current_key, previous_key, penalty_key])
+        penalty = values.get(penalty_key) if backoff else None
+        if penalty is not None and penalty[0] > now:
+            return penalty[0] - now
+        wait = self._wait(limit, now, values.get(current_key, 0), values.get(previous_key, 0))
+        if not wait:
+            timeout = int(2 * limit[1]) + 1
+            if not cache.add(current_key, 1, timeout=timeout):
+                try:
+                    cache.incr(current_key)
+                except ValueError:
+                    # Expired since the add
+                    cache.set(current_key, 1, timeout=timeout)
+        elif backoff:
+            wait, penalty, ttl = self._penalty(wait, penalty, now)
+            cache.set(penalty_key, penalty, timeout=int(ttl) + 1)
+        return wait
+
+    async def acheck(self, key: str, limit: Limit, backoff: bool = False) -> float:
+        now = time.time()
+        current_key, previous_key, penalty_key = self._keys(key, limit[1], now)
+        values = await cache.aget_many([current_key, previous_key, penalty_key])
+        penalty = values.get(penalty_key) if backoff else None
+        if penalty is not None and penalty[0] > now:
+            return penalty[0] - now
+        wait = self._wait(limit, now, values.get(current_key, 0), values.get(previous_key, 0))
+        if not wait:
+            timeout = int(2 * limit[1]) + 1
+            if not await cache.aadd(current_key, 1, timeout=timeout):
+                try:
+                    await cache.aincr(current_key)
+                except ValueError:
+                    await cache.aset(current_key, 1, timeout=timeout)
+        elif backoff:
+            wait, penalty, ttl = self._penalty(wait, penalty, now)
+            await cache.aset(penalty_key, penalty, timeout=int(ttl) + 1)
+        return wait
+
+
+@lru_cache(maxsize=None)
+def get_rate_limiter() -> RateLimiter:
+    return import_string(settings.RATE_LIMIT_BACKEND)()
@@ -0,0 +1,75 @@
+"""Media on S3, or an S3-compatible service such as MinIO or moto server (`AWS_S3_ENDPOINT_URL`).
+
+Only imported with `USE_S3`, so django-storages and boto3 aren't needed otherwise.
+
+Uploads are streamed from their file object with boto3's managed transfer: past
+`AWS_S3_MULTIPART_THRESHOLD` bytes they're sent in multipart parts of
+`AWS_S3_MULTIPART_CHUNKSIZE`, so only a few parts are ever in memory (Django spools
+large request uploads to disk first). One instance of each storage is shared by every
+field, so a thread reuses its clients and their pools of `AWS_S3_MAX_POOL_CONNECTIONS`
+connections.
+
+Knowledge files are private: presigned URLs let clients upload and download them
+directly, without the bytes passing through Django. Logos and profile pictures are
+public, at plain URLs that don't expire while the widget and browsers cache them.
+"""
+
+from typing import Optional
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from django.conf import settings
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+
+class S3MediaStorage(S3Boto3Storage):
+    def __init__(self, **kwargs):
+        kwargs = {
+            "location": "media",
+            "file_overwrite": False,
+            "default_acl": "private",
+            "custom_domain": settings.AWS_S3_CUSTOM_DOMAIN,
+            "endpoint_url": settings.AWS_S3_ENDPOINT_URL,
+            "client_config": Config(
+                max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS,
+                retries={"max_attempts": 3, "mode": "standard"},
+                signature_version="s3v4",
+                # MinIO and moto server want path style addressing
+                s3={"addressing_style": settings.AWS_S3_ADDRESSING_STYLE},
+            ),
+            "transfer_config": TransferConfig(
+                multipart_threshold=settings.AWS_S3_MULTIPART_THRESHOLD,
+                multipart_chunksize=settings.AWS_S3_MULTIPART_CHUNKSIZE,
+                max_concurrency=settings.AWS_S3_MAX_CONCURRENCY,
+            ),
+            **kwargs,
+        }
+        super().__init__(**kwargs)
+
+    def _key(self, name: str) -> str:
+        return self._normalize_name(clean_name(name))
+
+    def presigned_upload(self, name: str, content_type: str, max_size: int, expires: Optional[int] = None) -> dict:
+        """A presigned POST (`url` and form `fields`) for uploading up to `max_size` bytes to `name`."""
+        return self.bucket.meta.client.generate_presigned_post(
+            self.bucket_name,
+            self._key(name),
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, max_size]],
+            ExpiresIn=expires or self.querystring_expire,
+        )
+
+    def presigned_download(self, name: str, filename: Optional[str] = None, expires: Optional[int] = None) -> str:
+        """A presigned GET URL of `name`, signed even with a custom domain configured."""
+        params = {"Bucket": self.bucket_name, "Key": self._key(name)}
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        return self.bucket.meta.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires or self.querystring_expire)
+
+
+class S3PublicMediaStorage(S3MediaStorage):
+    """Logos and profile pictures, readable by anyone at unsigned URLs."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**{"default_acl": settings.AWS_PUBLIC_MEDIA_ACL, "querystring_auth": False, **kwargs})
@@ -1,13 +1,31 @@
-from django.conf import settings
+from functools import lru_cache
 
-# from storages.backends.s3boto3 import S3Boto3Storage
+from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 
 
+@lru_cache(maxsize=None)
+def _s3_storage(public: bool = False):
+    # Imported here, so local storage works without boto3
+    from .s3 import S3MediaStorage, S3PublicMediaStorage
+
+    return S3PublicMediaStorage() if public else S3MediaStorage()
+
+
 class MediaStorage:
+    """Private media (knowledge files), at presigned URLs on S3."""
+
+    def __new__(cls):
+        if settings.USE_S3:
+            # Shared, so its S3 connections are too
+            return _s3_storage()
+        return FileSystemStorage(location="media")
+
+
+class PublicMediaStorage:
+    """Logos and profile pictures, at plain URLs that can be cached (see MEDIA_PUBLIC_PREFIXES)."""
+
     def __new__(cls):
         if settings.USE_S3:
-            # return S3Boto3Storage(location="media", file_overwrite=False, custom_domain=settings.AWS_S3_CUSTOM_DOMAIN, default_acl="private")
-            # Implement this when we have an S3 bucket
-            ...
+            return _s3_storage(public=True)
         return FileSystemStorage(location="media")
@@ -0,0 +1,78 @@
+"""Tenant (Company) resolution for requests.
+
+Companies are cached per process in an LRU with a TTL, backed by Django's cache so a
+miss in one process is usually a hit for the next. Saving or deleting a Company drops
+its entries (see company/signals.py); other processes pick the change up within the TTL.
+"""
+
+import copy
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from company.models import Company
+from .cache import LocalTTLCache
+
+SESSION_COMPANY_KEY = "company_id"
+
+# Key of the fallback tenant used while requests aren't tied to a company yet
+DEFAULT_KEY = "default"
+
+_companies = LocalTTLCache(maxsize=settings.TENANT_CACHE_SIZE, ttl=settings.TENANT_CACHE_TTL)
+
+
+def _cache_key(key: str) -> str:
+    return f"tenant:{key}"
+
+
+def get_company(company_id=None) -> Optional[Company]:
+    key = str(company_id) if company_id else DEFAULT_KEY
+    company = _companies.get(key)
+    if company is None:
+        company = cache.get(_cache_key(key))
+        if company is None:
+            company = Company.objects.filter(id=company_id).first() if company_id else Company.objects.first()
+            if company is None:
+                return None
+            cache.set(_cache_key(key), company, settings.TENANT_CACHE_TTL)
+        _companies.set(key, company)
+    # Callers may modify and save their company, so they never get the cached instance
+    return copy.copy(company)
+
+
+def invalidate_company(company_id):
+    for key in (str(company_id), DEFAULT_KEY):
+        _companies.delete(key)
+    cache.delete_many([_cache_key(str(company_id)), _cache_key(DEFAULT_KEY)])
+
+
+def remember_company(request, user):
+    """Store the company of a user who just logged in, so requests resolve it without loading the user."""
+    if user.company_id:
+        request.session[SESSION_COMPANY_KEY] = str(user.company_id)
+    else:
+        request.session.pop(SESSION_COMPANY_KEY, None)
+
+
+def resolve_company(request) -> Optional[Company]:
+    """The company of the session user, falling back to the default tenant."""
+    company_id = None
+    session = getattr(request, "session", None)
+    if session is not None:
+        company_id = session.get(SESSION_COMPANY_KEY)
+        if company_id is None:
+            user = getattr(request, "user", None)
+            if user is not None and user.is_authenticated and user.company_id:
+                company_id = str(user.company_id)
+                session[SESSION_COMPANY_KEY] = company_id
+
+    company = get_company(company_id) if company_id else None
+    # TODO: REMOVE LATER, requests without a company fall back to the first one
+    return company or get_company()
+
+
+async def aresolve_company(request) -> Optional[Company]:
+    """`resolve_company` for async views, where the lazy `request.company` can't hit the DB."""
+    return await sync_to_async(resolve_company)(request)
@@ -1,7 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 import uuid
-from core.storage import MediaStorage
+from core.storage import PublicMediaStorage
 from django.utils.translation import gettext_lazy as _
 
 
@@ -18,11 +18,13 @@ class User(AbstractUser):
         blank=True
     )
     profile_picture = models.ImageField(
-        storage=MediaStorage(),
+        storage=PublicMediaStorage(),
         upload_to='profile_pictures/',
         null=True,
         blank=True
     )
+    # Resized copies of the profile picture, see core/images.py
+    profile_picture_variants = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
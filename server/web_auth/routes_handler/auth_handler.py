@@ -1,11 +1,13 @@
 from ninja import Router, File
 from ninja.files import UploadedFile
 from ninja.schema import Schema
-from typing import Optional
+from typing import Dict, Optional
 from django.contrib.auth import authenticate, login, logout
 from django.http import HttpRequest
 from ..models import User
 from company.models import Company
+from core.images import ImageError, create_derivatives, derivative_urls
+from core.tenants import remember_company
 import uuid
 
 router = Router()
@@ -33,6 +35,8 @@ class UserResponseSchema(Schema):
     last_name: Optional[str] = None
     company_id: Optional[str] = None
     profile_picture_url: Optional[str] = None
+    # {format: {width: url}}
+    profile_picture_variants: Dict[str, Dict[str, str]] = {}
 
 
 @router.post("/register", response={201: UserResponseSchema, 400: dict})
@@ -40,6 +44,14 @@ def register_user(request, data: UserCreateSchema, profile_picture: Optional[Upl
     # Check if user with this email already exists
     if User.objects.filter(email=data.email).exists():
         return 400, {"detail": "User with this email already exists"}
+
+    # Resize the profile picture first, so an invalid image doesn't leave a user behind
+    profile_picture_variants = {}
+    if profile_picture:
+        try:
+            profile_picture_variants = create_derivatives(profile_picture, User._meta.get_field("profile_picture").storage, "profile_pictures")
+        except ImageError as e:
+            return 400, {"detail": str(e)}
     
     # Create new user
     user = User.objects.create_user(
@@ -64,10 +76,12 @@ def register_user(request, data: UserCreateSchema, profile_picture: Optional[Upl
     # Add profile picture if provided
     if profile_picture:
         user.profile_picture = profile_picture
+        user.profile_picture_variants = profile_picture_variants
         user.save()
     
     # Log the user in
     login(request, user)
+    remember_company(request, user)
     
     return 201, {
         "id": str(user.id),
@@ -77,6 +91,7 @@ def register_user(request, data: UserCreateSchema, profile_picture: Optional[Upl
         "last_name": user.last_name,
         "company_id": str(user.company.id) if user.company else None,
         "profile_picture_url": user.profile_picture.url if user.profile_picture else None,
+        "profile_picture_variants": derivative_urls(user.profile_picture_variants, user.profile_picture.storage),
     }
 
 
@@ -88,6 +103,7 @@ def login_user(request, data: UserLoginSchema):
         return 401, {"detail": "Invalid credentials"}
     
     login(request, user)
+    remember_company(request, user)
     
     return 200, {
         "id": str(user.id),
@@ -97,6 +113,7 @@ def login_user(request, data: UserLoginSchema):
         "last_name": user.last_name,
         "company_id": str(user.company.id) if user.company else None,
         "profile_picture_url": user.profile_picture.url if user.profile_picture else None,
+        "profile_picture_variants": derivative_urls(user.profile_picture_variants, user.profile_picture.storage),
     }
 
 
@@ -121,4 +138,5 @@ def get_current_user(request: HttpRequest):
         "last_name": user.last_name,
         "company_id": str(user.company.id) if user.company else None,
         "profile_picture_url": user.profile_picture.url if user.profile_picture else None,
+        "profile_picture_variants": derivative_urls(user.profile_picture_variants, user.profile_picture.storage),
     }